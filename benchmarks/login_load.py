@@ -0,0 +1,98 @@
+"""
+Пропускная способность логина и задержка отчетов при смешанной нагрузке.
+Сначала отчеты замеряются без логинов, затем вместе с потоками, которые непрерывно логинятся.
+
+    PYTHONPATH=./src python benchmarks/login_load.py --login-threads 8 --report-threads 2
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(app, login_threads, report_threads, duration):
+    stop = threading.Event()
+    report_latencies = []
+    login_statuses = []
+
+    def report_worker():
+        client = app.test_client()
+        client.post('/auth/login', json={'email': 'bench@example.com', 'password': 'password1'})
+        while not stop.is_set():
+            started_at = time.perf_counter()
+            client.get('/report?page_size=50')
+            report_latencies.append((time.perf_counter() - started_at) * 1000)
+
+    def login_worker():
+        client = app.test_client()
+        while not stop.is_set():
+            response = client.post('/auth/login', json={'email': 'bench@example.com', 'password': 'password1'})
+            login_statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=report_worker) for _ in range(report_threads)]
+    threads += [threading.Thread(target=login_worker) for _ in range(login_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    logins = sum(1 for status in login_statuses if status == 200)
+    shed = sum(1 for status in login_statuses if status == 503)
+    return {
+        'logins_per_second': logins / duration,
+        'shed': shed,
+        'report_p50': statistics.median(report_latencies) if report_latencies else 0,
+        'report_p95': percentile(report_latencies, 0.95),
+        'reports': len(report_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--login-threads', type=int, default=8)
+    parser.add_argument('--report-threads', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['DB_CONNECTION'] = os.path.join(directory, 'bench.db')
+        from app import create_app
+        from database import db
+        from services.operations import OperationsService
+        from services.passwords import hasher
+
+        app = create_app()
+        with app.app_context(), db.connection as connection:
+            connection.execute(
+                'INSERT INTO user(first_name, last_name, email, password) VALUES (?, ?, ?, ?)',
+                ('Bench', 'User', 'bench@example.com', hasher.generate('password1')),
+            )
+            service = OperationsService(connection)
+            for i in range(1000):
+                service.create_operation({'id': 1}, {'type': 'expenses', 'amount': -1, 'description': f'#{i}'})
+
+        print(f'hash method {hasher.method}, workers {app.config["PASSWORD_HASH_WORKERS"]}, '
+              f'queue {app.config["PASSWORD_HASH_QUEUE_SIZE"]}')
+        for login_threads in (0, args.login_threads):
+            result = run(app, login_threads, args.report_threads, args.duration)
+            print(
+                f'login threads {login_threads:>3}: '
+                f'{result["logins_per_second"]:7.1f} logins/s, {result["shed"]:5} shed, '
+                f'report p50 {result["report_p50"]:6.1f} ms, p95 {result["report_p95"]:6.1f} ms '
+                f'({result["reports"]} reports)'
+            )
+
+
+if __name__ == '__main__':
+    main()
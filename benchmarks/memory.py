@@ -0,0 +1,175 @@
+"""
+Память горячих путей сервисов на данных растущего размера (tracemalloc): пик и остаток после вызова,
+всего и на строку. Рост пика на строку между наименьшим и наибольшим размером сравнивается с бюджетом,
+при превышении скрипт завершается с ошибкой.
+
+    PYTHONPATH=./src python benchmarks/memory.py --sizes 1000,5000,20000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+from create_db import create_db
+from services import report_cache
+from services.categories import CategoriesService
+from services.operations import OperationsService
+from services.reports import ReportService
+
+# Бюджет роста пика в байтах на строку (операцию отчета или категорию), для create_operation - роста остатка на вызов
+BUDGETS = {
+    'get_report': int(os.getenv('MEMORY_BUDGET_GET_REPORT', 1500)),
+    'get_report + json': int(os.getenv('MEMORY_BUDGET_GET_REPORT_JSON', 4000)),
+    'get_categories': int(os.getenv('MEMORY_BUDGET_GET_CATEGORIES', 800)),
+    'create_operation': int(os.getenv('MEMORY_BUDGET_CREATE_OPERATION', 64)),
+}
+WORDS = ['кофе', 'такси', 'аренда', 'зарплата', 'продукты', 'аптека', 'кино', 'бензин', 'подписка', 'ресторан']
+CREATE_CALLS = 1000
+
+
+def seed(connection, rows, categories):
+    random.seed(0)
+    connection.execute(
+        'INSERT INTO user(id, first_name, last_name, email, password) '
+        "VALUES (1, 'Bench', 'User', 'bench@example.com', '')"
+    )
+    category_rows = []
+    for category_id in range(1, categories + 1):
+        parent_id = random.randint(1, category_id - 1) if category_id > 3 else None
+        path = str(category_id).zfill(8)
+        if parent_id is not None:
+            path = category_rows[parent_id - 1][4] + '.' + path
+        category_rows.append((category_id, f'Категория {category_id}', parent_id, 1, path))
+    connection.executemany('INSERT INTO category VALUES (?, ?, ?, ?, ?)', category_rows)
+
+    operation_rows = []
+    for operation_id in range(1, rows + 1):
+        date = f'2023-{random.randint(1, 12):02}-{random.randint(1, 28):02}T12:00:00'
+        operation_rows.append((
+            operation_id,
+            'expenses',
+            -random.randint(100, 100000),
+            ' '.join(random.choices(WORDS, k=3)),
+            random.randint(1, categories),
+            date,
+            date,
+            1,
+        ))
+    connection.executemany('INSERT INTO operation VALUES (?, ?, ?, ?, ?, ?, ?, ?)', operation_rows)
+    connection.commit()
+
+
+def measure(call):
+    """
+    Память вызова
+    :param call: Функция без аргументов
+    :return: Пик во время вызова и остаток после него (результат вызова уже удален), в байтах
+    """
+    gc.collect()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    result = call()
+    _, peak = tracemalloc.get_traced_memory()
+    del result
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    return peak - before, after - before
+
+
+def run_size(rows):
+    """
+    Замеры на наборе данных из rows операций и rows / 20 категорий
+    :return: Словарь: путь -> (количество строк, пик, остаток)
+    """
+    categories = max(rows // 20, 10)
+    results = {}
+    # Отчеты прошлого набора данных не должны занимать память и вытесняться во время замеров этого
+    report_cache._entries.clear()
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench.db')
+        create_db(SimpleNamespace(config={'DB_CONNECTION': database}))
+        connection = sqlite3.connect(database)
+        connection.row_factory = sqlite3.Row
+        seed(connection, rows, categories)
+        qs = {'from': '2023-01-01T00:00:00', 'to': '2024-01-01T00:00:00', 'page_size': str(rows)}
+
+        report_service = ReportService(connection)
+        # Первый вызов прогревает кэш отчетов и импорты, в замер не идет
+        report_service.get_report(1, dict(qs))
+        results['get_report'] = (rows, *measure(lambda: report_service.get_report(1, dict(qs))))
+        results['get_report + json'] = (
+            rows,
+            *measure(lambda: json.dumps(report_service.get_report(1, dict(qs))).encode()),
+        )
+
+        categories_service = CategoriesService(connection)
+        categories_service.get_categories(1)
+        results['get_categories'] = (categories, *measure(lambda: categories_service.get_categories(1)))
+
+        operations_service = OperationsService(connection)
+
+        def create_operations(calls):
+            for i in range(calls):
+                operations_service.create_operation({'id': 1}, {
+                    'type': 'expenses',
+                    'amount': -1.5,
+                    'description': f'memory {i}',
+                    'category_id': i % categories + 1,
+                    'operation_date': '2023-06-01T12:00:00',
+                })
+                connection.commit()
+
+        create_operations(CREATE_CALLS)
+        results['create_operation'] = (CREATE_CALLS, *measure(lambda: create_operations(CREATE_CALLS)))
+        results['create_operation x2'] = (2 * CREATE_CALLS, *measure(lambda: create_operations(2 * CREATE_CALLS)))
+        connection.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,5000,20000', help='Количества операций через запятую.')
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    tracemalloc.start()
+    by_size = {size: run_size(size) for size in sizes}
+    tracemalloc.stop()
+
+    print(f'{"path":<20}{"operations":>11}{"rows":>8}{"peak, KB":>11}{"retained, KB":>14}{"peak/row, B":>13}')
+    for size, results in by_size.items():
+        for path, (rows, peak, retained) in results.items():
+            print(f'{path:<20}{size:>11}{rows:>8}{peak / 1024:>11.0f}{retained / 1024:>14.1f}{peak / rows:>13.0f}')
+
+    print(f'\n{"path":<20}{"growth/row, B":>15}{"budget, B":>11}')
+    exceeded = []
+    smallest, largest = by_size[sizes[0]], by_size[sizes[-1]]
+    for path, budget in BUDGETS.items():
+        rows_small, peak_small, _ = smallest[path]
+        rows_large, peak_large, retained_large = largest[path]
+        if path == 'create_operation':
+            # Размер данных на вызов не влияет, поэтому сравнивается рост остатка между пачками
+            # из N и 2N вызовов: утечка растет с количеством вызовов, а заполнение кэшей sqlite3 - нет
+            calls_double, _, retained_double = largest['create_operation x2']
+            growth = (retained_double - retained_large) / (calls_double - rows_large)
+        elif rows_large == rows_small:
+            growth = peak_large / rows_large
+        else:
+            growth = (peak_large - peak_small) / (rows_large - rows_small)
+        print(f'{path:<20}{growth:>15.0f}{budget:>11}')
+        if growth > budget:
+            exceeded.append(path)
+
+    if exceeded:
+        print(f'Memory budget exceeded: {", ".join(exceeded)}.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Размер ответа и время сжатия для отчета за год и дерева категорий по каждой доступной кодировке.
+zstd и br измеряются, если установлены zstandard и brotli.
+
+    PYTHONPATH=./src python benchmarks/response_compression.py --rows 50000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from types import SimpleNamespace
+
+from compression import compress, compress_stream, get_encoders
+from create_db import create_db
+from services.categories import CategoriesService
+from services.reports import ReportService
+
+LEVELS = {
+    'gzip': (1, 6, 9),
+    'zstd': (1, 3, 9),
+    'br': (1, 4, 9),
+}
+WORDS = ['кофе', 'такси', 'аренда', 'зарплата', 'продукты', 'аптека', 'кино', 'бензин', 'подписка', 'ресторан']
+CHUNK_SIZE = 64 * 1024
+
+
+def seed(connection, rows, categories):
+    random.seed(0)
+    connection.execute(
+        'INSERT INTO user(id, first_name, last_name, email, password) '
+        "VALUES (1, 'Bench', 'User', 'bench@example.com', '')"
+    )
+    category_rows = []
+    for category_id in range(1, categories + 1):
+        parent_id = random.randint(1, category_id - 1) if category_id > 3 else None
+        path = str(category_id).zfill(8)
+        if parent_id is not None:
+            path = category_rows[parent_id - 1][4] + '.' + path
+        category_rows.append((category_id, f'Категория {category_id}', parent_id, 1, path))
+    connection.executemany('INSERT INTO category VALUES (?, ?, ?, ?, ?)', category_rows)
+
+    operation_rows = []
+    for operation_id in range(1, rows + 1):
+        date = f'2023-{random.randint(1, 12):02}-{random.randint(1, 28):02}T12:00:00'
+        operation_rows.append((
+            operation_id,
+            'expenses',
+            -random.randint(100, 100000),
+            ' '.join(random.choices(WORDS, k=3)),
+            random.randint(1, categories),
+            date,
+            date,
+            1,
+        ))
+    connection.executemany('INSERT INTO operation VALUES (?, ?, ?, ?, ?, ?, ?, ?)', operation_rows)
+    connection.commit()
+
+
+def measure(encoder_class, level, data, repeat, stream):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        encoder = encoder_class(level)
+        if stream:
+            chunks = (data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE))
+            compressed = b''.join(compress_stream(encoder, chunks))
+        else:
+            compressed = compress(encoder, data)
+    return len(compressed), (time.perf_counter() - started_at) / repeat * 1000
+
+
+def report(name, data, repeat):
+    print(f'\n{name}: {len(data)} bytes')
+    print(f'{"encoding":<10}{"level":>6}{"bytes":>12}{"ratio":>8}{"ms":>10}{"MB/s":>9}{"stream ms":>11}')
+    for encoding, encoder_class in get_encoders().items():
+        for level in LEVELS[encoding]:
+            size, ms = measure(encoder_class, level, data, repeat, stream=False)
+            _, stream_ms = measure(encoder_class, level, data, repeat, stream=True)
+            speed = len(data) / 1024 / 1024 / (ms / 1000)
+            print(f'{encoding:<10}{level:>6}{size:>12}{len(data) / size:>8.1f}{ms:>10.1f}{speed:>9.0f}{stream_ms:>11.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench.db')
+        create_db(SimpleNamespace(config={'DB_CONNECTION': database}))
+        connection = sqlite3.connect(database)
+        connection.row_factory = sqlite3.Row
+        seed(connection, args.rows, args.categories)
+
+        report_body = ReportService(connection).get_report(1, {
+            'from': '2023-01-01T00:00:00',
+            'to': '2024-01-01T00:00:00',
+            'page_size': str(args.rows),
+        })
+        categories_service = CategoriesService(connection)
+        categories_body = categories_service.make_tree(categories_service.get_categories(1))
+        connection.close()
+
+    report(f'GET /report ({args.rows} operations)', json.dumps(report_body).encode(), args.repeat)
+    report(f'GET /categories?format=tree ({args.categories} categories)', json.dumps(categories_body).encode(), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
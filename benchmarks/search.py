@@ -0,0 +1,84 @@
+"""
+Сравнение поиска по описаниям операций через FTS5 и через LIKE '%term%'.
+
+    PYTHONPATH=./src python benchmarks/search.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from types import SimpleNamespace
+
+from create_db import create_db
+from services.search import make_match_query
+
+WORDS = [
+    'кофе', 'кофейня', 'такси', 'аренда', 'зарплата', 'продукты', 'аптека', 'кино', 'бензин',
+    'подписка', 'интернет', 'телефон', 'ресторан', 'подарок', 'книги', 'одежда', 'спорт', 'отпуск',
+]
+
+
+def seed(connection, rows, users):
+    random.seed(0)
+    batch = []
+    for i in range(1, rows + 1):
+        description = ' '.join(random.choices(WORDS, k=3)) + f' #{i}'
+        batch.append((i, 'expenses', -100, description, '2020-01-01T00:00:00', '2020-01-01T00:00:00', i % users + 1))
+        if len(batch) == 10000:
+            connection.executemany('INSERT INTO operation VALUES (?, ?, ?, ?, NULL, ?, ?, ?)', batch)
+            batch.clear()
+    connection.executemany('INSERT INTO operation VALUES (?, ?, ?, ?, NULL, ?, ?, ?)', batch)
+    connection.execute(
+        'INSERT INTO operation_search(rowid, description, user_id) '
+        'SELECT id, description, user_id FROM operation'
+    )
+    connection.commit()
+
+
+def measure(connection, query, params, repeat):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        count = connection.execute(query, params).fetchone()[0]
+    return (time.perf_counter() - started_at) / repeat * 1000, count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench.db')
+        create_db(SimpleNamespace(config={'DB_CONNECTION': database}))
+        connection = sqlite3.connect(database)
+        seed(connection, args.rows, args.users)
+
+        print(f'{args.rows} operations, {args.users} users')
+        print(f'{"query":<12}{"LIKE, ms":>12}{"FTS5, ms":>12}{"rows":>10}')
+        for term in ('такси', 'кофе*', 'аренда спорт'):
+            like_conditions = ' AND '.join('description LIKE ?' for _ in term.split())
+            like_params = [f'%{word.rstrip("*")}%' for word in term.split()]
+            like_ms, like_count = measure(
+                connection,
+                f'SELECT COUNT(*) FROM operation WHERE user_id = ? AND {like_conditions}',
+                [1, *like_params],
+                args.repeat,
+            )
+            fts_ms, fts_count = measure(
+                connection,
+                'SELECT COUNT(*) FROM operation '
+                'INNER JOIN operation_search ON operation_search.rowid = operation.id '
+                'WHERE operation.user_id = ? AND operation_search MATCH ?',
+                [1, make_match_query(term)],
+                args.repeat,
+            )
+            print(f'{term:<12}{like_ms:>12.1f}{fts_ms:>12.1f}{fts_count:>10}')
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Время старта воркера: от импорта приложения до первого обслуженного запроса.
+Завершается с ошибкой, если медиана превышает бюджет.
+
+    PYTHONPATH=./src python benchmarks/startup.py --budget-ms 300
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Первый запрос (вход с неизвестным email) проходит через подключение к базе и создание схемы
+CHILD = """
+import json, time
+started_at = time.perf_counter()
+from app import create_app
+app = create_app()
+imported_at = time.perf_counter()
+response = app.test_client().post('/auth/login', json={'email': 'nobody@example.com', 'password': 'password'})
+served_at = time.perf_counter()
+assert response.status_code == 422, response.status_code
+print(json.dumps({'import_ms': (imported_at - started_at) * 1000, 'total_ms': (served_at - started_at) * 1000}))
+"""
+
+
+def run_once(src_path):
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ)
+        env['PYTHONPATH'] = src_path
+        env['DB_CONNECTION'] = os.path.join(directory, 'startup.db')
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD],
+            cwd=directory,
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('STARTUP_BUDGET_MS', 300)))
+    args = parser.parse_args()
+
+    src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+    results = [run_once(src_path) for _ in range(args.runs)]
+    import_ms = statistics.median(result['import_ms'] for result in results)
+    total_ms = statistics.median(result['total_ms'] for result in results)
+
+    print(f'create_app:    {import_ms:.1f} ms (median of {args.runs})')
+    print(f'first request: {total_ms:.1f} ms (median of {args.runs}), budget {args.budget_ms:.0f} ms')
+    if total_ms > args.budget_ms:
+        print('Startup budget exceeded.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
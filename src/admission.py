@@ -0,0 +1,190 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import (
+    g,
+    jsonify,
+    request,
+    session,
+)
+
+from auth import admin_required
+from database import query_timeouts
+from services.exceptions import (
+    BadRequest,
+    ServiceError,
+    ServiceUnavailableError,
+    TooManyRequestsError,
+)
+
+MAX_BUCKETS = 10000
+
+
+class TokenBucket:
+    """
+    Ведро токенов: пополняется со скоростью rate в секунду до burst, каждый запрос забирает токен
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        """
+        Попытка забрать токен
+        :return: 0, если токен забран, иначе через сколько секунд появится следующий
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Pool:
+    """
+    Ограничение количества одновременных запросов с очередью ограниченной длины.
+    Запрос, которому не хватило места в очереди или не дождавшийся слота, сразу получает 503
+    """
+    def __init__(self, concurrency, queue_size, queue_timeout):
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._slots = threading.Semaphore(concurrency)
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Получение слота
+        :return: 'admitted', 'queue_full' или 'timed_out'
+        """
+        if self._slots.acquire(blocking=False):
+            return 'admitted'
+        with self._lock:
+            if self._waiting >= self.queue_size:
+                return 'queue_full'
+            self._waiting += 1
+        try:
+            if self._slots.acquire(timeout=self.queue_timeout):
+                return 'admitted'
+            return 'timed_out'
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def release(self):
+        self._slots.release()
+
+
+class AdmissionControl:
+    """
+    Допуск дорогих запросов (отчетов): ведро токенов на каждого пользователя, общий для группы
+    endpoint'ов лимит одновременных запросов с очередью и ограничение page_size.
+    Лишние запросы сразу получают 429 или 503 с Retry-After, вместо того чтобы занимать воркеры.
+    Лимиты задаются по endpoint'ам в ADMISSION_LIMITS и ADMISSION_POOLS и действуют в пределах процесса
+    """
+    def __init__(self, app=None):
+        self.limits = {}
+        self.pools = {}
+        self.stats = {}
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['ADMISSION_ENABLED']:
+            return
+        self.limits = app.config['ADMISSION_LIMITS']
+        self.pools = {
+            name: Pool(pool['concurrency'], pool['queue_size'], pool['queue_timeout'])
+            for name, pool in app.config['ADMISSION_POOLS'].items()
+        }
+        self.stats = {
+            endpoint: dict.fromkeys(('admitted', 'rate_limited', 'queue_full', 'timed_out', 'bad_page_size'), 0)
+            for endpoint in self.limits
+        }
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+        app.add_url_rule('/admission/stats', 'admission_stats', admin_required(self._get_stats))
+
+    def _admit(self):
+        limits = self.limits.get(request.endpoint)
+        if limits is None:
+            return None
+        try:
+            self._check(request.endpoint, limits)
+        except (TooManyRequestsError, ServiceUnavailableError) as e:
+            return e.error, e.code, {'Retry-After': str(e.retry_after)}
+        except ServiceError as e:
+            return e.error, e.code
+        return None
+
+    def _check(self, endpoint, limits):
+        """
+        Проверка запроса: page_size, ведро токенов пользователя, слот в группе
+        :param endpoint: endpoint запроса
+        :param limits: Лимиты endpoint'а
+        """
+        max_page_size = limits.get('max_page_size')
+        if max_page_size is not None:
+            page_size = request.args.get('page_size', type=int)
+            if page_size is not None and not 0 < page_size <= max_page_size:
+                self._count(endpoint, 'bad_page_size')
+                raise BadRequest(f'Page size must be from 1 to {max_page_size}.')
+
+        if 'rate' in limits:
+            key = (endpoint, session.get('user_id') or request.remote_addr)
+            with self._lock:
+                bucket = self._buckets.pop(key, None) or TokenBucket(limits['rate'], limits['burst'])
+                self._buckets[key] = bucket
+                if len(self._buckets) > MAX_BUCKETS:
+                    self._buckets.popitem(last=False)
+                wait = bucket.take()
+            if wait:
+                self._count(endpoint, 'rate_limited')
+                raise TooManyRequestsError('Too many requests, try again later.', retry_after=math.ceil(wait))
+
+        pool = self.pools.get(limits.get('pool'))
+        if pool is not None:
+            result = pool.acquire()
+            if result != 'admitted':
+                self._count(endpoint, result)
+                raise ServiceUnavailableError(
+                    'Server is busy, try again later.',
+                    retry_after=math.ceil(pool.queue_timeout) or 1,
+                )
+            g.admission_pool = pool
+        self._count(endpoint, 'admitted')
+
+    def _release(self, exception=None):
+        pool = g.pop('admission_pool', None)
+        if pool is not None:
+            pool.release()
+
+    def _count(self, endpoint, counter):
+        with self._lock:
+            self.stats[endpoint][counter] += 1
+
+    def _get_stats(self):
+        """
+        Счетчики текущего процесса: сколько запросов принято и сколько отброшено и почему,
+        а также какие запросы не уложились в срок (QUERY_DEADLINES). Доступны только администраторам
+        """
+        with self._lock:
+            stats = {endpoint: dict(counters) for endpoint, counters in self.stats.items()}
+        return jsonify({
+            'admission': stats,
+            'query_timeouts': [
+                {'endpoint': endpoint, 'query': shape, 'count': count}
+                for (endpoint, shape), count in query_timeouts.most_common()
+            ],
+        })
+
+
+admission = AdmissionControl()
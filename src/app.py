@@ -1,25 +1,42 @@
-import os
-
 from flask import Flask
 
+from admission import admission
 from blueprints.auth import bp as auth_bp
+from blueprints.batch import bp as batch_bp
+from blueprints.budgets import bp as budgets_bp
 from blueprints.categories import bp as categories_bp
 from blueprints.operations import bp as operations_bp
+from blueprints.recurring import bp as recurring_bp
 from blueprints.reports import bp as report_bp
+from blueprints.sync import bp as sync_bp
 from blueprints.users import bp as users_bp
-from create_db import create_db
+from commands import register_commands
+from compression import compression
 from database import db
+from maintenance import maintenance
+from replica import replica
+from services.analytics import analytics_cache
+from services.passwords import hasher
 
 
 def create_app():
 	app = Flask(__name__)
 	app.config.from_object('config.Config')
-	if not os.path.exists(os.path.join(os.getcwd(), app.config['DB_CONNECTION'])):
-		create_db(app)
 	db.init_app(app)
+	replica.init_app(app)
+	hasher.init_app(app)
+	analytics_cache.init_app(app)
+	admission.init_app(app)
+	compression.init_app(app)
+	maintenance.init_app(app)
 	app.register_blueprint(auth_bp, url_prefix='/auth')
+	app.register_blueprint(batch_bp, url_prefix='/batch')
+	app.register_blueprint(budgets_bp, url_prefix='/budgets')
 	app.register_blueprint(categories_bp, url_prefix='/categories')
 	app.register_blueprint(operations_bp, url_prefix='/operations')
+	app.register_blueprint(recurring_bp, url_prefix='/recurring')
 	app.register_blueprint(report_bp, url_prefix='/report')
+	app.register_blueprint(sync_bp, url_prefix='/sync')
 	app.register_blueprint(users_bp, url_prefix='/users')
+	register_commands(app)
 	return app
@@ -1,9 +1,10 @@
 from functools import wraps
 from http import HTTPStatus
 
-from flask import session
+from flask import current_app, session
 
 from database import db
+from services.shards import ShardsService
 from services.users import UsersService
 from services.exceptions import DoesNotExistError
 
@@ -20,14 +21,29 @@ def auth_required(*, pass_user=False):
             user_id = session.get('user_id')
             if not user_id:
                 return '', HTTPStatus.UNAUTHORIZED
-            with db.connection as connection:
+            with db.directory as connection:
                 service = UsersService(connection)
                 try:
                     user = service.get_user(user_id)
                 except DoesNotExistError as e:
                     return e.error, HTTPStatus.UNAUTHORIZED
+                if db.shards:
+                    db.use_shard(ShardsService(connection).get_shard(user_id))
             if pass_user:
                 kwargs['user'] = user
             return view_func(*args, **kwargs)
         return wrapper
     return decorator
+
+
+def admin_required(view_func):
+    """
+    Декоратор для служебных endpoint'ов: доступ только пользователям из ADMIN_EMAILS
+    """
+    @wraps(view_func)
+    @auth_required(pass_user=True)
+    def wrapper(*args, user, **kwargs):
+        if user['email'] not in current_app.config['ADMIN_EMAILS']:
+            return '', HTTPStatus.FORBIDDEN
+        return view_func(*args, **kwargs)
+    return wrapper
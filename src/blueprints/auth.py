@@ -5,9 +5,11 @@ from flask import (
     request,
     session,
 )
-from werkzeug.security import check_password_hash
 
 from database import db
+from services.exceptions import ServiceUnavailableError
+from services.passwords import hasher
+from services.users import UsersService
 
 bp = Blueprint('auth', __name__)
 
@@ -21,7 +23,7 @@ def login():
     email = request_json['email']
     password = request_json['password']
 
-    with db.connection as connection:
+    with db.directory as connection:
         cur = connection.execute(
             'SELECT id, password '
             'FROM user '
@@ -32,8 +34,19 @@ def login():
 
         if row is None:
             return '', HTTPStatus.UNPROCESSABLE_ENTITY
-        if not check_password_hash(row['password'], password):
-            return '', HTTPStatus.FORBIDDEN
+        try:
+            if not hasher.check(row['password'], password):
+                return '', HTTPStatus.FORBIDDEN
+        except ServiceUnavailableError as e:
+            return e.error, e.code, {'Retry-After': str(e.retry_after)}
+
+        if hasher.needs_rehash(row['password']):
+            try:
+                password_hash = hasher.generate(password)
+            except ServiceUnavailableError:
+                pass
+            else:
+                UsersService(connection).update_password_hash(row['id'], password_hash)
 
         session['user_id'] = row['id']
         return '', HTTPStatus.OK
@@ -0,0 +1,145 @@
+from http import HTTPStatus
+
+from flask import (
+    Blueprint,
+    current_app,
+    request,
+    jsonify,
+)
+from flask.views import MethodView
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import Map, Rule
+
+from auth import auth_required
+from database import db
+from services.categories import CategoriesService
+from services.exceptions import ServiceError
+from services.operations import OperationsService
+
+
+def create_operation(connection, user, body):
+    operation = OperationsService(connection).create_operation(user, body)
+    return operation, HTTPStatus.CREATED
+
+
+def update_operation(connection, user, body, operation_id):
+    service = OperationsService(connection)
+    if not service.is_owner(user['id'], operation_id):
+        return '', HTTPStatus.FORBIDDEN
+    return service.update_operation(user['id'], operation_id, body), HTTPStatus.OK
+
+
+def delete_operation(connection, user, body, operation_id):
+    service = OperationsService(connection)
+    if not service.is_owner(user['id'], operation_id):
+        return '', HTTPStatus.FORBIDDEN
+    service.delete_operation(operation_id)
+    return '', HTTPStatus.NO_CONTENT
+
+
+def create_category(connection, user, body):
+    # create_category сам делает commit, поэтому категория создается как дерево из одного узла
+    categories = CategoriesService(connection).create_category_tree(user['id'], {
+        'parent_id': body.get('parent_id'),
+        'categories': [{'title': body.get('title')}],
+    })
+    return categories[0], HTTPStatus.CREATED
+
+
+def update_category(connection, user, body, category_id):
+    service = CategoriesService(connection)
+    if not service.is_owner(user['id'], category_id):
+        return '', HTTPStatus.FORBIDDEN
+    return service.update_category(user['id'], category_id, body), HTTPStatus.OK
+
+
+def delete_category(connection, user, body, category_id):
+    service = CategoriesService(connection)
+    if not service.is_owner(user['id'], category_id):
+        return '', HTTPStatus.FORBIDDEN
+    service.delete_category(category_id)
+    return '', HTTPStatus.NO_CONTENT
+
+
+routes = Map([
+    Rule('/operations', methods=['POST'], endpoint=create_operation),
+    Rule('/operations/<int:operation_id>', methods=['PATCH'], endpoint=update_operation),
+    Rule('/operations/<int:operation_id>', methods=['DELETE'], endpoint=delete_operation),
+    Rule('/categories', methods=['POST'], endpoint=create_category),
+    Rule('/categories/<int:category_id>', methods=['PATCH'], endpoint=update_category),
+    Rule('/categories/<int:category_id>', methods=['DELETE'], endpoint=delete_category),
+]).bind('')
+
+
+class BatchView(MethodView):
+    @auth_required(pass_user=True)
+    def post(self, user):
+        """
+        Выполнение нескольких запросов к операциям и категориям в одной транзакции.
+        Каждый запрос выполняется в своей точке сохранения: при ошибке откатывается только он,
+        а при atomic = true - весь пакет
+        :param user: Пользователь
+        :return: Результаты запросов (статус и тело) в том же порядке
+        """
+        requests = request.json.get('requests')
+        atomic = bool(request.json.get('atomic', False))
+        if not isinstance(requests, list) or not requests:
+            return {'message': 'Field "requests" must be a non-empty list.'}, HTTPStatus.BAD_REQUEST
+        if len(requests) > current_app.config['BATCH_MAX_REQUESTS']:
+            return {
+                'message': f'Batch must contain at most {current_app.config["BATCH_MAX_REQUESTS"]} requests.',
+            }, HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+        results = []
+        failed = None
+        with db.connection as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            for index, sub_request in enumerate(requests):
+                connection.execute('SAVEPOINT batch_item')
+                body, status = self._dispatch(connection, user, sub_request)
+                if status >= HTTPStatus.BAD_REQUEST:
+                    connection.execute('ROLLBACK TO batch_item')
+                connection.execute('RELEASE batch_item')
+                results.append({'status': status, 'body': body})
+                if atomic and status >= HTTPStatus.BAD_REQUEST:
+                    failed = index
+                    break
+
+            if failed is None:
+                connection.commit()
+            else:
+                connection.rollback()
+                message = {'message': f'Batch was rolled back because request {failed} failed.'}
+                for index in range(len(requests)):
+                    if index == len(results):
+                        results.append(None)
+                    if index != failed:
+                        results[index] = {'status': HTTPStatus.FAILED_DEPENDENCY, 'body': message}
+        return jsonify(results), HTTPStatus.OK
+
+    @staticmethod
+    def _dispatch(connection, user, sub_request):
+        """
+        Выполнение одного запроса пакета
+        :param connection: Соединение с базой данных
+        :param user: Пользователь
+        :param sub_request: Запрос (method, path, body)
+        :return: Тело и статус ответа
+        """
+        if not isinstance(sub_request, dict):
+            return {'message': 'Request must be an object.'}, HTTPStatus.BAD_REQUEST
+        try:
+            handler, args = routes.match(sub_request.get('path', ''), sub_request.get('method', 'GET').upper())
+        except NotFound:
+            return {'message': 'Unknown path.'}, HTTPStatus.NOT_FOUND
+        except MethodNotAllowed:
+            return {'message': 'Method is not allowed for that path.'}, HTTPStatus.METHOD_NOT_ALLOWED
+        body = sub_request.get('body') or {}
+        try:
+            return handler(connection, user, dict(body), **args)
+        except ServiceError as e:
+            return e.error, e.code
+
+
+bp = Blueprint('batch', __name__)
+bp.add_url_rule('', view_func=BatchView.as_view('batch'))
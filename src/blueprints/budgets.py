@@ -0,0 +1,68 @@
+from http import HTTPStatus
+from flask import (
+    Blueprint,
+    request,
+    jsonify,
+)
+
+from flask.views import MethodView
+from auth import auth_required
+from database import db
+from services.budgets import BudgetsService
+from services.exceptions import (
+    ServiceError,
+)
+
+
+class BudgetsView(MethodView):
+
+    @auth_required(pass_user=True)
+    def get(self, user):
+        with db.connection as connection:
+            service = BudgetsService(connection)
+            budgets = service.get_budgets(user['id'])
+            return jsonify(budgets), HTTPStatus.OK
+
+    @auth_required(pass_user=True)
+    def post(self, user):
+        with db.connection as connection:
+            service = BudgetsService(connection)
+            try:
+                budget = service.create_budget(user['id'], request.json)
+            except ServiceError as e:
+                connection.rollback()
+                return e.error, e.code
+            else:
+                connection.commit()
+                return budget, HTTPStatus.CREATED
+
+
+class BudgetView(MethodView):
+
+    @auth_required(pass_user=True)
+    def get(self, budget_id, user):
+        with db.connection as connection:
+            service = BudgetsService(connection)
+            if not service.is_owner(user['id'], budget_id):
+                return '', HTTPStatus.FORBIDDEN
+            try:
+                budget = service.get_budget_by_id(budget_id)
+            except ServiceError as e:
+                return e.error, e.code
+            else:
+                return budget, HTTPStatus.OK
+
+    @auth_required(pass_user=True)
+    def delete(self, budget_id, user):
+        with db.connection as connection:
+            service = BudgetsService(connection)
+            if not service.is_owner(user['id'], budget_id):
+                return '', HTTPStatus.FORBIDDEN
+            service.delete_budget(budget_id)
+            connection.commit()
+            return '', HTTPStatus.NO_CONTENT
+
+
+bp = Blueprint('budgets', __name__)
+bp.add_url_rule('', view_func=BudgetsView.as_view('budgets'))
+bp.add_url_rule('/<int:budget_id>', view_func=BudgetView.as_view('budget'))
@@ -18,13 +18,25 @@ class CategoriesView(MethodView):
     @auth_required(pass_user=True)
     def get(self, user):
         """
-        Получение категорий пользователя
+        Получение категорий пользователя: списком или деревом (format=tree),
+        целиком или поддерево категории root глубиной depth
         :param user: Пользователь
         :return: Категории
         """
+        root_id = request.args.get('root', type=int)
+        depth = request.args.get('depth', type=int)
+        if depth is not None and depth < 0:
+            return {'message': 'Depth must be >= 0.'}, HTTPStatus.BAD_REQUEST
         with db.connection as connection:
             service = CategoriesService(connection)
-            categories = service.get_categories(user['id'])
+            if root_id is not None and not service.is_owner(user['id'], root_id):
+                return '', HTTPStatus.FORBIDDEN
+            try:
+                categories = service.get_categories(user['id'], root_id, depth)
+            except ServiceError as e:
+                return e.error, e.code
+            if request.args.get('format') == 'tree':
+                categories = service.make_tree(categories)
             return jsonify(categories)
 
     @auth_required(pass_user=True)
@@ -80,6 +92,26 @@ class CategoryView(MethodView):
             return '', HTTPStatus.NO_CONTENT
 
 
+class CategoryTreeView(MethodView):
+    @auth_required(pass_user=True)
+    def post(self, user):
+        """
+        Добавление дерева категорий одной транзакцией
+        :param user: Пользователь
+        :return: Созданные категории
+        """
+        with db.connection as connection:
+            service = CategoriesService(connection)
+            try:
+                categories = service.create_category_tree(user['id'], request.json)
+            except ServiceError as e:
+                connection.rollback()
+                return e.error, e.code
+            connection.commit()
+            return jsonify(categories), HTTPStatus.CREATED
+
+
 bp = Blueprint('categories', __name__)
 bp.add_url_rule('', view_func=CategoriesView.as_view('categories'))
+bp.add_url_rule('/tree', view_func=CategoryTreeView.as_view('category_tree'))
 bp.add_url_rule('/<int:category_id>', view_func=CategoryView.as_view('category'))
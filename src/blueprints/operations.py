@@ -8,6 +8,7 @@ from flask import (
 from flask.views import MethodView
 from auth import auth_required
 from database import db
+from services.idempotency import IdempotencyService, make_request_hash
 from services.operations import OperationsService
 from services.exceptions import (
     ServiceError,
@@ -18,16 +19,39 @@ class OperationsView(MethodView):
 
     @auth_required(pass_user=True)
     def post(self, user):
+        """
+        Добавление операции.
+        С заголовком Idempotency-Key повтор запроса возвращает сохраненный ответ первого запроса,
+        с dedup=1 операция с той же датой, суммой и описанием, созданная импортом, не дублируется
+        :param user: Пользователь
+        :return: Созданная (или найденная) операция
+        """
+        key = request.headers.get('Idempotency-Key')
+        request_hash = make_request_hash(request.args.to_dict(), request.json)
         with db.connection as connection:
             service = OperationsService(connection)
+            idempotency = IdempotencyService(connection)
             try:
-                operation = service.create_operation(user, request.json)
+                if key is not None:
+                    saved = idempotency.begin(user['id'], key, request_hash)
+                    if saved is not None:
+                        connection.rollback()
+                        operation, status = saved
+                        return operation, status, {'Idempotent-Replayed': 'true'}
+                if request.args.get('dedup') == '1':
+                    operation, created = service.import_operation(user, request.json)
+                    status = HTTPStatus.CREATED if created else HTTPStatus.OK
+                else:
+                    operation = service.create_operation(user, request.json)
+                    status = HTTPStatus.CREATED
+                if key is not None:
+                    idempotency.save_response(user['id'], key, request_hash, operation, status)
             except ServiceError as e:
                 connection.rollback()
                 return e.error, e.code
             else:
                 connection.commit()
-                return operation, HTTPStatus.CREATED
+                return operation, status
 
 
 class OperationView(MethodView):
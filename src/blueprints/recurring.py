@@ -0,0 +1,68 @@
+from http import HTTPStatus
+from flask import (
+    Blueprint,
+    request,
+    jsonify,
+)
+
+from flask.views import MethodView
+from auth import auth_required
+from database import db
+from services.recurring import RecurringService
+from services.exceptions import (
+    ServiceError,
+)
+
+
+class RecurringRulesView(MethodView):
+
+    @auth_required(pass_user=True)
+    def get(self, user):
+        with db.connection as connection:
+            service = RecurringService(connection)
+            rules = service.get_rules(user['id'])
+            return jsonify(rules), HTTPStatus.OK
+
+    @auth_required(pass_user=True)
+    def post(self, user):
+        with db.connection as connection:
+            service = RecurringService(connection)
+            try:
+                rule = service.create_rule(user['id'], request.json)
+            except ServiceError as e:
+                connection.rollback()
+                return e.error, e.code
+            else:
+                connection.commit()
+                return rule, HTTPStatus.CREATED
+
+
+class RecurringRuleView(MethodView):
+
+    @auth_required(pass_user=True)
+    def get(self, rule_id, user):
+        with db.connection as connection:
+            service = RecurringService(connection)
+            if not service.is_owner(user['id'], rule_id):
+                return '', HTTPStatus.FORBIDDEN
+            try:
+                rule = service.get_rule_by_id(rule_id)
+            except ServiceError as e:
+                return e.error, e.code
+            else:
+                return rule, HTTPStatus.OK
+
+    @auth_required(pass_user=True)
+    def delete(self, rule_id, user):
+        with db.connection as connection:
+            service = RecurringService(connection)
+            if not service.is_owner(user['id'], rule_id):
+                return '', HTTPStatus.FORBIDDEN
+            service.delete_rule(rule_id)
+            connection.commit()
+            return '', HTTPStatus.NO_CONTENT
+
+
+bp = Blueprint('recurring', __name__)
+bp.add_url_rule('', view_func=RecurringRulesView.as_view('recurring'))
+bp.add_url_rule('/<int:rule_id>', view_func=RecurringRuleView.as_view('recurring_rule'))
@@ -6,7 +6,7 @@ from flask import (
 from flask.views import MethodView
 
 from auth import auth_required
-from database import db
+from replica import replica
 from services.exceptions import ServiceError
 from services.reports import ReportService
 
@@ -20,7 +20,7 @@ class ReportView(MethodView):
         :return: Отчет
         """
         qs = dict(request.args)
-        with db.connection as connection:
+        with replica.connection as connection:
             service = ReportService(connection)
             try:
                 report = service.get_report(user['id'], qs)
@@ -29,5 +29,43 @@ class ReportView(MethodView):
             return report
 
 
+class SummaryView(MethodView):
+    @auth_required(pass_user=True)
+    def get(self, user):
+        """
+        Получение итогов по операциям с разбивкой по категориям
+        :param user: Пользователь
+        :return: Итоги
+        """
+        qs = dict(request.args)
+        with replica.connection as connection:
+            service = ReportService(connection)
+            try:
+                summary = service.get_summary(user['id'], qs)
+            except ServiceError as e:
+                return e.error, e.code
+            return summary
+
+
+class BalanceView(MethodView):
+    @auth_required(pass_user=True)
+    def get(self, user):
+        """
+        Получение баланса по дням, неделям или месяцам
+        :param user: Пользователь
+        :return: Баланс по интервалам
+        """
+        qs = dict(request.args)
+        with replica.connection as connection:
+            service = ReportService(connection)
+            try:
+                balance = service.get_balance(user['id'], qs)
+            except ServiceError as e:
+                return e.error, e.code
+            return balance
+
+
 bp = Blueprint('reports', __name__)
 bp.add_url_rule('', view_func=ReportView.as_view('report'))
+bp.add_url_rule('/summary', view_func=SummaryView.as_view('summary'))
+bp.add_url_rule('/balance', view_func=BalanceView.as_view('balance'))
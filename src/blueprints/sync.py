@@ -0,0 +1,38 @@
+from http import HTTPStatus
+
+from flask import (
+    Blueprint,
+    current_app,
+    request,
+)
+from flask.views import MethodView
+
+from auth import auth_required
+from database import db
+from services.sync import SyncService
+
+
+class SyncView(MethodView):
+    @auth_required(pass_user=True)
+    def get(self, user):
+        """
+        Получение операций и категорий, измененных после since (номер из next_since прошлого ответа).
+        Первая синхронизация - since=0. Пока has_more = true, нужно запрашивать следующую страницу
+        :param user: Пользователь
+        :return: Измененные записи, id удаленных и номер для следующего запроса
+        """
+        since = request.args.get('since', 0, type=int)
+        limit = request.args.get('limit', current_app.config['SYNC_PAGE_SIZE'], type=int)
+        max_limit = current_app.config['SYNC_MAX_PAGE_SIZE']
+        if since < 0:
+            return {'message': 'Since must be >= 0.'}, HTTPStatus.BAD_REQUEST
+        if not 0 < limit <= max_limit:
+            return {'message': f'Limit must be from 1 to {max_limit}.'}, HTTPStatus.BAD_REQUEST
+        with db.connection as connection:
+            service = SyncService(connection)
+            changes = service.get_changes(user['id'], since, limit)
+            return changes, HTTPStatus.OK
+
+
+bp = Blueprint('sync', __name__)
+bp.add_url_rule('', view_func=SyncView.as_view('sync'))
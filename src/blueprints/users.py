@@ -8,9 +8,11 @@ from flask import (
 from flask.views import MethodView
 
 from database import db
+from services.shards import ShardsService
 from services.users import UsersService
 from services.exceptions import (
     ServiceError,
+    ServiceUnavailableError,
 )
 
 
@@ -20,14 +22,22 @@ class UsersView(MethodView):
         Создание пользователя в базе данных
         :return: Информация о пользователе (id, email и имя)
         """
-        with db.connection as connection:
+        with db.directory as connection:
             service = UsersService(connection)
             try:
                 user = service.create_user(request.json)
+            except ServiceUnavailableError as e:
+                return e.error, e.code, {'Retry-After': str(e.retry_after)}
             except ServiceError as e:
                 return e.error, e.code
-            else:
-                return user, HTTPStatus.CREATED
+            if db.shards:
+                shard = ShardsService(connection).assign_shard(user['id'], len(db.shards))
+                connection.commit()
+                db.use_shard(shard)
+                with db.connection as shard_connection:
+                    UsersService(shard_connection).create_user_stub(user)
+                    shard_connection.commit()
+            return user, HTTPStatus.CREATED
 
 
 bp = Blueprint('users', __name__)
@@ -0,0 +1,172 @@
+import os
+from datetime import datetime, timedelta
+from itertools import chain
+
+import click
+
+from database import db
+from maintenance import maintenance
+from replica import replica
+from services.balances import BalancesService
+from services.idempotency import IdempotencyService
+from services.operation_log import OperationLogService
+from services.partitions import PartitionsService
+from services.recurring import RecurringService
+from services.shards import ShardsService, copy_user_data, delete_user_data
+from services.users import UsersService
+
+
+def register_commands(app):
+    @app.cli.command('archive-operations')
+    @click.option('--horizon-days', type=int, default=None, help='Возраст операций, после которого они уходят в архив.')
+    def archive_operations(horizon_days):
+        """
+        Перенос операций старше горизонта в архивные базы по годам
+        """
+        if horizon_days is None:
+            horizon_days = app.config['ARCHIVE_HORIZON_DAYS']
+        before_year = (datetime.now() - timedelta(days=horizon_days)).year
+
+        for database in db.databases:
+            archive_dir = app.config['ARCHIVE_DIR'] or os.path.dirname(database)
+            stem = os.path.splitext(os.path.basename(database))[0]
+
+            def get_archive_path(year):
+                return os.path.join(archive_dir, f'{stem}.{year}.db')
+
+            with db.get_connection(database) as connection:
+                moved = PartitionsService(connection).archive_operations(before_year, get_archive_path)
+                if moved:
+                    connection.execute('VACUUM')
+            for year, count in sorted(moved.items()):
+                click.echo(f'{database}: {year}: {count} operations archived')
+
+    @app.cli.command('materialize-recurring')
+    @click.option('--batch-size', type=int, default=None, help='Количество операций в одной транзакции.')
+    def materialize_recurring(batch_size):
+        """
+        Создание операций для наступивших повторений. Запускается по расписанию (cron),
+        после простоя догоняет все пропущенные повторения
+        """
+        if batch_size is None:
+            batch_size = app.config['RECURRING_BATCH_SIZE']
+        now = datetime.now()
+        total = 0
+        for database in db.databases:
+            with db.get_connection(database) as connection:
+                service = RecurringService(connection)
+                while True:
+                    processed = service.materialize_due(now, batch_size)
+                    connection.commit()
+                    total += processed
+                    if processed < batch_size:
+                        break
+        click.echo(f'{total} recurring occurrences processed')
+
+    @app.cli.command('rebuild-balance-checkpoints')
+    def rebuild_balance_checkpoints():
+        """
+        Пересчет контрольных точек баланса по всем операциям, включая архивы.
+        При обновлении базы выполняется автоматически, команда нужна для ручного восстановления
+        """
+        for database in db.databases:
+            with db.get_connection(database) as connection:
+                count = BalancesService(connection).rebuild_checkpoints()
+            click.echo(f'{database}: {count} balance checkpoints')
+
+    @app.cli.command('purge-idempotency-keys')
+    @click.option('--ttl', type=int, default=None, help='Время жизни ключа в секундах.')
+    def purge_idempotency_keys(ttl):
+        """
+        Удаление устаревших ключей идемпотентности. Запускается по расписанию (cron)
+        """
+        if ttl is None:
+            ttl = app.config['IDEMPOTENCY_KEY_TTL']
+        total = 0
+        for database in db.databases:
+            with db.get_connection(database) as connection:
+                total += IdempotencyService(connection).purge(ttl)
+        click.echo(f'{total} idempotency keys purged')
+
+    @app.cli.command('compact-operation-log')
+    @click.option('--keep-last', type=int, default=None, help='Количество последних записей журнала, которые остаются.')
+    def compact_operation_log(keep_last):
+        """
+        Удаление старых записей журнала изменений операций. Запускается по расписанию (cron).
+        Кэши итогов и столбцов, построенные до оставшихся записей, при следующем обращении пересобираются
+        """
+        if keep_last is None:
+            keep_last = app.config['OPERATION_LOG_KEEP_LAST']
+        for database in db.databases:
+            with db.get_connection(database) as connection:
+                deleted = OperationLogService(connection).compact(keep_last)
+            click.echo(f'{database}: {deleted} operation log entries compacted')
+
+    @app.cli.command('maintenance')
+    def run_maintenance():
+        """
+        Обслуживание всех баз сразу (PRAGMA optimize, ANALYZE, incremental_vacuum, checkpoint WAL),
+        без ожидания простоя. Для запуска по расписанию (cron) вместо фонового потока.
+        Базы без auto_vacuum = INCREMENTAL сначала один раз переводятся в этот режим (полный VACUUM)
+        """
+        for result in chain(maintenance.convert_auto_vacuum(), maintenance.run(force=True)):
+            detail = ', '.join(
+                f'{key}={value}'
+                for key, value in result.items()
+                if key not in ('database', 'step', 'status', 'ms', 'finished_at')
+            )
+            click.echo(f'{result["database"]}: {result["step"]} {result["status"]} in {result["ms"]} ms {detail}'.rstrip())
+
+    @app.cli.command('refresh-replicas')
+    def refresh_replicas():
+        """
+        Снятие снимков всех баз для отчетов. Для запуска по расписанию (cron)
+        вместо фонового потока (REPLICA_REFRESH_IN_BACKGROUND=false)
+        """
+        for database in replica.refresh_stale(force=True):
+            click.echo(f'{database}: snapshot refreshed')
+
+    @app.cli.command('shards-rebalance')
+    @click.option('--user-id', type=int, default=None, help='Перенести только этого пользователя.')
+    @click.option('--to', 'to_shard', type=int, default=None, help='Номер шарда для --user-id.')
+    def shards_rebalance(user_id, to_shard):
+        """
+        Перенос пользователей между шардами (при остановленном сервисе).
+        Без параметров выравнивает количество пользователей в шардах и переносит в шарды
+        пользователей основной базы. Чтобы разделить шард, новый файл добавляется
+        в конец SHARD_CONNECTIONS, и команда переносит на него часть пользователей
+        """
+        if not db.shards:
+            raise click.ClickException('SHARD_CONNECTIONS is not configured.')
+        if (user_id is None) != (to_shard is None):
+            raise click.UsageError('--user-id and --to must be used together.')
+        if to_shard is not None and not 0 <= to_shard < len(db.shards):
+            raise click.UsageError(f'Shard must be from 0 to {len(db.shards) - 1}.')
+
+        with db.directory as directory:
+            service = ShardsService(directory)
+            if user_id is None:
+                main_shard = db.shards.index(db.main_database) if db.main_database in db.shards else None
+                moves = service.plan_rebalance(len(db.shards), main_shard)
+            else:
+                moves = [(user_id, service.get_shard(user_id), to_shard)]
+
+            for user_id, source, target in moves:
+                source_database = db.main_database if source is None else db.shards[source]
+                target_database = db.shards[target]
+                if source_database != target_database:
+                    user = UsersService(directory).get_user(user_id)
+                    copied = copy_user_data(
+                        db.get_connection(source_database),
+                        db.get_connection(target_database),
+                        user,
+                    )
+                service.set_shard(user_id, target)
+                directory.commit()
+                if source_database != target_database:
+                    source_connection = db.get_connection(source_database)
+                    PartitionsService(source_connection).delete_archived_operations(user_id)
+                    delete_user_data(source_connection, user_id, keep_user=source_database == db.main_database)
+                    click.echo(f'user {user_id}: {source_database} -> {target_database}, {sum(copied.values())} rows')
+                else:
+                    click.echo(f'user {user_id}: {target_database}')
@@ -0,0 +1,161 @@
+import zlib
+
+from flask import request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/csv', 'text/html')
+
+
+class GzipEncoder:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class ZstdEncoder:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def get_encoders():
+    """
+    Доступные кодировки: gzip есть всегда, zstd и br - если установлены zstandard и brotli
+    :return: Словарь кодировка -> класс кодировщика
+    """
+    encoders = {'gzip': GzipEncoder}
+    if zstandard is not None:
+        encoders['zstd'] = ZstdEncoder
+    if brotli is not None:
+        encoders['br'] = BrotliEncoder
+    return encoders
+
+
+def compress(encoder, data):
+    """
+    Сжатие тела целиком
+    :param encoder: Кодировщик
+    :param data: Тело
+    :return: Сжатое тело
+    """
+    return encoder.compress(data) + encoder.finish()
+
+
+def compress_stream(encoder, chunks):
+    """
+    Сжатие потокового ответа (генератора) по частям, без сборки тела целиком
+    :param encoder: Кодировщик
+    :param chunks: Части тела
+    :return: Генератор сжатых частей
+    """
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = encoder.compress(chunk)
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class Compression:
+    """
+    Сжатие ответов по Accept-Encoding. Из кодировок, которые принимает клиент, выбирается
+    с наибольшим q, при равных q - первая в COMPRESSION_ENCODINGS. Ответы меньше
+    COMPRESSION_MIN_SIZE байт не сжимаются; потоковые ответы сжимаются всегда, по частям
+    """
+    def __init__(self, app=None):
+        self.encoders = {}
+        self.levels = {}
+        self.min_size = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['COMPRESSION_ENABLED']:
+            return
+        available = get_encoders()
+        self.encoders = {
+            encoding: available[encoding]
+            for encoding in app.config['COMPRESSION_ENCODINGS']
+            if encoding in available
+        }
+        self.levels = app.config['COMPRESSION_LEVELS']
+        self.min_size = app.config['COMPRESSION_MIN_SIZE']
+        app.after_request(self._compress)
+
+    def negotiate(self, accept_encodings):
+        """
+        Выбор кодировки
+        :param accept_encodings: Accept-Encoding запроса
+        :return: Кодировка или None, если клиент не принимает ни одну из доступных
+        """
+        best = None
+        best_quality = 0
+        for encoding in self.encoders:
+            quality = accept_encodings.quality(encoding)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def _compress(self, response):
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not response.is_streamed and response.calculate_content_length() < self.min_size:
+            return response
+
+        encoding = self.negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+        encoder = self.encoders[encoding](self.levels[encoding])
+        if response.is_streamed:
+            response.response = compress_stream(encoder, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(compress(encoder, response.get_data()))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+compression = Compression()
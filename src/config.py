@@ -3,4 +3,79 @@ import os
 
 class Config:
 	SECRET_KEY = os.getenv('SECRET_KEY', 'secret')
+	ADMIN_EMAILS = [email for email in os.getenv('ADMIN_EMAILS', '').split(',') if email]
 	DB_CONNECTION = os.getenv('DB_CONNECTION', 'db.db')
+	REPLICA_ENABLED = os.getenv('REPLICA_ENABLED', 'false').lower() == 'true'
+	REPLICA_MAX_STALENESS = int(os.getenv('REPLICA_MAX_STALENESS', 30))
+	REPLICA_REFRESH_SECONDS = int(os.getenv('REPLICA_REFRESH_SECONDS', 10))
+	REPLICA_REFRESH_IN_BACKGROUND = os.getenv('REPLICA_REFRESH_IN_BACKGROUND', 'true').lower() == 'true'
+	ARCHIVE_HORIZON_DAYS = int(os.getenv('ARCHIVE_HORIZON_DAYS', 730))
+	ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '')
+	SHARD_CONNECTIONS = [path for path in os.getenv('SHARD_CONNECTIONS', '').split(',') if path]
+	SHARD_ID_STRIDE = int(os.getenv('SHARD_ID_STRIDE', 10 ** 12))
+	SHARD_CATEGORY_ID_STRIDE = int(os.getenv('SHARD_CATEGORY_ID_STRIDE', 10000000))
+	RECURRING_BATCH_SIZE = int(os.getenv('RECURRING_BATCH_SIZE', 500))
+	BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 100))
+	SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 500))
+	SYNC_MAX_PAGE_SIZE = int(os.getenv('SYNC_MAX_PAGE_SIZE', 5000))
+	IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+	OPERATION_LOG_KEEP_LAST = int(os.getenv('OPERATION_LOG_KEEP_LAST', 100000))
+	QUERY_DEADLINES = {
+		'reports.report': float(os.getenv('REPORT_QUERY_DEADLINE', 5)),
+		'reports.summary': float(os.getenv('REPORT_QUERY_DEADLINE', 5)),
+		'reports.balance': float(os.getenv('REPORT_QUERY_DEADLINE', 5)),
+	}
+	ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+	ADMISSION_POOLS = {
+		'reports': {
+			'concurrency': int(os.getenv('REPORT_CONCURRENCY', 4)),
+			'queue_size': int(os.getenv('REPORT_QUEUE_SIZE', 8)),
+			'queue_timeout': float(os.getenv('REPORT_QUEUE_TIMEOUT', 2)),
+		},
+	}
+	ADMISSION_LIMITS = {
+		'reports.report': {
+			'rate': float(os.getenv('REPORT_RATE', 1)),
+			'burst': int(os.getenv('REPORT_BURST', 10)),
+			'pool': 'reports',
+			'max_page_size': int(os.getenv('REPORT_MAX_PAGE_SIZE', 1000)),
+		},
+		'reports.summary': {
+			'rate': float(os.getenv('REPORT_RATE', 1)),
+			'burst': int(os.getenv('REPORT_BURST', 10)),
+			'pool': 'reports',
+		},
+		'reports.balance': {
+			'rate': float(os.getenv('REPORT_RATE', 1)),
+			'burst': int(os.getenv('REPORT_BURST', 10)),
+			'pool': 'reports',
+		},
+	}
+	PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:150000')
+	PASSWORD_SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', 8))
+	PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+	PASSWORD_HASH_QUEUE_SIZE = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 16))
+	COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+	COMPRESSION_ENCODINGS = os.getenv('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',')
+	COMPRESSION_LEVELS = {
+		'gzip': int(os.getenv('COMPRESSION_GZIP_LEVEL', 6)),
+		'zstd': int(os.getenv('COMPRESSION_ZSTD_LEVEL', 3)),
+		'br': int(os.getenv('COMPRESSION_BR_LEVEL', 4)),
+	}
+	COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+	MAINTENANCE_ENABLED = os.getenv('MAINTENANCE_ENABLED', 'false').lower() == 'true'
+	MAINTENANCE_POLL_SECONDS = float(os.getenv('MAINTENANCE_POLL_SECONDS', 10))
+	MAINTENANCE_IDLE_SECONDS = float(os.getenv('MAINTENANCE_IDLE_SECONDS', 5))
+	MAINTENANCE_BUSY_TIMEOUT = float(os.getenv('MAINTENANCE_BUSY_TIMEOUT', 0.1))
+	MAINTENANCE_INTERVALS = {
+		'optimize': int(os.getenv('MAINTENANCE_OPTIMIZE_INTERVAL', 60 * 60)),
+		'analyze': int(os.getenv('MAINTENANCE_ANALYZE_INTERVAL', 24 * 60 * 60)),
+		'incremental_vacuum': int(os.getenv('MAINTENANCE_VACUUM_INTERVAL', 10 * 60)),
+		'wal_checkpoint': int(os.getenv('MAINTENANCE_CHECKPOINT_INTERVAL', 60)),
+	}
+	MAINTENANCE_ANALYZE_CHANGES = int(os.getenv('MAINTENANCE_ANALYZE_CHANGES', 10000))
+	MAINTENANCE_ANALYSIS_LIMIT = int(os.getenv('MAINTENANCE_ANALYSIS_LIMIT', 1000))
+	MAINTENANCE_VACUUM_PAGES = int(os.getenv('MAINTENANCE_VACUUM_PAGES', 1000))
+	ANALYTICS_CACHE_ENABLED = os.getenv('ANALYTICS_CACHE_ENABLED', 'false').lower() == 'true'
+	ANALYTICS_CACHE_BYTES = int(os.getenv('ANALYTICS_CACHE_BYTES', 256 * 1024 * 1024))
+	ANALYTICS_MIN_OPERATIONS = int(os.getenv('ANALYTICS_MIN_OPERATIONS', 50000))
@@ -1,39 +1,287 @@
 import sqlite3
 
+# Схема первой версии
+BASELINE = """
+	CREATE TABLE IF NOT EXISTS category (
+	id              INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
+	title           TEXT NOT NULL, 
+	parent_id 		INTEGER, 
+	user_id         INTEGER NOT NULL,
+	tree_path		TEXT NOT NULL,
+	UNIQUE(title, user_id), 
+	FOREIGN KEY(parent_id) REFERENCES category(id),
+	FOREIGN KEY(user_id) REFERENCES user(id) 
+	); 
+	
+	CREATE TABLE IF NOT EXISTS user (
+	id         INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
+	first_name TEXT NOT NULL, 
+	last_name  TEXT NOT NULL, 
+	email      TEXT NOT NULL UNIQUE, 
+	password   TEXT NOT NULL 
+	);
+	
+	CREATE TABLE IF NOT EXISTS operation (
+	id             INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
+	type           TEXT NOT NULL, 
+	amount         INTEGER NOT NULL, 
+	description    TEXT, 
+	category_id    INTEGER, 
+	record_date    TEXT NOT NULL, 
+	operation_date TEXT NOT NULL, 
+	user_id        INTEGER NOT NULL, 
+	FOREIGN KEY(user_id) REFERENCES user(id), 
+	FOREIGN KEY(category_id) REFERENCES category(id) ON DELETE SET NULL
+	);
+"""
 
-def create_db(app):
-	with sqlite3.connect(app.config['DB_CONNECTION']) as connection:
-		connection.executescript("""
-			CREATE TABLE category (
-			id              INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
-			title           TEXT NOT NULL, 
-			parent_id 		INTEGER, 
-			user_id         INTEGER NOT NULL,
-			tree_path		TEXT NOT NULL,
-			UNIQUE(title, user_id), 
-			FOREIGN KEY(parent_id) REFERENCES category(id),
-			FOREIGN KEY(user_id) REFERENCES user(id) 
-			); 
-			
-			CREATE TABLE user (
-			id         INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
-			first_name TEXT NOT NULL, 
-			last_name  TEXT NOT NULL, 
-			email      TEXT NOT NULL UNIQUE, 
-			password   TEXT NOT NULL 
-			);
-			
-			CREATE TABLE operation (
-			id             INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
-			type           TEXT NOT NULL, 
-			amount         INTEGER NOT NULL, 
-			description    TEXT, 
-			category_id    INTEGER, 
-			record_date    TEXT NOT NULL, 
-			operation_date TEXT NOT NULL, 
-			user_id        INTEGER NOT NULL, 
-			FOREIGN KEY(user_id) REFERENCES user(id), 
-			FOREIGN KEY(category_id) REFERENCES category(id) ON DELETE SET NULL
-			); 
-		""")
+
+def rebuild_search_index(connection):
+	"""
+	Заполнение индекса поиска по операциям, созданным до его появления
+	"""
+	from services.search import SearchService
+	SearchService(connection).rebuild_index()
+
+
+def rebuild_balance_checkpoints(connection):
+	"""
+	Заполнение контрольных точек баланса по операциям, созданным до их появления
+	"""
+	from services.balances import BalancesService
+	BalancesService(connection).rebuild_checkpoints()
+
+
+def stamp_sync_changes(connection):
+	"""
+	Запись в журнал синхронизации операций и категорий, созданных до его появления
+	"""
+	from services.sync import SyncService
+	SyncService(connection).stamp_existing()
+
+
+# Шаги обновления схемы существующих баз по порядку: (скрипт, заполнение по существующим данным или None).
+# Номер последнего выполненного шага хранится в PRAGMA user_version, новые шаги добавляются только в конец.
+# Скрипты и заполнение можно выполнить повторно, поэтому прерванный шаг просто повторяется
+MIGRATIONS = [
+	# Журнал изменений операций
+	("""
+		CREATE TABLE IF NOT EXISTS operation_log (
+		id             INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
+		user_id        INTEGER NOT NULL, 
+		operation_id   INTEGER NOT NULL, 
+		action         TEXT NOT NULL, 
+		sign           INTEGER NOT NULL, 
+		type           TEXT, 
+		amount         INTEGER NOT NULL, 
+		category_id    INTEGER, 
+		operation_date TEXT
+		); 
+		
+		CREATE INDEX IF NOT EXISTS operation_log_user_id_idx ON operation_log(user_id, id);
+	""", None),
+	# Реестр архивных баз операций
+	("""
+		CREATE TABLE IF NOT EXISTS operation_archive (
+		year INTEGER NOT NULL PRIMARY KEY, 
+		path TEXT NOT NULL
+		);
+	""", None),
+	# Полнотекстовый индекс описаний операций
+	("""
+		CREATE VIRTUAL TABLE IF NOT EXISTS operation_search USING fts5(
+		description, 
+		user_id UNINDEXED, 
+		prefix = '2 3'
+		);
+	""", rebuild_search_index),
+	# Бюджеты по категориям и траты по периодам
+	("""
+		CREATE TABLE IF NOT EXISTS budget (
+		id           INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
+		user_id      INTEGER NOT NULL, 
+		category_id  INTEGER NOT NULL, 
+		period       TEXT NOT NULL, 
+		amount_limit INTEGER NOT NULL, 
+		alert_at     INTEGER NOT NULL, 
+		UNIQUE(category_id, period), 
+		FOREIGN KEY(user_id) REFERENCES user(id), 
+		FOREIGN KEY(category_id) REFERENCES category(id) ON DELETE CASCADE
+		); 
+		
+		CREATE INDEX IF NOT EXISTS budget_user_id_idx ON budget(user_id);
+		
+		CREATE TABLE IF NOT EXISTS budget_spend (
+		budget_id    INTEGER NOT NULL, 
+		user_id      INTEGER NOT NULL, 
+		period_start TEXT NOT NULL, 
+		spent        INTEGER NOT NULL, 
+		PRIMARY KEY(budget_id, period_start), 
+		FOREIGN KEY(budget_id) REFERENCES budget(id) ON DELETE CASCADE
+		);
+	""", None),
+	# Повторяющиеся операции
+	("""
+		CREATE TABLE IF NOT EXISTS recurring_rule (
+		id           INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
+		user_id      INTEGER NOT NULL, 
+		type         TEXT NOT NULL, 
+		amount       INTEGER NOT NULL, 
+		description  TEXT, 
+		category_id  INTEGER, 
+		rule         TEXT NOT NULL, 
+		start_date   TEXT NOT NULL, 
+		next_date    TEXT, 
+		FOREIGN KEY(user_id) REFERENCES user(id), 
+		FOREIGN KEY(category_id) REFERENCES category(id) ON DELETE SET NULL
+		); 
+		
+		CREATE INDEX IF NOT EXISTS recurring_rule_user_id_idx ON recurring_rule(user_id);
+		CREATE INDEX IF NOT EXISTS recurring_rule_next_date_idx ON recurring_rule(next_date);
+		
+		CREATE TABLE IF NOT EXISTS recurring_occurrence (
+		rule_id         INTEGER NOT NULL, 
+		occurrence_date TEXT NOT NULL, 
+		user_id         INTEGER NOT NULL, 
+		operation_id    INTEGER, 
+		PRIMARY KEY(rule_id, occurrence_date), 
+		FOREIGN KEY(rule_id) REFERENCES recurring_rule(id) ON DELETE CASCADE
+		);
+	""", None),
+	# Индекс поддеревьев категорий
+	("""
+		CREATE INDEX IF NOT EXISTS category_user_id_tree_path_idx ON category(user_id, tree_path);
+	""", None),
+	# Справочник шардов
+	("""
+		CREATE TABLE IF NOT EXISTS shard_directory (
+		user_id INTEGER NOT NULL PRIMARY KEY, 
+		shard   INTEGER NOT NULL
+		);
+		
+		CREATE INDEX IF NOT EXISTS shard_directory_shard_idx ON shard_directory(shard);
+	""", None),
+	# Контрольные точки баланса по месяцам
+	("""
+		CREATE TABLE IF NOT EXISTS balance_checkpoint (
+		user_id     INTEGER NOT NULL, 
+		month_start TEXT NOT NULL, 
+		change      INTEGER NOT NULL, 
+		PRIMARY KEY(user_id, month_start)
+		);
+	""", rebuild_balance_checkpoints),
+	# Журнал изменений для синхронизации
+	("""
+		CREATE TABLE IF NOT EXISTS sync_change (
+		seq       INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, 
+		user_id   INTEGER NOT NULL, 
+		entity    TEXT NOT NULL, 
+		entity_id INTEGER NOT NULL, 
+		deleted   INTEGER NOT NULL DEFAULT 0, 
+		UNIQUE(entity, entity_id)
+		); 
+		
+		CREATE INDEX IF NOT EXISTS sync_change_user_id_seq_idx ON sync_change(user_id, seq);
+	""", None),
+	# Ключи идемпотентности
+	("""
+		CREATE TABLE IF NOT EXISTS idempotency_key (
+		user_id      INTEGER NOT NULL, 
+		key          TEXT NOT NULL, 
+		request_hash TEXT NOT NULL, 
+		status       INTEGER NOT NULL, 
+		response     TEXT NOT NULL, 
+		created_at   TEXT NOT NULL, 
+		PRIMARY KEY(user_id, key)
+		); 
+		
+		CREATE INDEX IF NOT EXISTS idempotency_key_created_at_idx ON idempotency_key(created_at);
+	""", None),
+	# Отпечатки импортированных операций
+	("""
+		CREATE TABLE IF NOT EXISTS operation_fingerprint (
+		user_id        INTEGER NOT NULL, 
+		fingerprint    TEXT NOT NULL, 
+		operation_id   INTEGER NOT NULL, 
+		operation_date TEXT NOT NULL, 
+		PRIMARY KEY(user_id, fingerprint)
+		); 
+		
+		CREATE INDEX IF NOT EXISTS operation_fingerprint_operation_id_idx ON operation_fingerprint(operation_id);
+	""", None),
+	# Номера изменений синхронизации по пользователю, чтобы они сохранялись при переносе в другой шард.
+	# Таблица пересоздается в одной транзакции, номера существующих изменений не меняются
+	("""
+		BEGIN;
+		
+		CREATE TABLE sync_change_by_user (
+		user_id   INTEGER NOT NULL, 
+		seq       INTEGER NOT NULL, 
+		entity    TEXT NOT NULL, 
+		entity_id INTEGER NOT NULL, 
+		deleted   INTEGER NOT NULL DEFAULT 0, 
+		PRIMARY KEY(user_id, seq), 
+		UNIQUE(entity, entity_id)
+		); 
+		
+		INSERT INTO sync_change_by_user(user_id, seq, entity, entity_id, deleted) 
+		SELECT user_id, seq, entity, entity_id, deleted FROM sync_change; 
+		
+		DROP TABLE sync_change; 
+		
+		ALTER TABLE sync_change_by_user RENAME TO sync_change; 
+		
+		COMMIT;
+	""", stamp_sync_changes),
+]
+
+
+def add_sequences(connection, id_offset, category_id_offset):
+	"""
+	Записи sqlite_sequence для таблиц, у которых их еще нет: от них сервисы выдают следующий id,
+	поэтому пустые таблицы (в том числе добавленные миграцией) начинают id с начала диапазона базы
+	:param connection: Соединение с базой
+	:param id_offset: Начало диапазона id базы
+	:param category_id_offset: Начало диапазона id категорий базы
+	"""
+	connection.execute(
+		'INSERT INTO sqlite_sequence(name, seq) '
+		"SELECT name, CASE name WHEN 'category' THEN ? ELSE ? END "
+		"FROM sqlite_master WHERE type = 'table' AND sql LIKE '%AUTOINCREMENT%' "
+		'AND name NOT IN (SELECT name FROM sqlite_sequence)',
+		(category_id_offset, id_offset),
+	)
+	connection.commit()
+
+
+def migrate_db(connection, id_offset=0, category_id_offset=0):
+	"""
+	Выполнение шагов MIGRATIONS, которых еще не было в базе
+	:param connection: Соединение с базой
+	:param id_offset: Начало диапазона id базы
+	:param category_id_offset: Начало диапазона id категорий базы
+	"""
+	version = connection.execute('PRAGMA user_version').fetchone()[0]
+	for number, (script, backfill) in enumerate(MIGRATIONS[version:], start=version + 1):
+		connection.executescript(script)
+		add_sequences(connection, id_offset, category_id_offset)
+		if backfill is not None:
+			backfill(connection)
+		connection.execute(f'PRAGMA user_version = {number}')
 		connection.commit()
+
+
+def create_db(app, database=None, id_offset=0, category_id_offset=0):
+	"""
+	Создание схемы пустой базы или обновление схемы существующей
+	:param app: Приложение
+	:param database: Путь к базе данных (по умолчанию DB_CONNECTION)
+	:param id_offset: Начало диапазона id базы
+	:param category_id_offset: Начало диапазона id категорий базы
+	"""
+	with sqlite3.connect(database or app.config['DB_CONNECTION'], uri=True) as connection:
+		connection.row_factory = sqlite3.Row
+		# auto_vacuum действует, только если задан до создания первой таблицы
+		connection.executescript('PRAGMA auto_vacuum = INCREMENTAL;' + BASELINE)
+		add_sequences(connection, id_offset, category_id_offset)
+		migrate_db(connection, id_offset, category_id_offset)
@@ -1,37 +1,273 @@
+import re
 import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+
+from flask import current_app, g, has_app_context, has_request_context, request
+
+from create_db import create_db
+from services.exceptions import QueryTimeoutError
+from services.shards import LOCAL_TABLES
+
+# id категорий входят в tree_path восемью цифрами, поэтому диапазоны id категорий всех баз должны уместиться в 10^8
+MAX_CATEGORY_ID = 10 ** 8
+# Остальные id должны точно передаваться числами JSON (клиенты на JavaScript)
+MAX_ID = 2 ** 53
+# Доля диапазона id, после которой в лог пишется предупреждение
+ID_RANGE_WARNING = 0.9
+
+# Количество превышений срока по endpoint'ам и видам запросов (в пределах процесса)
+query_timeouts = Counter()
+# Количество измененных строк по базам (в пределах процесса), по нему обслуживание решает, когда нужен ANALYZE
+row_changes = Counter()
+
+
+def get_query_shape(sql):
+    """
+    Вид запроса без конкретных значений: литералы заменяются на ?, списки параметров сворачиваются
+    :param sql: Текст запроса
+    :return: Вид запроса
+    """
+    shape = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    shape = re.sub(r'\b\d+(?:\.\d+)?\b', '?', shape)
+    shape = re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', shape)
+    return ' '.join(shape.split())
+
+
+def handle_interrupted(error):
+    """
+    Обработка запроса, прерванного по истечении срока: 504 вместо 500 и запись вида запроса,
+    который не уложился в срок
+    """
+    if 'interrupted' not in str(error) or g.get('query_deadline') is None:
+        raise error
+    shape = get_query_shape(g.get('last_query', ''))
+    query_timeouts[(request.endpoint, shape)] += 1
+    current_app.logger.warning('Query deadline exceeded on %s: %s', request.endpoint, shape)
+    e = QueryTimeoutError('Query took too long, try a narrower request.')
+    return e.error, e.code
 
 
 class SQLiteDB:
+    """
+    Соединения с базами данных. Пользователи и справочник шардов хранятся в основной базе
+    (DB_CONNECTION), а данные пользователей - в шарде, к которому он приписан (SHARD_CONNECTIONS).
+    Для каждого запроса connection отдает базу шарда, выбранного при авторизации (use_shard),
+    поэтому записи пользователей разных шардов не ждут одну блокировку записи
+    """
     def __init__(self, app=None):
-        self._connection = None
+        # Соединения у каждого потока свои: sqlite3 не разрешает использовать их из другого потока
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
         self._app = None
+        self._checked_databases = set()
         if app is not None:
             self.init_app(app)
 
     def init_app(self, app):
         self._app = app
+        self._check_stride()
         self._app.teardown_appcontext(self._disconnect)
+        self._app.register_error_handler(sqlite3.OperationalError, handle_interrupted)
+
+    def _get_connections(self):
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    @property
+    def _connection(self):
+        return self._get_connections().get(self.database)
+
+    @_connection.setter
+    def _connection(self, connection):
+        self._get_connections()[self.database] = connection
 
     @property
     def connection(self):
-        self._connect()
-        return self._connection
+        return self.get_connection(self.database)
+
+    @property
+    def directory(self):
+        """
+        Соединение с основной базой (пользователи и справочник шардов)
+        """
+        return self.get_connection(self.main_database)
+
+    def get_connection(self, database):
+        """
+        Соединение с базой данных. Схема пустой базы создается при первом подключении к ней
+        :param database: Путь к базе данных
+        :return: Соединение
+        """
+        connection = self._connect(database)
+        if database not in self._checked_databases:
+            self._ensure_schema(database)
+        return connection
 
-    def _connect(self):
-        database_connection = self._app.config['DB_CONNECTION']
-        self._connection = sqlite3.connect(
-            database_connection,
+    def _ensure_schema(self, database):
+        """
+        Создание схемы при первом подключении к пустой базе или обновление схемы существующей
+        (шаги, которых в ней еще не было). Проверка делается один раз на процесс для каждой базы
+        и не замедляет старт воркера.
+        id в каждой базе начинаются со своего смещения, чтобы данные пользователя
+        можно было перенести в другой шард без изменения id
+        """
+        with self._schema_lock:
+            if database in self._checked_databases:
+                return
+            if self.shards and database in self.databases:
+                id_ranges = self._get_id_ranges(database)
+                create_db(self._app, database, id_ranges['*'][0], id_ranges['category'][0])
+                self._check_id_range(database, id_ranges)
+            else:
+                create_db(self._app, database)
+            self._checked_databases.add(database)
+
+    def _get_id_ranges(self, database):
+        """
+        Диапазоны id базы: категории - SHARD_CATEGORY_ID_STRIDE на базу до MAX_CATEGORY_ID,
+        остальные таблицы - SHARD_ID_STRIDE на базу после MAX_CATEGORY_ID, где их не догонят id,
+        выданные, когда все таблицы делили диапазон категорий
+        :param database: Путь к базе данных
+        :return: Начало и размер диапазона для категорий (category) и остальных таблиц (*)
+        """
+        index = self.databases.index(database)
+        category_stride = self._app.config['SHARD_CATEGORY_ID_STRIDE']
+        stride = self._app.config['SHARD_ID_STRIDE']
+        return {
+            'category': (index * category_stride, category_stride),
+            '*': (MAX_CATEGORY_ID + index * stride, stride),
+        }
+
+    def _check_stride(self):
+        """
+        Проверка, что диапазоны id категорий всех баз умещаются в tree_path,
+        а диапазоны остальных id - в точные числа JSON
+        """
+        if len(self.databases) * self._app.config['SHARD_CATEGORY_ID_STRIDE'] > MAX_CATEGORY_ID:
+            raise RuntimeError(
+                f'SHARD_CATEGORY_ID_STRIDE is too large for {len(self.databases)} databases: '
+                f'category id ranges of all databases must fit in {MAX_CATEGORY_ID}.'
+            )
+        if MAX_CATEGORY_ID + len(self.databases) * self._app.config['SHARD_ID_STRIDE'] > MAX_ID:
+            raise RuntimeError(
+                f'SHARD_ID_STRIDE is too large for {len(self.databases)} databases: '
+                f'id ranges of all databases must fit in {MAX_ID}.'
+            )
+
+    def _check_id_range(self, database, id_ranges):
+        """
+        Проверка счетчиков id базы. Счетчик за пределами диапазона базы (после переноса пользователей
+        старыми версиями) возвращается к наибольшему id своего диапазона. Если диапазон исчерпан,
+        новые id совпали бы с id соседней базы, поэтому работа с базой останавливается.
+        Журнал изменений и пользователи между шардами не переносятся, у них диапазона нет
+        :param database: Путь к базе данных
+        :param id_ranges: Диапазоны id базы (_get_id_ranges)
+        """
+        self._check_stride()
+        with closing(sqlite3.connect(database, uri=True)) as connection:
+            cur = connection.execute('SELECT name, seq FROM sqlite_sequence')
+            for name, seq in cur.fetchall():
+                if name == 'user' or name in LOCAL_TABLES:
+                    continue
+                id_offset, stride = id_ranges.get(name, id_ranges['*'])
+                id_limit = id_offset + stride
+                if not id_offset <= seq < id_limit:
+                    seq = connection.execute(
+                        f'SELECT IFNULL(MAX(rowid), ?) FROM {name} WHERE rowid >= ? AND rowid < ?',
+                        (id_offset, id_offset, id_limit),
+                    ).fetchone()[0]
+                    connection.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (seq, name))
+                if seq >= id_limit - 1:
+                    setting = 'SHARD_CATEGORY_ID_STRIDE' if name == 'category' else 'SHARD_ID_STRIDE'
+                    raise RuntimeError(f'{database}: id range of {name} is exhausted, {setting} is too small.')
+                if seq - id_offset >= stride * ID_RANGE_WARNING:
+                    self._app.logger.warning(
+                        '%s: %s used %d of %d ids in its range', database, name, seq - id_offset, stride
+                    )
+            connection.commit()
+
+    @property
+    def main_database(self):
+        return self._app.config['DB_CONNECTION']
+
+    @property
+    def shards(self):
+        return self._app.config['SHARD_CONNECTIONS']
+
+    @property
+    def databases(self):
+        """
+        Все базы с данными пользователей: основная (в ней остаются пользователи,
+        еще не приписанные к шарду) и шарды
+        """
+        if self.main_database in self.shards:
+            return self.shards
+        return [self.main_database, *self.shards]
+
+    @property
+    def database(self):
+        if has_app_context():
+            return g.get('database', self.main_database)
+        return self.main_database
+
+    def use_database(self, database):
+        """
+        Выбор базы, с которой работает connection до конца запроса (команды)
+        :param database: Путь к базе данных
+        """
+        g.database = database
+
+    def use_shard(self, shard):
+        """
+        Выбор шарда пользователя
+        :param shard: Номер шарда в SHARD_CONNECTIONS или None, если пользователь еще в основной базе
+        """
+        self.use_database(self.main_database if shard is None else self.shards[shard])
+
+    def _connect(self, database=None):
+        database = database or self.database
+        connection = sqlite3.connect(
+            database,
             detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            uri=True,
         )
-        self._connection.row_factory = sqlite3.Row
-        self._connection.execute(
+        connection.row_factory = sqlite3.Row
+        connection.execute(
             'PRAGMA foreign_keys = ON'
         )
+        deadline = self._get_deadline()
+        if deadline is not None:
+            # Обработчик вызывается каждые N инструкций SQLite, ненулевой результат прерывает запрос
+            connection.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+            connection.set_trace_callback(lambda sql: setattr(g, 'last_query', sql))
+        self._get_connections()[database] = connection
+        return connection
+
+    def _get_deadline(self):
+        """
+        Срок выполнения запросов к базе для текущего запроса (QUERY_DEADLINES по endpoint'ам).
+        Отсчитывается от первого подключения в запросе
+        :return: Срок (time.monotonic()) или None, если срока нет
+        """
+        if not has_request_context():
+            return None
+        seconds = self._app.config['QUERY_DEADLINES'].get(request.endpoint)
+        if seconds is None:
+            return None
+        if g.get('query_deadline') is None:
+            g.query_deadline = time.monotonic() + seconds
+        return g.query_deadline
 
     def _disconnect(self, exception=None):
-        if self._connection is not None:
-            self._connection.close()
-            self._connection = None
+        connections = self._get_connections()
+        for database, connection in connections.items():
+            row_changes[database] += connection.total_changes
+            connection.close()
+        connections.clear()
 
 
 db = SQLiteDB()
@@ -0,0 +1,278 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import g, jsonify
+
+from auth import admin_required
+from database import db, row_changes
+
+STEPS = ('optimize', 'analyze', 'incremental_vacuum', 'wal_checkpoint')
+
+# PRAGMA auto_vacuum: 2 - INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+# Как часто процесс обновляет общее время последнего запроса (секунды)
+ACTIVITY_TOUCH_SECONDS = 1
+
+
+class Maintenance:
+    """
+    Обслуживание баз SQLite: PRAGMA optimize, ANALYZE (по расписанию и после большого количества
+    изменений), incremental_vacuum (возврат свободных страниц) и checkpoint WAL (если включен).
+    Фоновый поток запускается с первым запросом и выполняет шаги, только пока сервис простаивает:
+    в процессе нет текущих запросов и ни один процесс не получал запросов MAINTENANCE_IDLE_SECONDS.
+    Время последнего запроса общее для всех процессов - это mtime файла рядом с основной базой
+    (обновляется не чаще раза в ACTIVITY_TOUCH_SECONDS). Долгий запрос другого процесса
+    этим не виден, но он ограничен сроком запросов, а обслуживание не ждет блокировок.
+    Каждый шаг выполняется не чаще своего интервала (MAINTENANCE_INTERVALS), объем vacuum и ANALYZE
+    ограничен, а соединение не ждет блокировок, поэтому обслуживание не конкурирует с запросами.
+    Одну базу обслуживает один процесс за раз (файловая блокировка).
+    incremental_vacuum работает только в базах с auto_vacuum = INCREMENTAL: новые базы создаются
+    с ним, а существующие один раз переводит команда maintenance (для этого нужен полный VACUUM)
+    """
+    def __init__(self, app=None):
+        self.results = {}
+        self._app = None
+        self._active_requests = 0
+        self._last_request_at = time.time()
+        self._touched_at = 0
+        self._last_runs = {}
+        self._analyzed_changes = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self._touched_at = 0
+        if not app.config['MAINTENANCE_ENABLED']:
+            return
+        app.before_request(self._request_started)
+        app.teardown_request(self._request_finished)
+        app.add_url_rule('/maintenance/stats', 'maintenance_stats', admin_required(self._get_stats))
+
+    def _request_started(self):
+        with self._lock:
+            self._active_requests += 1
+            g.maintenance_request = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='maintenance', daemon=True)
+                self._thread.start()
+        self._touch_activity()
+
+    def _request_finished(self, exception=None):
+        # Запрос, отклоненный раньше _request_started (например, admission), не учитывался
+        if not g.pop('maintenance_request', False):
+            return
+        with self._lock:
+            self._active_requests -= 1
+            self._last_request_at = time.time()
+        self._touch_activity()
+
+    @property
+    def _activity_path(self):
+        return self._app.config['DB_CONNECTION'] + '.activity'
+
+    def _touch_activity(self):
+        """
+        Запись времени запроса в mtime файла активности, чтобы его видели остальные процессы
+        """
+        now = time.time()
+        if now - self._touched_at < ACTIVITY_TOUCH_SECONDS:
+            return
+        self._touched_at = now
+        try:
+            try:
+                os.utime(self._activity_path, (now, now))
+            except FileNotFoundError:
+                with open(self._activity_path, 'a'):
+                    pass
+        except OSError as e:
+            self._app.logger.warning('Maintenance activity file is not writable: %s', e)
+
+    def _get_last_activity(self):
+        """
+        Время последнего запроса во всех процессах
+        :return: Время в секундах
+        """
+        try:
+            shared = os.path.getmtime(self._activity_path)
+        except OSError:
+            shared = 0
+        with self._lock:
+            return max(shared, self._last_request_at)
+
+    def is_idle(self):
+        with self._lock:
+            if self._active_requests:
+                return False
+        return time.time() - self._get_last_activity() >= self._app.config['MAINTENANCE_IDLE_SECONDS']
+
+    def _loop(self):
+        while True:
+            time.sleep(self._app.config['MAINTENANCE_POLL_SECONDS'])
+            try:
+                self.run()
+            except Exception:
+                self._app.logger.exception('Database maintenance failed')
+
+    def run(self, force=False):
+        """
+        Выполнение шагов, для которых подошло время, во всех базах
+        :param force: Выполнить все шаги сразу, без проверки простоя и интервалов (команда maintenance)
+        :return: Результаты выполненных шагов
+        """
+        results = []
+        for database in self._iter_locked_databases():
+            results.extend(self._run_database(database, force))
+        return results
+
+    def convert_auto_vacuum(self):
+        """
+        Перевод баз, созданных без auto_vacuum = INCREMENTAL, в этот режим (команда maintenance).
+        Режим существующей базы меняется только полным VACUUM, который перезаписывает файл
+        и блокирует базу, поэтому фоновый поток этого не делает
+        :return: Результаты перевода
+        """
+        results = []
+        for database in self._iter_locked_databases():
+            connection = sqlite3.connect(database, timeout=self._app.config['MAINTENANCE_BUSY_TIMEOUT'])
+            try:
+                if connection.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+                    continue
+                started_at = time.perf_counter()
+                try:
+                    connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                    connection.execute('VACUUM')
+                    status, detail = 'done', {}
+                except sqlite3.OperationalError as e:
+                    status, detail = 'failed', {'error': str(e)}
+                results.append(self._make_result(database, 'convert_auto_vacuum', status, started_at, detail))
+            finally:
+                connection.close()
+        return results
+
+    def _iter_locked_databases(self):
+        """
+        Базы, которые сейчас не обслуживает другой процесс. Блокировка базы держится,
+        пока вызывающий код не перейдет к следующей
+        """
+        # filelock заметно замедляет импорт приложения, а нужен только фоновому потоку и команде
+        from filelock import FileLock, Timeout
+
+        for database in db.databases:
+            if not os.path.exists(database):
+                continue
+            lock = FileLock(database + '.maintenance.lock')
+            try:
+                lock.acquire(timeout=0)
+            except Timeout:
+                continue
+            try:
+                yield database
+            finally:
+                lock.release()
+
+    def _run_database(self, database, force):
+        """
+        Выполнение шагов для одной базы. Перед каждым шагом простой проверяется заново:
+        если пришли запросы, оставшиеся шаги переносятся на следующий раз
+        :param database: Путь к базе данных
+        :param force: Выполнить все шаги
+        :return: Результаты выполненных шагов
+        """
+        results = []
+        connection = sqlite3.connect(database, timeout=self._app.config['MAINTENANCE_BUSY_TIMEOUT'])
+        try:
+            for step in STEPS:
+                if not force and not self._is_due(database, step):
+                    continue
+                if not force and not self.is_idle():
+                    break
+                started_at = time.perf_counter()
+                try:
+                    status, detail = getattr(self, f'_{step}')(connection, database)
+                except sqlite3.OperationalError as e:
+                    # База занята запросами - шаг повторится после интервала
+                    status, detail = 'failed', {'error': str(e)}
+                result = self._make_result(database, step, status, started_at, detail)
+                self._last_runs[(database, step)] = time.monotonic()
+                with self._lock:
+                    self.results.setdefault(database, {})[step] = result
+                if status != 'skipped':
+                    self._app.logger.info('Maintenance %s on %s: %s in %s ms', step, database, status, result['ms'])
+                results.append(result)
+        finally:
+            connection.close()
+        return results
+
+    @staticmethod
+    def _make_result(database, step, status, started_at, detail):
+        return {
+            'database': database,
+            'step': step,
+            'status': status,
+            'ms': round((time.perf_counter() - started_at) * 1000, 1),
+            'finished_at': datetime.now().isoformat(),
+            **detail,
+        }
+
+    def _is_due(self, database, step):
+        """
+        Подошло ли время шага: прошел его интервал, а для ANALYZE - еще и после большого
+        количества изменений строк с прошлого запуска
+        """
+        last_run = self._last_runs.get((database, step))
+        if last_run is None or time.monotonic() - last_run >= self._app.config['MAINTENANCE_INTERVALS'][step]:
+            return True
+        if step == 'analyze':
+            changes = row_changes[database] - self._analyzed_changes.get(database, 0)
+            return changes >= self._app.config['MAINTENANCE_ANALYZE_CHANGES']
+        return False
+
+    def _optimize(self, connection, database):
+        connection.execute('PRAGMA optimize')
+        return 'done', {}
+
+    def _analyze(self, connection, database):
+        # analysis_limit ограничивает количество строк индекса, которые читает ANALYZE
+        changes = row_changes[database]
+        connection.execute(f'PRAGMA analysis_limit = {int(self._app.config["MAINTENANCE_ANALYSIS_LIMIT"])}')
+        connection.execute('ANALYZE')
+        connection.commit()
+        changed_rows = changes - self._analyzed_changes.get(database, 0)
+        self._analyzed_changes[database] = changes
+        return 'done', {'changed_rows': changed_rows}
+
+    def _incremental_vacuum(self, connection, database):
+        if connection.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            return 'skipped', {'reason': 'auto_vacuum is not INCREMENTAL, run flask maintenance'}
+        free_pages = connection.execute('PRAGMA freelist_count').fetchone()[0]
+        if not free_pages:
+            return 'skipped', {'reason': 'no free pages'}
+        pages = int(self._app.config['MAINTENANCE_VACUUM_PAGES'])
+        # Каждый шаг прагмы освобождает одну страницу, а execute делает только первый шаг
+        connection.executescript(f'PRAGMA incremental_vacuum({pages});')
+        freed = free_pages - connection.execute('PRAGMA freelist_count').fetchone()[0]
+        return 'done', {'freed_pages': freed, 'free_pages_left': free_pages - freed}
+
+    def _wal_checkpoint(self, connection, database):
+        if connection.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+            return 'skipped', {'reason': 'journal_mode is not WAL'}
+        # PASSIVE не ждет читателей и писателей, переносит в базу то, что можно перенести сейчас
+        busy, log_frames, checkpointed_frames = connection.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        return 'done', {'busy': bool(busy), 'log_frames': log_frames, 'checkpointed_frames': checkpointed_frames}
+
+    def _get_stats(self):
+        """
+        Последний результат каждого шага по базам текущего процесса: что сделано и сколько заняло
+        """
+        with self._lock:
+            results = {database: dict(steps) for database, steps in self.results.items()}
+        return jsonify(results)
+
+
+maintenance = Maintenance()
@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import threading
+import time
+
+from flask import (
+    has_request_context,
+    request,
+    session,
+)
+
+from database import SQLiteDB, db
+
+
+class SQLiteReplica(SQLiteDB):
+    """
+    Реплика базы данных для отчетов - согласованный снимок основной базы,
+    снятый через online backup API. Тяжелые запросы отчетов читают снимок и не мешают записи.
+    Снимки снимает фоновый поток (или команда refresh-replicas по расписанию), когда снимок
+    становится старше REPLICA_REFRESH_SECONDS. Запрос только читает готовый снимок: если снимка нет,
+    он старше REPLICA_MAX_STALENESS секунд или пользователь сделал запись после его снятия,
+    запрос читает основную базу. При первом снимке основная база переводится в WAL,
+    чтобы копирование снимка не блокировало запись.
+    """
+    def __init__(self, app=None):
+        self._refresh_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+        super().__init__(app)
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.after_request(self._remember_write)
+        if app.config['REPLICA_ENABLED'] and app.config['REPLICA_REFRESH_IN_BACKGROUND']:
+            app.before_request(self._start_refresh_thread)
+
+    @property
+    def connection(self):
+        if not self._app.config['REPLICA_ENABLED']:
+            return db.connection
+        snapshot_time = self._get_snapshot_time(self.path)
+        if (
+            snapshot_time is None
+            or time.time() - snapshot_time > self._app.config['REPLICA_MAX_STALENESS']
+            or self._has_newer_write(snapshot_time)
+        ):
+            return db.connection
+        self._connect()
+        return self._connection
+
+    @property
+    def database(self):
+        return f'file:{self.path}?mode=ro'
+
+    @property
+    def path(self):
+        return self.get_path(db.database)
+
+    @staticmethod
+    def get_path(database):
+        """
+        Путь к снимку базы
+        :param database: Путь к базе данных
+        """
+        return database + '.replica'
+
+    @staticmethod
+    def _get_snapshot_time(path):
+        """
+        Время снятия снимка (хранится в mtime файла, поэтому общее для всех процессов)
+        :param path: Путь к снимку
+        :return: Время в секундах или None, если снимка нет
+        """
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def _start_refresh_thread(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='replica', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.refresh_stale()
+            except Exception:
+                self._app.logger.exception('Replica refresh failed')
+            time.sleep(self._app.config['REPLICA_REFRESH_SECONDS'])
+
+    def refresh_stale(self, force=False):
+        """
+        Снятие новых снимков баз, снимки которых старше REPLICA_REFRESH_SECONDS
+        :param force: Снять снимки всех баз
+        :return: Базы, снимки которых сняты
+        """
+        refreshed = []
+        for database in db.databases:
+            if not os.path.exists(database):
+                continue
+            snapshot_time = self._get_snapshot_time(self.get_path(database))
+            if (
+                force
+                or snapshot_time is None
+                or time.time() - snapshot_time >= self._app.config['REPLICA_REFRESH_SECONDS']
+            ):
+                if self._refresh(database) is not None:
+                    refreshed.append(database)
+        return refreshed
+
+    def _refresh(self, database):
+        """
+        Снятие нового снимка базы.
+        Снимок пишется во временный файл и атомарно подменяет старый: открытые соединения
+        дочитывают старый снимок. Если снимок уже снимается в другом потоке, второй не нужен
+        :param database: Путь к базе данных
+        :return: Время снятия снимка или None, если снимок снять не удалось
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return None
+        path = self.get_path(database)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            source = sqlite3.connect(database, uri=True)
+            target = sqlite3.connect(tmp_path)
+            try:
+                self._use_wal(source, database)
+                started_at = time.time()
+                # Копирование по частям начинается заново после каждой записи в базу и под нагрузкой
+                # может не закончиться, поэтому снимок копируется за один шаг. В WAL чтение
+                # не блокирует запись, и запросы не ждут, пока копируется снимок
+                source.backup(target)
+                target.execute('PRAGMA journal_mode = DELETE')
+            finally:
+                target.close()
+                source.close()
+            os.utime(tmp_path, (started_at, started_at))
+            os.replace(tmp_path, path)
+            return started_at
+        except sqlite3.Error:
+            self._app.logger.exception('Replica refresh failed')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        finally:
+            self._refresh_lock.release()
+
+    def _use_wal(self, source, database):
+        """
+        Перевод базы в WAL (режим сохраняется в файле базы, поэтому переводится один раз).
+        Если база занята, перевод повторится при следующем снимке
+        :param source: Соединение с базой
+        :param database: Путь к базе данных
+        """
+        try:
+            source.execute('PRAGMA journal_mode = WAL')
+        except sqlite3.OperationalError:
+            self._app.logger.warning('Could not switch %s to WAL, the snapshot will block writes', database)
+
+    @staticmethod
+    def _has_newer_write(snapshot_time):
+        """
+        Проверка, писал ли текущий пользователь в базу после снятия снимка
+        :param snapshot_time: Время снятия снимка
+        :return: true/false - писал или нет
+        """
+        if not has_request_context():
+            return False
+        last_write_at = session.get('last_write_at')
+        return last_write_at is not None and last_write_at >= snapshot_time
+
+    @staticmethod
+    def _remember_write(response):
+        """
+        Запоминание в сессии времени последней успешной записи пользователя
+        """
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 and session.get('user_id'):
+            session['last_write_at'] = time.time()
+        return response
+
+
+replica = SQLiteReplica()
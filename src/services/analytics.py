@@ -0,0 +1,283 @@
+import threading
+from collections import OrderedDict
+from itertools import chain
+
+# numpy заметно замедляет импорт приложения, а нужен только при включенном кэше,
+# поэтому импортируется в AnalyticsCache.init_app
+np = None
+
+from .base import BaseService
+from .partitions import PartitionsService
+
+
+class OperationColumns:
+    """
+    Операции одного пользователя в виде столбцов NumPy, отсортированных по дате
+    """
+    def __init__(self, ids, dates, amounts, category_ids, is_income, last_id):
+        self.ids = ids
+        self.dates = dates
+        self.amounts = amounts
+        self.category_ids = category_ids
+        self.is_income = is_income
+        self.last_id = last_id
+
+    @classmethod
+    def from_rows(cls, rows, last_id):
+        ids = np.fromiter((row['id'] for row in rows), dtype=np.int64, count=len(rows))
+        dates = np.fromiter((row['date'] for row in rows), dtype=np.int64, count=len(rows))
+        amounts = np.fromiter((row['amount'] for row in rows), dtype=np.int64, count=len(rows))
+        category_ids = np.fromiter((row['category_id'] for row in rows), dtype=np.int64, count=len(rows))
+        is_income = np.fromiter((row['is_income'] for row in rows), dtype=np.bool_, count=len(rows))
+        order = np.lexsort((ids, dates))
+        return cls(ids[order], dates[order], amounts[order], category_ids[order], is_income[order], last_id)
+
+    @property
+    def nbytes(self):
+        return sum(
+            column.nbytes
+            for column in (self.ids, self.dates, self.amounts, self.category_ids, self.is_income)
+        )
+
+    def apply(self, changes, last_id):
+        """
+        Применение изменений из журнала: у каждой затронутой операции остается последнее состояние
+        :param changes: Записи журнала по возрастанию id
+        :param last_id: id последней записи журнала
+        :return: Новые столбцы
+        """
+        latest = {}
+        for change in changes:
+            latest[change['operation_id']] = change if change['sign'] > 0 else None
+
+        keep = ~np.isin(self.ids, np.fromiter(latest, dtype=np.int64, count=len(latest)))
+        added = OperationColumns.from_rows([change for change in latest.values() if change is not None], last_id)
+        ids = np.concatenate((self.ids[keep], added.ids))
+        dates = np.concatenate((self.dates[keep], added.dates))
+        order = np.lexsort((ids, dates))
+        return OperationColumns(
+            ids[order],
+            dates[order],
+            np.concatenate((self.amounts[keep], added.amounts))[order],
+            np.concatenate((self.category_ids[keep], added.category_ids))[order],
+            np.concatenate((self.is_income[keep], added.is_income))[order],
+            last_id,
+        )
+
+    def find(self, date_from, date_to, category_ids, is_income):
+        """
+        Отбор операций: период - бинарным поиском, категории и тип - векторными масками
+        :param date_from: Начало периода (unix time, включительно) или None
+        :param date_to: Конец периода (unix time, не включительно) или None
+        :param category_ids: id категорий поддерева или None
+        :param is_income: True/False для фильтра по типу или None
+        :return: id найденных операций (по возрастанию) и их сумма
+        """
+        lo = 0 if date_from is None else np.searchsorted(self.dates, date_from, side='left')
+        hi = len(self.dates) if date_to is None else np.searchsorted(self.dates, date_to, side='left')
+        mask = np.ones(max(hi - lo, 0), dtype=np.bool_)
+        if category_ids is not None:
+            mask &= np.isin(self.category_ids[lo:hi], np.asarray(category_ids, dtype=np.int64))
+        if is_income is not None:
+            mask &= self.is_income[lo:hi] == is_income
+        indexes = np.flatnonzero(mask) + lo
+        return np.sort(self.ids[indexes]), int(self.amounts[indexes].sum())
+
+
+class AnalyticsCache:
+    """
+    Кэш столбцов операций для пользователей с большим количеством операций.
+    Столбцы доводятся до актуального состояния по журналу operation_log, поэтому запись
+    в любом воркере видна всем остальным. Общий объем ограничен бюджетом памяти,
+    при его превышении вытесняются давно не использованные пользователи
+    """
+    def __init__(self, app=None):
+        self.enabled = False
+        self.memory_budget = 0
+        self.min_operations = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        global np
+        self.enabled = False
+        if app.config['ANALYTICS_CACHE_ENABLED']:
+            try:
+                import numpy as np
+            except ImportError:
+                app.logger.warning('numpy is not installed, analytics cache is disabled')
+            else:
+                self.enabled = True
+        self.memory_budget = app.config['ANALYTICS_CACHE_BYTES']
+        self.min_operations = app.config['ANALYTICS_MIN_OPERATIONS']
+
+    def get(self, connection, user_id):
+        """
+        Получение актуальных столбцов операций пользователя
+        :param connection: Соединение с базой данных
+        :param user_id: id пользователя
+        :return: Столбцы или None, если пользователь не кэшируется
+        """
+        if not self.enabled:
+            return None
+        service = AnalyticsService(connection)
+        key = (service.get_database_path(), user_id)
+        with self._lock:
+            columns = self._entries.get(key)
+
+        if columns is None:
+            if service.count_operations(user_id, self.min_operations) < self.min_operations:
+                return None
+            columns = service.load_columns(user_id)
+        else:
+            columns = service.refresh_columns(user_id, columns)
+
+        self._put(key, columns)
+        return columns
+
+    def _put(self, key, columns):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            if columns.nbytes > self.memory_budget:
+                return
+            self._entries[key] = columns
+            self._nbytes += columns.nbytes
+            while self._nbytes > self.memory_budget:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+
+class AnalyticsService(BaseService):
+    def count_operations(self, user_id, at_least=None):
+        """
+        Количество операций пользователя (включая архивы)
+        :param user_id: id пользователя
+        :param at_least: Закончить подсчет, когда количество дойдет до этого значения
+        :return: Количество
+        """
+        sources = chain(['operation'], PartitionsService(self.connection).iter_archive_sources())
+        count = 0
+        for source in sources:
+            cur = self.connection.execute(
+                'SELECT COUNT(*) AS items '
+                f'FROM {source} '
+                'WHERE user_id = ?',
+                (user_id,),
+            )
+            count += cur.fetchone()['items']
+            if at_least is not None and count >= at_least:
+                break
+        return count
+
+    def load_columns(self, user_id):
+        """
+        Загрузка всех операций пользователя (включая архивы) в столбцы
+        :param user_id: id пользователя
+        :return: Столбцы
+        """
+        fields = (
+            'id,'
+            " CAST(strftime('%s', operation_date) AS INTEGER) AS date,"
+            ' amount,'
+            ' IFNULL(category_id, 0) AS category_id,'
+            " type = 'income' AS is_income"
+        )
+        # id последней записи журнала читается тем же запросом, что и горячие операции
+        cur = self.connection.execute(
+            f'SELECT {fields},'
+            ' (SELECT IFNULL(MAX(id), 0) FROM operation_log) AS last_id '
+            'FROM operation '
+            'WHERE user_id = ?',
+            (user_id,),
+        )
+        rows = cur.fetchall()
+        last_id = rows[0]['last_id'] if rows else self._get_last_log_id()
+        for source in PartitionsService(self.connection).iter_archive_sources():
+            cur = self.connection.execute(
+                f'SELECT {fields} '
+                f'FROM {source} '
+                'WHERE user_id = ?',
+                (user_id,),
+            )
+            rows.extend(cur.fetchall())
+        return OperationColumns.from_rows(rows, last_id)
+
+    def refresh_columns(self, user_id, columns):
+        """
+        Применение к столбцам изменений из журнала, сделанных после их загрузки
+        :param user_id: id пользователя
+        :param columns: Столбцы
+        :return: Актуальные столбцы
+        """
+        cur = self.connection.execute(
+            'SELECT log.last_id, log.compacted_through, changes.* '
+            'FROM ('
+            ' SELECT IFNULL(MAX(id), 0) AS last_id,'
+            ' (SELECT IFNULL(MAX(operation_id), 0) FROM operation_log'
+            "  WHERE user_id = 0 AND action = 'compact') AS compacted_through"
+            ' FROM operation_log'
+            ') AS log '
+            'LEFT JOIN ('
+            ' SELECT'
+            ' id AS log_id,'
+            ' operation_id AS id,'
+            ' operation_id,'
+            ' sign,'
+            " CAST(strftime('%s', operation_date) AS INTEGER) AS date,"
+            ' amount,'
+            ' IFNULL(category_id, 0) AS category_id,'
+            " type = 'income' AS is_income"
+            ' FROM operation_log'
+            ' WHERE user_id = ? AND id > ?'
+            ') AS changes ON 1 '
+            'ORDER BY changes.log_id',
+            (user_id, columns.last_id),
+        )
+        rows = cur.fetchall()
+        if rows[0]['compacted_through'] > columns.last_id or rows[0]['last_id'] < columns.last_id:
+            # Журнал сжат после загрузки столбцов или база заменена (восстановлена из копии)
+            return self.load_columns(user_id)
+        changes = [row for row in rows if row['log_id'] is not None]
+        if not changes:
+            return columns
+        return columns.apply(changes, max(columns.last_id, rows[0]['last_id']))
+
+    def _get_last_log_id(self):
+        cur = self.connection.execute('SELECT IFNULL(MAX(id), 0) AS last_id FROM operation_log')
+        return cur.fetchone()['last_id']
+
+    def get_timestamps(self, *dates):
+        """
+        Перевод дат из query string в unix time так же, как это делает SQLite в отчетах
+        :param dates: Даты (None пропускаются)
+        :return: unix time для каждой даты (None для пропущенных)
+        """
+        cur = self.connection.execute(
+            'SELECT {}'.format(', '.join("CAST(strftime('%s', ?) AS INTEGER)" for _ in dates)),
+            list(dates),
+        )
+        row = cur.fetchone()
+        return [row[i] if date else None for i, date in enumerate(dates)]
+
+    def get_subtree_ids(self, user_id, category_id):
+        """
+        id категорий, путь которых содержит данную категорию (так же, как фильтр в отчете)
+        :param user_id: id пользователя
+        :param category_id: id категории
+        :return: Список id
+        """
+        cur = self.connection.execute(
+            'SELECT id '
+            'FROM category '
+            'WHERE user_id = ? AND tree_path LIKE ?',
+            (user_id, f'%{str(category_id).zfill(8)}%'),
+        )
+        return [row['id'] for row in cur.fetchall()]
+
+
+analytics_cache = AnalyticsCache()
@@ -0,0 +1,76 @@
+from collections import Counter
+
+from .base import BaseService
+from .partitions import PartitionsService
+
+
+def get_month_start(date):
+    """
+    Начало месяца даты
+    :param date: Дата (строка в ISO формате или datetime)
+    :return: Первое число месяца в формате YYYY-MM-01
+    """
+    return str(date)[:7] + '-01'
+
+
+class BalancesService(BaseService):
+    """
+    Контрольные точки баланса: изменение баланса пользователя за каждый месяц.
+    Баланс на начало месяца - сумма изменений за предыдущие месяцы, поэтому для графика баланса
+    не нужно суммировать всю историю операций
+    """
+    def apply_operation(self, old_operation, new_operation):
+        """
+        Изменение контрольных точек после изменения операции: старое состояние вычитается, новое прибавляется
+        :param old_operation: Операция до изменения (None при создании)
+        :param new_operation: Операция после изменения (None при удалении)
+        """
+        changes = {}
+        for sign, operation in ((-1, old_operation), (1, new_operation)):
+            if operation is None:
+                continue
+            key = (operation['user_id'], get_month_start(operation['operation_date']))
+            changes[key] = changes.get(key, 0) + sign * operation['amount']
+        self.connection.executemany(
+            'INSERT INTO balance_checkpoint(user_id, month_start, change) '
+            'VALUES (?, ?, ?) '
+            'ON CONFLICT(user_id, month_start) DO UPDATE SET change = change + excluded.change',
+            [(user_id, month_start, change) for (user_id, month_start), change in changes.items() if change],
+        )
+
+    def rebuild_checkpoints(self):
+        """
+        Пересчет всех контрольных точек по операциям, включая архивные (для баз с историей,
+        созданной до появления контрольных точек). Архивы читаются до транзакции: архивные операции
+        не меняются. Горячая таблица читается и точки перезаписываются в одной транзакции
+        с блокировкой на запись, поэтому параллельные изменения операций не теряются
+        :return: Количество контрольных точек
+        """
+        changes = Counter()
+        for source in PartitionsService(self.connection).iter_archive_sources():
+            self._add_changes(changes, source)
+        if not self.connection.in_transaction:
+            self.connection.execute('BEGIN IMMEDIATE')
+        self._add_changes(changes, 'operation')
+        self.connection.execute('DELETE FROM balance_checkpoint')
+        self.connection.executemany(
+            'INSERT INTO balance_checkpoint(user_id, month_start, change) '
+            'VALUES (?, ?, ?)',
+            [(user_id, month_start, change) for (user_id, month_start), change in changes.items() if change],
+        )
+        return len(changes)
+
+    def _add_changes(self, changes, source):
+        """
+        Добавление изменений баланса по месяцам из источника операций
+        :param changes: Изменения: (id пользователя, начало месяца) -> сумма
+        :param source: Таблица или подзапрос
+        """
+        # Начало месяца берется из строки даты, как в get_month_start
+        cur = self.connection.execute(
+            "SELECT user_id, substr(operation_date, 1, 7) || '-01' AS month_start, SUM(amount) AS change "
+            f'FROM {source} AS source '
+            'GROUP BY user_id, month_start'
+        )
+        for row in cur.fetchall():
+            changes[(row['user_id'], row['month_start'])] += row['change']
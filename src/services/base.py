@@ -14,6 +14,20 @@ class BaseService:
     def make_select_fields(cls, fields):
         return ', '.join(f'{field}' for field in fields)
 
+    @classmethod
+    def make_next_id(cls, table_name):
+        # Следующий id из диапазона базы. AUTOINCREMENT выдал бы id после наибольшего в таблице,
+        # а им может оказаться id, перенесенный из шарда с диапазоном выше
+        return f"(SELECT seq + 1 FROM sqlite_sequence WHERE name = '{table_name}')"
+
+    def get_database_path(self):
+        """
+        Путь к файлу основной базы соединения - часть ключа кэшей уровня процесса, чтобы записи
+        разных баз (шардов, восстановленной копии) не смешивались
+        :return: Путь к файлу ('' для базы в памяти)
+        """
+        return self.connection.execute('PRAGMA database_list').fetchone()[2]
+
     @classmethod
     def make_select_query(cls, fields, table_name, where, order_by, where_and, and_equals_to):
         fields_to_select = cls.make_select_fields(fields)
@@ -39,9 +53,12 @@ class BaseService:
         rows = cur.fetchall()
         return rows
 
-    def insert_row(self, table_name, **fields):
+    def insert_row(self, table_name, id_field=None, **fields):
         params = self.make_select_fields(fields)
         placeholders = self.make_placeholders(len(fields))
+        if id_field:
+            params = f'{id_field}, {params}'
+            placeholders = f'{self.make_next_id(table_name)}, {placeholders}'
         insert_query = f'INSERT INTO {table_name}({params}) VALUES ({placeholders})'
         cur = self.connection.execute(insert_query, (*fields.values(),))
         return cur.lastrowid
@@ -0,0 +1,237 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+
+from .base import BaseService
+from .exceptions import BrokenRulesError, ConflictError, DoesNotExistError
+
+PERIODS = ('week', 'month', 'quarter', 'year')
+
+
+def get_period_start(period, day):
+    """
+    Начало периода бюджета, в который попадает дата
+    :param period: Период (week, month, quarter, year)
+    :param day: Дата
+    :return: Дата начала периода
+    """
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day.replace(month=1, day=1)
+
+
+class BudgetsService(BaseService):
+    """
+    Бюджеты - лимиты расходов по категории за период.
+    Потраченная сумма хранится счетчиком в budget_spend и меняется при каждой записи операции,
+    поэтому получение бюджетов не зависит от количества операций.
+    Расход в категории учитывается во всех бюджетах её предков по tree_path
+    """
+    def get_budgets(self, user_id):
+        """
+        Получение бюджетов пользователя с расходами за текущий период
+        :param user_id: id пользователя
+        :return: Бюджеты
+        """
+        today = date.today()
+        period_starts = [get_period_start(period, today).isoformat() for period in PERIODS]
+        cur = self.connection.execute(
+            'SELECT'
+            ' budget.id,'
+            ' budget.category_id,'
+            ' budget.period,'
+            ' budget.amount_limit,'
+            ' budget.alert_at,'
+            ' budget.period_start,'
+            ' IFNULL(budget_spend.spent, 0) AS spent '
+            'FROM ('
+            ' SELECT *, CASE period'
+            "  WHEN 'week' THEN ? WHEN 'month' THEN ? WHEN 'quarter' THEN ? ELSE ?"
+            ' END AS period_start'
+            ' FROM budget'
+            ' WHERE user_id = ?'
+            ') AS budget '
+            'LEFT JOIN budget_spend ON budget_spend.budget_id = budget.id'
+            ' AND budget_spend.period_start = budget.period_start '
+            'ORDER BY budget.id',
+            (*period_starts, user_id),
+        )
+        return [self._make_budget(row) for row in cur.fetchall()]
+
+    def get_budget_by_id(self, budget_id):
+        """
+        Получение бюджета по его id с расходами за текущий период
+        :param budget_id: id бюджета
+        :return: Бюджет
+        """
+        row = self.select_row(['user_id'], table_name='budget', where='id', equals_to=budget_id)
+        if row is None:
+            raise DoesNotExistError(f'Budget with id {budget_id} does not exist.')
+        for budget in self.get_budgets(row['user_id']):
+            if budget['id'] == budget_id:
+                return budget
+
+    @staticmethod
+    def _make_budget(row):
+        limit = row['amount_limit']
+        spent = row['spent']
+        return {
+            'id': row['id'],
+            'category_id': row['category_id'],
+            'period': row['period'],
+            'period_start': row['period_start'],
+            'limit': limit / 100,
+            'spent': spent / 100,
+            'remaining': (limit - spent) / 100,
+            'alert_at': row['alert_at'],
+            'alert': spent * 100 >= limit * row['alert_at'],
+            'exceeded': spent > limit,
+        }
+
+    def create_budget(self, user_id, budget_data):
+        """
+        Создание бюджета
+        :param user_id: id пользователя
+        :param budget_data: Информация о бюджете (id категории, период, лимит,
+            процент лимита для предупреждения (если есть))
+        :return: Созданный бюджет
+        """
+        category_id = budget_data.get('category_id')
+        row = self.select_row(
+            ['tree_path'],
+            table_name='category',
+            where='user_id',
+            equals_to=user_id,
+            where_and='id',
+            and_equals_to=category_id,
+        )
+        if row is None:
+            raise BrokenRulesError(f'Category with id {category_id} does not exist for that user.')
+        if budget_data.get('period') not in PERIODS:
+            raise BrokenRulesError(f'Period must be one of: {", ".join(PERIODS)}.')
+        if not budget_data.get('limit') or budget_data['limit'] <= 0:
+            raise BrokenRulesError('Limit must be > 0.')
+        alert_at = budget_data.get('alert_at', 100)
+        if not 0 < alert_at <= 100:
+            raise BrokenRulesError('Alert threshold must be a percentage of the limit.')
+
+        try:
+            budget_id = self.insert_row(
+                table_name='budget',
+                id_field='id',
+                user_id=user_id,
+                category_id=category_id,
+                period=budget_data['period'],
+                amount_limit=round(budget_data['limit'] * 100),
+                alert_at=alert_at,
+            )
+        except sqlite3.IntegrityError:
+            raise ConflictError(f'Budget for category {category_id} and period {budget_data["period"]} already exists.')
+        self._seed_budget(budget_id, user_id, row['tree_path'], budget_data['period'])
+        return self.get_budget_by_id(budget_id)
+
+    def delete_budget(self, budget_id):
+        """
+        Удаление бюджета
+        :param budget_id: id бюджета
+        """
+        self.connection.execute(
+            'DELETE FROM budget '
+            'WHERE id = ?',
+            (budget_id,),
+        )
+
+    def is_owner(self, user_id, budget_id):
+        """
+        Проверка, является ли пользователь владельцем бюджета
+        :param user_id: id пользователя
+        :param budget_id: id бюджета
+        :return: true/false - является или нет
+        """
+        row = self.select_row(['user_id'], table_name='budget', where='id', equals_to=budget_id)
+        return row is None or row['user_id'] == user_id
+
+    def refresh_budgets(self, user_id):
+        """
+        Пересчет текущих и будущих периодов всех бюджетов пользователя.
+        Нужен после изменения дерева категорий, когда у поддерева меняются предки
+        :param user_id: id пользователя
+        """
+        cur = self.connection.execute(
+            'SELECT budget.id, budget.period, category.tree_path '
+            'FROM budget '
+            'INNER JOIN category ON category.id = budget.category_id '
+            'WHERE budget.user_id = ?',
+            (user_id,),
+        )
+        for row in cur.fetchall():
+            self._seed_budget(row['id'], user_id, row['tree_path'], row['period'])
+
+    def _seed_budget(self, budget_id, user_id, tree_path, period):
+        """
+        Подсчет расходов бюджета за текущий и будущие периоды по операциям.
+        Текущий период всегда младше горизонта архивации, поэтому достаточно горячей таблицы
+        :param budget_id: id бюджета
+        :param user_id: id пользователя
+        :param tree_path: Путь категории бюджета
+        :param period: Период бюджета
+        """
+        current_start = get_period_start(period, date.today()).isoformat()
+        cur = self.connection.execute(
+            'SELECT operation.operation_date, operation.amount '
+            'FROM operation '
+            'INNER JOIN category ON category.id = operation.category_id '
+            "WHERE operation.user_id = ? AND operation.type = 'expenses'"
+            ' AND category.tree_path LIKE ?'
+            " AND strftime('%s', operation.operation_date) >= strftime('%s', ?)",
+            (user_id, tree_path + '%', current_start),
+        )
+        spent = {}
+        for row in cur.fetchall():
+            period_start = get_period_start(period, datetime.fromisoformat(row['operation_date']).date()).isoformat()
+            spent[period_start] = spent.get(period_start, 0) - row['amount']
+
+        self.connection.execute(
+            'DELETE FROM budget_spend '
+            'WHERE budget_id = ? AND period_start >= ?',
+            (budget_id, current_start),
+        )
+        self.connection.executemany(
+            'INSERT INTO budget_spend(budget_id, user_id, period_start, spent) '
+            'VALUES (?, ?, ?, ?)',
+            [(budget_id, user_id, period_start, amount) for period_start, amount in spent.items()],
+        )
+
+    def apply_operation(self, old_operation, new_operation):
+        """
+        Изменение счетчиков бюджетов после изменения операции: старое состояние вычитается,
+        новое прибавляется, поэтому смена категории, суммы, даты и типа учитываются одинаково
+        :param old_operation: Операция до изменения (None при создании)
+        :param new_operation: Операция после изменения (None при удалении)
+        """
+        for sign, operation in ((-1, old_operation), (1, new_operation)):
+            if operation is None or operation['type'] != 'expenses' or operation['category_id'] is None:
+                continue
+            # Бюджет относится к операции, если его категория есть в пути категории операции
+            cur = self.connection.execute(
+                'SELECT budget.id, budget.period '
+                'FROM budget '
+                'INNER JOIN category ON category.id = ? '
+                'WHERE budget.user_id = ?'
+                " AND instr(category.tree_path, printf('%08d', budget.category_id)) > 0",
+                (operation['category_id'], operation['user_id']),
+            )
+            day = datetime.fromisoformat(operation['operation_date']).date()
+            self.connection.executemany(
+                'INSERT INTO budget_spend(budget_id, user_id, period_start, spent) '
+                'VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(budget_id, period_start) DO UPDATE SET spent = spent + excluded.spent',
+                [
+                    (row['id'], operation['user_id'], get_period_start(row['period'], day).isoformat(),
+                     -sign * operation['amount'])
+                    for row in cur.fetchall()
+                ],
+            )
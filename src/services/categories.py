@@ -1,27 +1,66 @@
+import json
 import sqlite3
+from collections import Counter
 
 from .base import BaseService
+from .budgets import BudgetsService
 from .exceptions import ConflictError, DoesNotExistError, BrokenRulesError
+from .sync import SyncService
 
 
 class CategoriesService(BaseService):
-    def get_categories(self, user_id):
+    def get_categories(self, user_id, root_id=None, depth=None):
         """
         Получение категорий пользователя
         :param user_id: id пользователя
-        :return: Все категории, созданные данным пользователем
+        :param root_id: id категории, поддерево которой нужно получить (если есть)
+        :param depth: Глубина поддерева относительно корня (если есть)
+        :return: Все категории, созданные данным пользователем (или категории поддерева)
         """
-        fields = ['id', 'title', 'parent_id', 'user_id']
-        rows = self.select_rows(
-            fields,
-            table_name='category',
-            where='user_id',
-            equals_to=user_id,
-            order_by='tree_path',
+        conditions = ['user_id = ?']
+        params = [user_id]
+        root_path = ''
+        if root_id is not None:
+            root_path = self.get_category_by_user_id(user_id, root_id)['tree_path']
+            # Путь состоит из цифр и точек, а '/' идет сразу после '.', поэтому в диапазон
+            # попадает сама категория и все пути, начинающиеся с её пути и точки
+            conditions.append('tree_path >= ? AND tree_path < ?')
+            params.extend([root_path, root_path + '/'])
+        if depth is not None:
+            # Каждый уровень добавляет к пути 9 символов: точку и 8 цифр id
+            conditions.append('length(tree_path) <= ?')
+            params.append(len(root_path or '0' * 8) + depth * 9)
+        where_clause = ' AND '.join(conditions)
+        cur = self.connection.execute(
+            'SELECT id, title, parent_id, user_id '
+            'FROM category '
+            f'WHERE {where_clause} '
+            'ORDER BY tree_path',
+            params,
         )
-        categories = [dict(row) for row in rows]
+        categories = [dict(row) for row in cur.fetchall()]
         return categories
 
+    @staticmethod
+    def make_tree(categories):
+        """
+        Построение вложенного дерева за один проход по категориям, отсортированным по tree_path:
+        родитель всегда идет раньше потомков, поэтому к моменту обработки категории он уже в дереве
+        :param categories: Категории в порядке tree_path
+        :return: Корневые категории со списками потомков (children)
+        """
+        nodes = {}
+        roots = []
+        for category in categories:
+            node = dict(category, children=[])
+            nodes[node['id']] = node
+            parent = nodes.get(node['parent_id'])
+            if parent is None:
+                roots.append(node)
+            else:
+                parent['children'].append(node)
+        return roots
+
     def _get_category_path(self, category_id):
         """
         Получение пути внутри дерева для категории
@@ -111,10 +150,92 @@ class CategoriesService(BaseService):
             path = parent_path + '.' + current_node
 
         self._update_category(category_id, tree_path=path)
+        SyncService(self.connection).stamp('category', user_id, [category_id])
         self.connection.commit()
 
         return category_data
 
+    def create_category_tree(self, user_id, tree_data):
+        """
+        Создание дерева категорий одной транзакцией.
+        id назначаются заранее от текущего значения sqlite_sequence, поэтому tree_path всех узлов
+        считается за один проход и все узлы добавляются одним executemany.
+        BEGIN IMMEDIATE сразу берет блокировку на запись, чтобы никто не занял эти id
+        :param user_id: id пользователя
+        :param tree_data: Дерево (id родителя для корней (если есть), список категорий,
+            у каждой имя и список потомков (если есть))
+        :return: Созданные категории в порядке tree_path
+        """
+        roots = tree_data.get('categories')
+        if not isinstance(roots, list) or not roots:
+            raise BrokenRulesError('Field "categories" must be a non-empty list.')
+
+        nodes = []
+        stack = [(node, tree_data.get('parent_id')) for node in reversed(roots)]
+        while stack:
+            node, parent = stack.pop()
+            if not isinstance(node, dict) or not isinstance(node.get('title'), str) or not node['title']:
+                raise BrokenRulesError('Every category must have a title.')
+            children = node.get('children') or []
+            if not isinstance(children, list):
+                raise BrokenRulesError('Field "children" must be a list.')
+            nodes.append((node, parent))
+            stack.extend((child, node) for child in reversed(children))
+
+        if not self.connection.in_transaction:
+            self.connection.execute('BEGIN IMMEDIATE')
+
+        parent_path = None
+        if tree_data.get('parent_id') is not None:
+            try:
+                parent_path = self.get_category_by_user_id(user_id, tree_data['parent_id'])['tree_path']
+            except DoesNotExistError:
+                raise BrokenRulesError('Parent category does not exist.')
+
+        titles = [node['title'] for node, _ in nodes]
+        conflicts = {title for title, count in Counter(titles).items() if count > 1}
+        cur = self.connection.execute(
+            'SELECT title '
+            'FROM category '
+            'WHERE user_id = ? AND title IN (SELECT value FROM json_each(?))',
+            (user_id, json.dumps(titles)),
+        )
+        conflicts = sorted(conflicts.union(row['title'] for row in cur.fetchall()))
+        if conflicts:
+            error = ConflictError(f'Categories with names {", ".join(conflicts)} already exist.')
+            error.error['conflicts'] = conflicts
+            raise error
+
+        cur = self.connection.execute(f'SELECT {self.make_next_id("category")} AS next_id')
+        next_id = cur.fetchone()['next_id']
+
+        ids = {}
+        paths = {}
+        rows = []
+        for node, parent in nodes:
+            category_id = next_id + len(rows)
+            if isinstance(parent, dict):
+                parent_id = ids[id(parent)]
+                prefix = paths[id(parent)] + '.'
+            else:
+                parent_id = parent
+                prefix = '' if parent_path is None else parent_path + '.'
+            path = prefix + str(category_id).zfill(8)
+            ids[id(node)] = category_id
+            paths[id(node)] = path
+            rows.append((category_id, node['title'], parent_id, user_id, path))
+
+        self.connection.executemany(
+            'INSERT INTO category(id, title, parent_id, user_id, tree_path) '
+            'VALUES (?, ?, ?, ?, ?)',
+            rows,
+        )
+        SyncService(self.connection).stamp('category', user_id, [row[0] for row in rows])
+        return [
+            {'id': category_id, 'title': title, 'parent_id': parent_id, 'user_id': user_id}
+            for category_id, title, parent_id, user_id, _ in sorted(rows, key=lambda row: row[4])
+        ]
+
     def _create_category(self, user_id, category_data):
         """
         Добавление категории в базу данных
@@ -128,6 +249,7 @@ class CategoriesService(BaseService):
         try:
             category_id = self.insert_row(
                 table_name='category',
+                id_field='id',
                 title=category_data['title'],
                 parent_id=category_data.get('parent_id'),
                 user_id=user_id,
@@ -202,9 +324,11 @@ class CategoriesService(BaseService):
                 else:
                     new_path = current_node
                 self._update_tree_path_prefix(old_path, new_path)
+                BudgetsService(self.connection).refresh_budgets(user_id)
 
         self._update_category(category_id, **category_data)
         category = self.get_category_by_id(category_id)
+        SyncService(self.connection).stamp('category', category['user_id'], [category_id])
         category.pop('tree_path')
         return category
 
@@ -227,12 +351,37 @@ class CategoriesService(BaseService):
         :param category_id: id категории
         """
         try:
-            tree_path = self._get_category_path(category_id)
+            category = self.get_category_by_id(category_id)
         except DoesNotExistError:
             raise BrokenRulesError(f'Category with id {category_id} does not exist.')
-        self._delete_category(tree_path)
+        self._delete_category(category['user_id'], category['tree_path'])
+        # Операции поддерева остаются без категории и больше не учитываются в бюджетах предков
+        BudgetsService(self.connection).refresh_budgets(category['user_id'])
 
-    def _delete_category(self, tree_path):
+    def _delete_category(self, user_id, tree_path):
+        """
+        Удаление поддерева категорий. Удаленные категории и операции, которые остаются
+        без категории (ON DELETE SET NULL), записываются в журнал синхронизации
+        :param user_id: id пользователя
+        :param tree_path: Путь корня поддерева
+        """
+        cur = self.connection.execute(
+            'SELECT id '
+            'FROM category '
+            'WHERE tree_path LIKE ?',
+            (tree_path + '%',),
+        )
+        category_ids = [row['id'] for row in cur.fetchall()]
+        cur = self.connection.execute(
+            'SELECT id '
+            'FROM operation '
+            'WHERE category_id IN (SELECT value FROM json_each(?))',
+            (json.dumps(category_ids),),
+        )
+        operation_ids = [row['id'] for row in cur.fetchall()]
+        sync = SyncService(self.connection)
+        sync.stamp('category', user_id, category_ids, deleted=True)
+        sync.stamp('operation', user_id, operation_ids)
         self.connection.execute(
             'DELETE FROM category '
             'WHERE tree_path LIKE ?',
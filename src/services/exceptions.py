@@ -22,3 +22,23 @@ class BrokenRulesError(ServiceError):
 
 class BadRequest(ServiceError):
     code = 400
+
+
+class ServiceUnavailableError(ServiceError):
+    code = 503
+
+    def __init__(self, message, *args, retry_after=1):
+        super().__init__(message, *args)
+        self.retry_after = retry_after
+
+
+class TooManyRequestsError(ServiceError):
+    code = 429
+
+    def __init__(self, message, *args, retry_after=1):
+        super().__init__(message, *args)
+        self.retry_after = retry_after
+
+
+class QueryTimeoutError(ServiceError):
+    code = 504
@@ -0,0 +1,90 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from .base import BaseService
+from .exceptions import BadRequest, BrokenRulesError
+
+MAX_KEY_LENGTH = 255
+
+
+def make_request_hash(*parts):
+    """
+    Хэш запроса, чтобы отличить повтор запроса от другого запроса с тем же ключом
+    :param parts: Части запроса (query string, тело)
+    :return: sha256 в hex
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class IdempotencyService(BaseService):
+    """
+    Ключи идемпотентности (заголовок Idempotency-Key): ответ на запрос сохраняется вместе с ключом
+    в той же транзакции, что и изменение, поэтому повтор запроса после обрыва связи получает
+    сохраненный ответ одним поиском по первичному ключу и ничего не пишет.
+    Ключи хранятся IDEMPOTENCY_KEY_TTL секунд
+    """
+    def begin(self, user_id, key, request_hash):
+        """
+        Поиск сохраненного ответа. Если ответа нет, начинается транзакция с блокировкой на запись
+        и поиск повторяется: параллельный повтор того же запроса ждет коммита первого и получает его ответ
+        :param user_id: id пользователя
+        :param key: Ключ идемпотентности
+        :param request_hash: Хэш запроса
+        :return: Тело и статус сохраненного ответа или None, если запрос выполняется впервые
+        """
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise BadRequest(f'Idempotency key must be from 1 to {MAX_KEY_LENGTH} characters.')
+        response = self._get_response(user_id, key, request_hash)
+        if response is None:
+            if not self.connection.in_transaction:
+                self.connection.execute('BEGIN IMMEDIATE')
+            response = self._get_response(user_id, key, request_hash)
+        return response
+
+    def _get_response(self, user_id, key, request_hash):
+        row = self.select_row(
+            ['request_hash', 'status', 'response'],
+            table_name='idempotency_key',
+            where='user_id',
+            equals_to=user_id,
+            where_and='key',
+            and_equals_to=key,
+        )
+        if row is None:
+            return None
+        if row['request_hash'] != request_hash:
+            raise BrokenRulesError('Idempotency key was already used for another request.')
+        return json.loads(row['response']), row['status']
+
+    def save_response(self, user_id, key, request_hash, response, status):
+        """
+        Сохранение ответа (до коммита изменения)
+        :param user_id: id пользователя
+        :param key: Ключ идемпотентности
+        :param request_hash: Хэш запроса
+        :param response: Тело ответа
+        :param status: Статус ответа
+        """
+        self.insert_row(
+            table_name='idempotency_key',
+            user_id=user_id,
+            key=key,
+            request_hash=request_hash,
+            status=int(status),
+            response=json.dumps(response),
+            created_at=datetime.now().isoformat(),
+        )
+
+    def purge(self, ttl):
+        """
+        Удаление ключей старше ttl
+        :param ttl: Время жизни ключа в секундах
+        :return: Количество удаленных ключей
+        """
+        cur = self.connection.execute(
+            'DELETE FROM idempotency_key '
+            'WHERE created_at < ?',
+            ((datetime.now() - timedelta(seconds=ttl)).isoformat(),),
+        )
+        return cur.rowcount
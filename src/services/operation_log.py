@@ -0,0 +1,72 @@
+from .base import BaseService
+
+
+class OperationLogService(BaseService):
+    """
+    Журнал изменений операций. Записи только добавляются: изменение операции
+    пишется двумя строками - старое состояние со знаком -1 и новое со знаком +1,
+    поэтому любое изменение агрегатов считается как SUM(sign * amount) и SUM(sign).
+    """
+    def write(self, old_operation, new_operation):
+        """
+        Запись изменения операции в журнал
+        :param old_operation: Операция до изменения (None при создании)
+        :param new_operation: Операция после изменения (None при удалении)
+        """
+        if old_operation is None:
+            action = 'insert'
+        elif new_operation is None:
+            action = 'delete'
+        else:
+            action = 'update'
+
+        rows = []
+        for sign, operation in ((-1, old_operation), (1, new_operation)):
+            if operation is None:
+                continue
+            rows.append((
+                operation['user_id'],
+                operation['id'],
+                action,
+                sign,
+                operation['type'],
+                operation['amount'],
+                operation['category_id'],
+                operation['operation_date'],
+            ))
+        self.connection.executemany(
+            'INSERT INTO operation_log'
+            '(user_id, operation_id, action, sign, type, amount, category_id, operation_date) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            rows,
+        )
+
+    def compact(self, keep_last):
+        """
+        Удаление старых записей журнала.
+        Вместо удаленных записей добавляется маркер 'compact' (user_id = 0), в operation_id
+        которого хранится id последней удаленной записи: кэши, построенные раньше, пересобираются полностью
+        :param keep_last: Количество последних записей, которые нужно оставить
+        :return: Количество удаленных записей
+        """
+        cur = self.connection.execute('SELECT MAX(id) AS last_id FROM operation_log')
+        last_id = cur.fetchone()['last_id']
+        if last_id is None or last_id <= keep_last:
+            return 0
+        compacted_through = last_id - keep_last
+        cur = self.connection.execute(
+            'DELETE FROM operation_log '
+            'WHERE id <= ?',
+            (compacted_through,),
+        )
+        if not cur.rowcount:
+            return 0
+        self.insert_row(
+            table_name='operation_log',
+            user_id=0,
+            operation_id=compacted_through,
+            action='compact',
+            sign=0,
+            amount=0,
+        )
+        return cur.rowcount
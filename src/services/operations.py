@@ -1,8 +1,17 @@
+import hashlib
+import json
 from datetime import datetime
 
+from .balances import BalancesService
 from .base import BaseService
+from .budgets import BudgetsService
 from .categories import CategoriesService
+from .operation_log import OperationLogService
+from .partitions import OPERATION_FIELDS, PartitionsService, get_year
+from .search import SearchService
+from .sync import SyncService
 from .exceptions import (
+    ConflictError,
     DoesNotExistError,
     BrokenRulesError
 )
@@ -20,6 +29,16 @@ def check_amount(operation_type, amount):
         raise BrokenRulesError('Expenses must be < 0.')
 
 
+def make_fingerprint(operation):
+    """
+    Отпечаток операции для поиска дубликатов при импорте
+    :param operation: Операция (сумма в копейках)
+    :return: sha256 от пользователя, даты, суммы и описания
+    """
+    content = [operation['user_id'], operation['operation_date'], operation['amount'], operation['description']]
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+
 def validate_date(operation):
     try:
         operation['operation_date'] = datetime.fromisoformat(operation['operation_date']).isoformat()
@@ -36,6 +55,51 @@ class OperationsService(BaseService):
             id категории(если есть), дата)
         :return: Созданная операция
         """
+        self._prepare_operation(user, operation_data)
+        return self._insert_operation(operation_data)
+
+    def import_operation(self, user, operation_data):
+        """
+        Создание операции без дубликатов (импорт выписок): если у пользователя уже есть операция,
+        созданная импортом, с той же датой, суммой и описанием, возвращается она
+        :param user: Пользователь
+        :param operation_data: данные об операции (как в create_operation)
+        :return: Операция и создана ли она
+        """
+        self._prepare_operation(user, operation_data)
+        fingerprint = make_fingerprint(operation_data)
+        if not self.connection.in_transaction:
+            self.connection.execute('BEGIN IMMEDIATE')
+        row = self.select_row(
+            ['operation_id', 'operation_date'],
+            table_name='operation_fingerprint',
+            where='user_id',
+            equals_to=user['id'],
+            where_and='fingerprint',
+            and_equals_to=fingerprint,
+        )
+        if row is not None:
+            duplicate = self._get_operation_row(row['operation_id'])
+            if duplicate is None:
+                duplicate = self._get_archived_operation_row(row['operation_id'], row['operation_date'])
+            return dict(duplicate, amount=duplicate['amount'] / 100), False
+
+        operation = self._insert_operation(operation_data)
+        self.insert_row(
+            table_name='operation_fingerprint',
+            user_id=user['id'],
+            fingerprint=fingerprint,
+            operation_id=operation['id'],
+            operation_date=operation['operation_date'],
+        )
+        return operation, True
+
+    def _prepare_operation(self, user, operation_data):
+        """
+        Проверка и приведение данных новой операции к виду, в котором она хранится
+        :param user: Пользователь
+        :param operation_data: данные об операции
+        """
         operation_data['user_id'] = user['id']
 
         if not operation_data.get('type'):
@@ -54,7 +118,7 @@ class OperationsService(BaseService):
         if operation_data['type'] not in ('income', 'expenses'):
             raise BrokenRulesError('Wrong operation type.')
         check_amount(operation_data['type'], operation_data['amount'])
-        operation_data['amount'] = int(operation_data['amount'] * 100)
+        operation_data['amount'] = round(operation_data['amount'] * 100)
 
         operation_data['record_date'] = datetime.now().isoformat()
         if operation_data.get('operation_date') is None:
@@ -63,8 +127,16 @@ class OperationsService(BaseService):
 
         operation_data.setdefault('description', None)
 
+    def _insert_operation(self, operation_data):
+        """
+        Добавление подготовленной операции
+        :param operation_data: данные об операции
+        :return: Созданная операция
+        """
         operation_id = self._create_operation(operation_data)
-        return self.get_operation_by_id(operation_id)
+        operation = self._get_operation_row(operation_id)
+        self._after_write(None, operation)
+        return dict(operation, amount=operation['amount'] / 100)
 
     def _create_operation(self, operation_data):
         """
@@ -74,6 +146,7 @@ class OperationsService(BaseService):
         """
         operation_id = self.insert_row(
             table_name='operation',
+            id_field='id',
             **operation_data
         )
         return operation_id
@@ -84,6 +157,18 @@ class OperationsService(BaseService):
         :param operation_id: id операции
         :return: Операция
         """
+        operation = self._get_operation_row(operation_id)
+        if operation is None:
+            raise DoesNotExistError(f'Operation with id {operation_id} does not exist.')
+        operation['amount'] /= 100
+        return operation
+
+    def _get_operation_row(self, operation_id):
+        """
+        Получение операции в том виде, в котором она хранится в базе данных (сумма в копейках)
+        :param operation_id: id операции
+        :return: Операция или None, если её нет
+        """
         fields = [
             'id',
             'type',
@@ -101,10 +186,72 @@ class OperationsService(BaseService):
             fields=fields
         )
         if row is None:
-            raise DoesNotExistError(f'Operation with id {operation_id} does not exist.')
-        operation = dict(row)
-        operation['amount'] /= 100
-        return operation
+            return None
+        return dict(row)
+
+    def _get_archived_operation_row(self, operation_id, operation_date):
+        """
+        Получение операции из архива её года
+        :param operation_id: id операции
+        :param operation_date: Дата операции
+        :return: Операция (сумма в копейках)
+        """
+        source = PartitionsService(self.connection).get_operations_source(operation_date, operation_date)
+        cur = self.connection.execute(
+            f'SELECT {self.make_select_fields(OPERATION_FIELDS)} '
+            f'FROM {source} AS operation '
+            'WHERE id = ?',
+            (operation_id,),
+        )
+        return dict(cur.fetchone())
+
+    def _find_operation_row(self, operation_id):
+        """
+        Поиск операции в горячей таблице, затем в архивах
+        :param operation_id: id операции
+        :return: Операция (сумма в копейках) и её архив (год, путь к файлу) или None для горячей таблицы;
+            (None, None), если операции нет
+        """
+        row = self._get_operation_row(operation_id)
+        if row is not None:
+            return row, None
+        return PartitionsService(self.connection).find_archived_operation(operation_id)
+
+    def _attach_archives_for_write(self, operation_id, *archives):
+        """
+        Подключение архивов на запись перед изменением архивной операции. Архив подключается
+        только вне транзакции, поэтому в пакете запросов архивную операцию изменить нельзя
+        :param operation_id: id операции
+        :param archives: Архивы (год, путь к файлу)
+        :return: Имена схем архивов в том же порядке
+        """
+        if self.connection.in_transaction:
+            raise ConflictError(f'Operation with id {operation_id} is archived, change it with a separate request.')
+        return PartitionsService(self.connection).attach_for_write(*archives)
+
+    def _after_write(self, old_operation, new_operation):
+        """
+        Обработка изменения операции в той же транзакции, что и само изменение
+        :param old_operation: Операция до изменения (None при создании)
+        :param new_operation: Операция после изменения (None при удалении)
+        """
+        OperationLogService(self.connection).write(old_operation, new_operation)
+        SearchService(self.connection).index_operation(old_operation, new_operation)
+        BudgetsService(self.connection).apply_operation(old_operation, new_operation)
+        BalancesService(self.connection).apply_operation(old_operation, new_operation)
+        if old_operation is not None and (
+            new_operation is None or make_fingerprint(old_operation) != make_fingerprint(new_operation)
+        ):
+            # Измененная операция больше не совпадает со строкой выписки, из которой создана
+            self.connection.execute(
+                'DELETE FROM operation_fingerprint '
+                'WHERE operation_id = ?',
+                (old_operation['id'],),
+            )
+        operation = new_operation or old_operation
+        SyncService(self.connection).stamp(
+            'operation', operation['user_id'], [operation['id']], deleted=new_operation is None,
+        )
 
     def update_operation(self, user_id, operation_id, operation_data):
         """
@@ -116,10 +263,10 @@ class OperationsService(BaseService):
         :param user_id: id пользователя
         :return: Изменённая операция
         """
-        try:
-            old_operation = self.get_operation_by_id(operation_id)
-        except DoesNotExistError:
+        old_row, archive = self._find_operation_row(operation_id)
+        if old_row is None:
             raise BrokenRulesError(f'Operation with id {operation_id} does not exist.')
+        old_operation = dict(old_row, amount=old_row['amount'] / 100)
 
         if operation_data.get('type'):
             if operation_data['type'] not in ('income', 'expenses'):
@@ -127,7 +274,7 @@ class OperationsService(BaseService):
             if operation_data['type'] != old_operation['type']:
                 operation_data.setdefault('amount', -old_operation['amount'])
             check_amount(operation_data['type'], operation_data['amount'])
-            operation_data['amount'] = int(operation_data['amount'] * 100)
+            operation_data['amount'] = round(operation_data['amount'] * 100)
 
         if operation_data.get('category_id'):
             service = CategoriesService(self.connection)
@@ -136,42 +283,77 @@ class OperationsService(BaseService):
         if operation_data.get('operation_date'):
             validate_date(operation_data)
 
-        self.update_row(
-            table_name='operation',
-            where='id',
-            equals_to=operation_id,
-            **operation_data
-        )
-        return self.get_operation_by_id(operation_id)
+        if archive is None:
+            self.update_row(
+                table_name='operation',
+                where='id',
+                equals_to=operation_id,
+                **operation_data
+            )
+            operation = self._get_operation_row(operation_id)
+        else:
+            operation = self._update_archived_operation(old_row, archive, operation_data)
+        self._after_write(old_row, operation)
+        return dict(operation, amount=operation['amount'] / 100)
+
+    def _update_archived_operation(self, old_row, archive, operation_data):
+        """
+        Изменение архивной операции. Если операция переходит в другой год, она переносится
+        в архив этого года, а если года нет в архиве - в горячую таблицу
+        :param old_row: Операция до изменения (сумма в копейках)
+        :param archive: Архив операции (год, путь к файлу)
+        :param operation_data: Измененные поля
+        :return: Операция после изменения (сумма в копейках)
+        """
+        operation = dict(old_row, **operation_data)
+        target = archive
+        if get_year(operation['operation_date']) != archive[0]:
+            target = PartitionsService(self.connection).get_archive(operation['operation_date'])
+        archives = [archive] if target is None or target == archive else [archive, target]
+        schemas = self._attach_archives_for_write(old_row['id'], *archives)
+        schema = schemas[0]
+        target_schema = 'main' if target is None else schemas[-1]
+        if schema == target_schema:
+            self.update_row(
+                table_name=f'{schema}.operation',
+                where='id',
+                equals_to=old_row['id'],
+                **operation_data
+            )
+        else:
+            self.connection.execute(
+                f'DELETE FROM {schema}.operation '
+                'WHERE id = ?',
+                (old_row['id'],),
+            )
+            self.insert_row(
+                table_name=f'{target_schema}.operation',
+                **{field: operation[field] for field in OPERATION_FIELDS}
+            )
+        return operation
 
     def delete_operation(self, operation_id):
         """
         Удаление операции
         :param operation_id: id операции
         """
-        try:
-            self.get_operation_by_id(operation_id)
-        except DoesNotExistError:
+        old_row, archive = self._find_operation_row(operation_id)
+        if old_row is None:
             raise BrokenRulesError(f'Operation with id {operation_id} does not exist.')
+        schema = 'main' if archive is None else self._attach_archives_for_write(operation_id, archive)[0]
         self.connection.execute(
-            'DELETE FROM operation '
+            f'DELETE FROM {schema}.operation '
             'WHERE id = ?',
             (operation_id,),
         )
+        self._after_write(old_row, None)
 
     def is_owner(self, user_id, operation_id):
         """
-        Проверка, является ли пользователь создателем операции
+        Проверка, является ли пользователь создателем операции (в том числе архивной)
         :param user_id: id пользователя
         :param operation_id: id операции
-        :return: true/false - является или нет
+        :return: true/false - является или нет (false, если операции нет)
         """
-        cur = self.connection.execute(
-            'SELECT (user.id = ?) AS is_owner '
-            'FROM operation '
-            'INNER JOIN user ON user.id = operation.user_id '
-            'WHERE operation.id = ?',
-            (user_id, operation_id,),
-        )
-        row = cur.fetchone()
-        return row is None or bool(row['is_owner'])
+        row, _ = self._find_operation_row(operation_id)
+        return row is not None and row['user_id'] == user_id
@@ -0,0 +1,297 @@
+import sqlite3
+from contextlib import closing
+
+from .base import BaseService
+from .exceptions import BadRequest
+
+# Сколько баз можно подключить к одному соединению (SQLITE_MAX_ATTACHED по умолчанию)
+MAX_ATTACHED = 10
+
+OPERATION_FIELDS = [
+    'id',
+    'type',
+    'amount',
+    'description',
+    'category_id',
+    'record_date',
+    'operation_date',
+    'user_id',
+]
+
+ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {schema}.operation (
+    id             INTEGER NOT NULL PRIMARY KEY,
+    type           TEXT NOT NULL,
+    amount         INTEGER NOT NULL,
+    description    TEXT,
+    category_id    INTEGER,
+    record_date    TEXT NOT NULL,
+    operation_date TEXT NOT NULL,
+    user_id        INTEGER NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS {schema}.operation_user_id_idx ON operation(user_id, operation_date);
+"""
+
+
+def get_year(date):
+    """
+    Год даты из query string
+    :param date: Дата (строка в ISO формате или datetime)
+    :return: Год или None, если его не удалось определить
+    """
+    try:
+        return int(str(date)[:4])
+    except ValueError:
+        return None
+
+
+class PartitionsService(BaseService):
+    """
+    Операции старше горизонта хранятся в архивных базах, по одной на год.
+    Архивы перечислены в таблице operation_archive горячей базы и подключаются (ATTACH)
+    к соединению только тогда, когда запрошенный период пересекается с их годом.
+    Для изменения архивной операции её архив подключается на запись.
+    """
+    def get_operations_source(self, date_from=None, date_to=None, user_id=None):
+        """
+        Источник операций для FROM: горячая таблица и архивы лет, пересекающихся с периодом.
+        Архивы, подключенные раньше для других периодов, отключаются, если без этого не хватает
+        места для нужных. Если период пересекается больше чем с MAX_ATTACHED годами архива
+        (например, период не задан), операции пользователя из архивов копируются пачками
+        во временную таблицу; без user_id или внутри транзакции такой период нужно сузить
+        :param date_from: Начало периода (включительно)
+        :param date_to: Конец периода (не включительно)
+        :param user_id: id пользователя, операции которого читаются
+        :return: Имя таблицы или подзапрос с UNION ALL
+        """
+        archives = self._get_archives(date_from, date_to)
+        needed = {f'archive_{year}' for year, _ in archives}
+        if len(needed) > MAX_ATTACHED and user_id is not None and not self.connection.in_transaction:
+            return self._collect_archived_operations(user_id, date_from, date_to)
+        attached = self._get_attached_archives()
+        if len(needed | attached) > MAX_ATTACHED and not self.connection.in_transaction:
+            for schema in attached - needed:
+                self.connection.execute(f'DETACH DATABASE {schema}')
+            attached &= needed
+        if len(needed | attached) > MAX_ATTACHED:
+            raise BadRequest(f'Period covers more than {MAX_ATTACHED} archived years, narrow it down.')
+
+        schemas = [self._attach_archive(year, path) for year, path in archives]
+        if not schemas:
+            return 'operation'
+
+        fields = self.make_select_fields(OPERATION_FIELDS)
+        selects = [f'SELECT {fields} FROM main.operation']
+        selects.extend(f'SELECT {fields} FROM {schema}.operation' for schema in schemas)
+        return '({})'.format(' UNION ALL '.join(selects))
+
+    def iter_archive_sources(self, date_from=None, date_to=None):
+        """
+        Архивы лет, пересекающихся с периодом, пачками не больше MAX_ATTACHED - для чтения
+        всей истории. Архивы прошлой пачки отключаются перед подключением следующей,
+        поэтому вызывать нужно вне транзакции, а строки пачки дочитывать до перехода к следующей
+        :param date_from: Начало периода (включительно)
+        :param date_to: Конец периода (не включительно)
+        :return: Генератор источников для FROM (подзапрос с UNION ALL архивов пачки, без горячей таблицы)
+        """
+        archives = self._get_archives(date_from, date_to)
+        fields = self.make_select_fields(OPERATION_FIELDS)
+        try:
+            for start in range(0, len(archives), MAX_ATTACHED):
+                self.detach_archives()
+                schemas = [self._attach_archive(year, path) for year, path in archives[start:start + MAX_ATTACHED]]
+                yield '({})'.format(' UNION ALL '.join(f'SELECT {fields} FROM {schema}.operation' for schema in schemas))
+        finally:
+            self.detach_archives()
+
+    def _collect_archived_operations(self, user_id, date_from, date_to):
+        """
+        Копирование архивных операций пользователя за период во временную таблицу соединения
+        (через iter_archive_sources, поэтому вызывать нужно вне транзакции)
+        :param user_id: id пользователя
+        :param date_from: Начало периода
+        :param date_to: Конец периода
+        :return: Подзапрос с UNION ALL горячей таблицы и временной
+        """
+        fields = self.make_select_fields(OPERATION_FIELDS)
+        self.connection.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS archived_operation AS '
+            f'SELECT {fields} FROM main.operation WHERE 0'
+        )
+        self.connection.execute('DELETE FROM temp.archived_operation')
+        self.connection.commit()
+        for source in self.iter_archive_sources(date_from, date_to):
+            self.connection.execute(
+                f'INSERT INTO temp.archived_operation({fields}) '
+                f'SELECT {fields} FROM {source} '
+                'WHERE user_id = ?',
+                (user_id,),
+            )
+            self.connection.commit()
+        return f'(SELECT {fields} FROM main.operation UNION ALL SELECT {fields} FROM temp.archived_operation)'
+
+    def find_archived_operation(self, operation_id):
+        """
+        Поиск операции в архивах. Архивы читаются отдельными соединениями, поэтому искать можно
+        и внутри транзакции
+        :param operation_id: id операции
+        :return: Операция (сумма в копейках) и архив с ней (год, путь к файлу) или (None, None)
+        """
+        fields = self.make_select_fields(OPERATION_FIELDS)
+        for year, path in self._get_archives(None, None):
+            with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as connection:
+                connection.row_factory = sqlite3.Row
+                cur = connection.execute(
+                    f'SELECT {fields} '
+                    'FROM operation '
+                    'WHERE id = ?',
+                    (operation_id,),
+                )
+                row = cur.fetchone()
+            if row is not None:
+                return dict(row), (year, path)
+        return None, None
+
+    def get_archive(self, date):
+        """
+        Архив года даты
+        :param date: Дата
+        :return: Год и путь к файлу архива или None, если год не в архиве
+        """
+        row = self.select_row(['year', 'path'], table_name='operation_archive', where='year', equals_to=get_year(date))
+        if row is None:
+            return None
+        return row['year'], row['path']
+
+    def attach_for_write(self, *archives):
+        """
+        Подключение архивов на запись. Подключенные раньше архивы отключаются,
+        поэтому вызывать нужно вне транзакции
+        :param archives: Архивы (год, путь к файлу)
+        :return: Имена схем архивов в том же порядке
+        """
+        self.detach_archives()
+        return [self._attach_archive(year, path, read_only=False) for year, path in archives]
+
+    def detach_archives(self):
+        """
+        Отключение всех подключенных архивов
+        """
+        for schema in self._get_attached_archives():
+            self.connection.execute(f'DETACH DATABASE {schema}')
+
+    def _get_attached_archives(self):
+        """
+        Получение имен схем подключенных архивов
+        :return: Множество имен
+        """
+        cur = self.connection.execute('PRAGMA database_list')
+        return {row['name'] for row in cur.fetchall() if row['name'].startswith('archive_')}
+
+    def _get_archives(self, date_from, date_to):
+        """
+        Получение архивов, годы которых пересекаются с периодом
+        :param date_from: Начало периода
+        :param date_to: Конец периода
+        :return: Список (год, путь к файлу архива)
+        """
+        year_from = get_year(date_from) if date_from else None
+        year_to = get_year(date_to) if date_to else None
+        cur = self.connection.execute(
+            'SELECT year, path '
+            'FROM operation_archive '
+            'ORDER BY year'
+        )
+        return [
+            (row['year'], row['path'])
+            for row in cur.fetchall()
+            if (year_from is None or row['year'] >= year_from) and (year_to is None or row['year'] <= year_to)
+        ]
+
+    def _attach_archive(self, year, path, read_only=True):
+        """
+        Подключение архива к соединению (если он еще не подключен)
+        :param year: Год архива
+        :param path: Путь к файлу архива
+        :param read_only: Подключить только для чтения
+        :return: Имя схемы архива
+        """
+        schema = f'archive_{year}'
+        if schema in self._get_attached_archives():
+            return schema
+        if read_only:
+            path = f'file:{path}?mode=ro'
+        self.connection.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+        return schema
+
+    def delete_archived_operations(self, user_id):
+        """
+        Удаление архивных операций пользователя (при переносе пользователя в другой шард).
+        Архивы подключаются на запись, поэтому вызывать нужно вне транзакции
+        :param user_id: id пользователя
+        :return: Количество удаленных операций
+        """
+        # Архивы, подключенные раньше только для чтения, нужно подключить заново
+        self.detach_archives()
+        deleted = 0
+        for year, path in self._get_archives(None, None):
+            schema = self._attach_archive(year, path, read_only=False)
+            cur = self.connection.execute(
+                f'DELETE FROM {schema}.operation '
+                'WHERE user_id = ?',
+                (user_id,),
+            )
+            deleted += cur.rowcount
+            self.connection.commit()
+            self.connection.execute(f'DETACH DATABASE {schema}')
+        return deleted
+
+    def archive_operations(self, before_year, get_archive_path):
+        """
+        Перенос операций годов раньше before_year в архивные базы
+        :param before_year: Первый год, который остается в горячей базе
+        :param get_archive_path: Функция, возвращающая путь к файлу архива по году
+        :return: Количество перенесенных операций по годам
+        """
+        cur = self.connection.execute(
+            "SELECT DISTINCT CAST(strftime('%Y', operation_date) AS INTEGER) AS year "
+            'FROM operation '
+            "WHERE strftime('%s', operation_date) < strftime('%s', ?)",
+            (f'{before_year:04d}-01-01',),
+        )
+        years = [row['year'] for row in cur.fetchall() if row['year'] is not None]
+
+        moved = {}
+        for year in years:
+            row = self.select_row(['path'], table_name='operation_archive', where='year', equals_to=year)
+            path = row['path'] if row is not None else get_archive_path(year)
+            schema = self._attach_archive(year, path, read_only=False)
+            self.connection.executescript(ARCHIVE_SCHEMA.format(schema=schema))
+
+            fields = self.make_select_fields(OPERATION_FIELDS)
+            year_condition = (
+                "strftime('%s', operation_date) >= strftime('%s', ?) "
+                "AND strftime('%s', operation_date) < strftime('%s', ?)"
+            )
+            year_params = (f'{year:04d}-01-01', f'{year + 1:04d}-01-01')
+            self.connection.execute(
+                f'INSERT INTO {schema}.operation({fields}) '
+                f'SELECT {fields} FROM main.operation '
+                f'WHERE {year_condition}',
+                year_params,
+            )
+            cur = self.connection.execute(
+                'DELETE FROM main.operation '
+                f'WHERE {year_condition}',
+                year_params,
+            )
+            moved[year] = cur.rowcount
+            self.connection.execute(
+                'INSERT OR IGNORE INTO operation_archive(year, path) '
+                'VALUES (?, ?)',
+                (year, path),
+            )
+            self.connection.commit()
+            self.connection.execute(f'DETACH DATABASE {schema}')
+        return moved
@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .exceptions import ServiceUnavailableError
+
+
+class PasswordHasher:
+    """
+    Хэширование паролей в отдельном ограниченном пуле потоков.
+    pbkdf2 в hashlib отпускает GIL, поэтому хэширование не останавливает остальные запросы воркера,
+    а ограничение очереди не дает всплеску логинов занять все потоки: лишние запросы сразу получают 503.
+    Метод хранится в начале хэша, и по нему определяется, нужно ли перехэшировать пароль
+    """
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256:150000'
+        self.salt_length = 8
+        self._stored_method = None
+        self._executor = None
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self._stored_method = None
+        self.salt_length = app.config['PASSWORD_SALT_LENGTH']
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE_SIZE'])
+
+    def generate(self, password):
+        """
+        Хэширование пароля с текущими параметрами
+        :param password: Пароль
+        :return: Хэш пароля
+        """
+        return self._run(generate_password_hash, password, method=self.method, salt_length=self.salt_length)
+
+    def check(self, password_hash, password):
+        """
+        Проверка пароля
+        :param password_hash: Сохраненный хэш пароля
+        :param password: Пароль
+        :return: true/false - совпадает или нет
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        Проверка, посчитан ли хэш с устаревшими параметрами
+        :param password_hash: Сохраненный хэш пароля
+        :return: true/false - нужно перехэшировать или нет
+        """
+        return password_hash.split('$', 1)[0] != self.stored_method
+
+    @property
+    def stored_method(self):
+        """
+        Метод в том виде, в котором Werkzeug пишет его в начало хэша: к методу без параметров
+        (pbkdf2:sha256) добавляются значения по умолчанию (pbkdf2:sha256:150000).
+        Определяется один раз, хэшированием пустого пароля
+        """
+        if self._stored_method is None:
+            self._stored_method = generate_password_hash('', method=self.method, salt_length=1).split('$', 1)[0]
+        return self._stored_method
+
+    def _run(self, func, *args, **kwargs):
+        if self._executor is None:
+            return func(*args, **kwargs)
+        if not self._slots.acquire(blocking=False):
+            raise ServiceUnavailableError('Too many authentication requests, try again later.')
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+
+hasher = PasswordHasher()
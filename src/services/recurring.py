@@ -0,0 +1,228 @@
+import logging
+import re
+import sqlite3
+from datetime import datetime
+
+from .base import BaseService
+from .categories import CategoriesService
+from .exceptions import BrokenRulesError, DoesNotExistError, ServiceError
+from .operations import OperationsService, check_amount
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rule(rule, start_date):
+    """
+    Разбор правила повторения в формате RRULE (FREQ=MONTHLY;BYMONTHDAY=1)
+    :param rule: Правило
+    :param start_date: Дата первого повторения (datetime)
+    :return: Объект rrule
+    """
+    frequency = re.search(r'FREQ=(\w+)', rule.upper())
+    if frequency is None or frequency.group(1) not in FREQUENCIES:
+        raise BrokenRulesError(f'Rule frequency must be one of: {", ".join(FREQUENCIES)}.')
+
+    # dateutil заметно замедляет импорт приложения, а нужен только правилам повторения
+    from dateutil.rrule import rrulestr
+
+    try:
+        return rrulestr(rule, dtstart=start_date)
+    except (ValueError, TypeError):
+        raise BrokenRulesError('Wrong rule format. It must be an RRULE, e.g. FREQ=MONTHLY;BYMONTHDAY=1')
+
+
+class RecurringService(BaseService):
+    """
+    Повторяющиеся операции. Правило хранит дату ближайшего повторения, которое еще не создано (next_date),
+    поэтому планировщик одним запросом по индексу находит все правила, у которых наступил срок.
+    Каждое повторение фиксируется в recurring_occurrence в той же транзакции, что и операция,
+    поэтому повторный или параллельный запуск планировщика не создает операцию дважды
+    """
+    def get_rules(self, user_id):
+        """
+        Получение правил пользователя
+        :param user_id: id пользователя
+        :return: Правила
+        """
+        fields = ['id', 'type', 'amount', 'description', 'category_id', 'rule', 'start_date', 'next_date']
+        rows = self.select_rows(fields, table_name='recurring_rule', where='user_id', equals_to=user_id, order_by='id')
+        return [dict(row, amount=row['amount'] / 100) for row in rows]
+
+    def get_rule_by_id(self, rule_id):
+        """
+        Получение правила по его id
+        :param rule_id: id правила
+        :return: Правило
+        """
+        fields = ['id', 'type', 'amount', 'description', 'category_id', 'rule', 'start_date', 'next_date']
+        row = self.select_row(fields, table_name='recurring_rule', where='id', equals_to=rule_id)
+        if row is None:
+            raise DoesNotExistError(f'Recurring rule with id {rule_id} does not exist.')
+        return dict(row, amount=row['amount'] / 100)
+
+    def create_rule(self, user_id, rule_data):
+        """
+        Создание правила повторяющейся операции
+        :param user_id: id пользователя
+        :param rule_data: Информация о правиле (тип, сумма, описание(если есть), id категории(если есть),
+            правило RRULE, дата первого повторения)
+        :return: Созданное правило
+        """
+        if rule_data.get('type') not in ('income', 'expenses'):
+            raise BrokenRulesError('Wrong operation type.')
+        if not rule_data.get('amount'):
+            raise BrokenRulesError('Missing field "amount".')
+        check_amount(rule_data['type'], rule_data['amount'])
+        if not rule_data.get('rule'):
+            raise BrokenRulesError('Missing field "rule".')
+
+        category_id = rule_data.get('category_id')
+        if category_id is not None:
+            try:
+                CategoriesService(self.connection).get_category_by_user_id(user_id, category_id)
+            except DoesNotExistError:
+                raise BrokenRulesError(f'Category with id {category_id} does not exist for that user.')
+
+        try:
+            start_date = datetime.fromisoformat(rule_data.get('start_date') or datetime.now().isoformat())
+        except ValueError:
+            raise BrokenRulesError('Wrong date format. It must be %Y-%m-%dT%H:%M:%S')
+        if start_date.tzinfo is not None:
+            # Планировщик сравнивает даты с локальным временем без часового пояса
+            start_date = start_date.astimezone().replace(tzinfo=None)
+        # Даты хранятся без микросекунд, чтобы их можно было сравнивать как строки
+        start_date = start_date.replace(microsecond=0)
+        next_date = parse_rule(rule_data['rule'], start_date).after(start_date, inc=True)
+        if next_date is None:
+            raise BrokenRulesError('Rule has no occurrences.')
+
+        rule_id = self.insert_row(
+            table_name='recurring_rule',
+            id_field='id',
+            user_id=user_id,
+            type=rule_data['type'],
+            amount=round(rule_data['amount'] * 100),
+            description=rule_data.get('description'),
+            category_id=category_id,
+            rule=rule_data['rule'],
+            start_date=start_date.isoformat(),
+            next_date=next_date.isoformat(),
+        )
+        return self.get_rule_by_id(rule_id)
+
+    def delete_rule(self, rule_id):
+        """
+        Удаление правила. Уже созданные операции остаются
+        :param rule_id: id правила
+        """
+        self.connection.execute(
+            'DELETE FROM recurring_rule '
+            'WHERE id = ?',
+            (rule_id,),
+        )
+
+    def is_owner(self, user_id, rule_id):
+        """
+        Проверка, является ли пользователь владельцем правила
+        :param user_id: id пользователя
+        :param rule_id: id правила
+        :return: true/false - является или нет
+        """
+        row = self.select_row(['user_id'], table_name='recurring_rule', where='id', equals_to=rule_id)
+        return row is None or row['user_id'] == user_id
+
+    def materialize_due(self, now, limit):
+        """
+        Создание операций для наступивших повторений всех пользователей.
+        За один вызов создается не больше limit операций, у правил сдвигается next_date,
+        поэтому следующий вызов продолжает с того места, где остановился предыдущий.
+        Правило, которое не удалось обработать, останавливается (next_date = NULL) и пишется в лог
+        :param now: Момент, до которого (включительно) создаются повторения
+        :param limit: Максимальное количество повторений за вызов
+        :return: Количество обработанных повторений
+        """
+        cur = self.connection.execute(
+            'SELECT id, user_id, type, amount, description, category_id, rule, start_date, next_date '
+            'FROM recurring_rule '
+            'WHERE next_date <= ? '
+            'ORDER BY next_date '
+            'LIMIT ?',
+            (now.isoformat(), limit),
+        )
+        rules = cur.fetchall()
+        service = OperationsService(self.connection)
+        processed = 0
+        for rule in rules:
+            # Ошибка в одном правиле откатывает только его повторения и не останавливает остальные
+            self.connection.execute('SAVEPOINT recurring_rule')
+            try:
+                processed += self._materialize_rule(service, rule, now, limit - processed)
+            except (TypeError, ValueError, ServiceError, sqlite3.IntegrityError):
+                logger.exception('Recurring rule %s failed and was stopped', rule['id'])
+                self.connection.execute('ROLLBACK TO recurring_rule')
+                self.update_row(table_name='recurring_rule', where='id', equals_to=rule['id'], next_date=None)
+            self.connection.execute('RELEASE recurring_rule')
+            if processed >= limit:
+                break
+        return processed
+
+    def _materialize_rule(self, service, rule, now, limit):
+        """
+        Создание операций для наступивших повторений одного правила и сдвиг его next_date
+        :param service: Сервис операций
+        :param rule: Правило
+        :param now: Момент, до которого (включительно) создаются повторения
+        :param limit: Максимальное количество повторений
+        :return: Количество обработанных повторений
+        """
+        occurrences = parse_rule(rule['rule'], datetime.fromisoformat(rule['start_date'])).xafter(
+            datetime.fromisoformat(rule['next_date']),
+            inc=True,
+        )
+        processed = 0
+        next_date = None
+        for occurrence in occurrences:
+            if occurrence > now or processed >= limit:
+                next_date = occurrence
+                break
+            self._materialize_occurrence(service, rule, occurrence)
+            processed += 1
+        self.update_row(
+            table_name='recurring_rule',
+            where='id',
+            equals_to=rule['id'],
+            next_date=next_date.isoformat() if next_date else None,
+        )
+        return processed
+
+    def _materialize_occurrence(self, service, rule, occurrence):
+        """
+        Создание операции для одного повторения, если она еще не создана
+        :param service: Сервис операций
+        :param rule: Правило
+        :param occurrence: Дата повторения
+        """
+        try:
+            self.insert_row(
+                table_name='recurring_occurrence',
+                rule_id=rule['id'],
+                occurrence_date=occurrence.isoformat(),
+                user_id=rule['user_id'],
+            )
+        except sqlite3.IntegrityError:
+            return
+        operation = service.create_operation({'id': rule['user_id']}, {
+            'type': rule['type'],
+            'amount': rule['amount'] / 100,
+            'description': rule['description'],
+            'category_id': rule['category_id'],
+            'operation_date': occurrence.isoformat(),
+        })
+        self.connection.execute(
+            'UPDATE recurring_occurrence '
+            'SET operation_id = ? '
+            'WHERE rule_id = ? AND occurrence_date = ?',
+            (operation['id'], rule['id'], occurrence.isoformat()),
+        )
@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+
+from .base import BaseService
+from .partitions import PartitionsService
+
+MAX_ENTRIES = 1024
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def make_date_conditions(date_from, date_to):
+    """
+    Условия на дату операции для отчета
+    :param date_from: Начало периода (включительно)
+    :param date_to: Конец периода (не включительно)
+    :return: Условия и параметры для них
+    """
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("strftime('%s', operation_date) >= strftime('%s', ?)")
+        params.append(date_from)
+    if date_to:
+        conditions.append("strftime('%s', operation_date) < strftime('%s', ?)")
+        params.append(date_to)
+    return conditions, params
+
+
+class ReportCache(BaseService):
+    """
+    Кэш итогов отчета (сумма, количество и суммы по категориям) за период.
+    Ранее посчитанный результат доводится до актуального по журналу изменений operation_log,
+    полный пересчет выполняется только для нового периода, после сжатия журнала и после замены базы.
+    Записи кэша хранятся отдельно для каждой базы
+    """
+    def get_totals(self, user_id, date_from, date_to):
+        """
+        Получение итогов по операциям пользователя за период
+        :param user_id: id пользователя
+        :param date_from: Начало периода
+        :param date_to: Конец периода
+        :return: Итоги: total_amount, total_items и categories ({id категории: [сумма, количество]})
+        """
+        key = (self.get_database_path(), user_id, str(date_from or ''), str(date_to or ''))
+        with _lock:
+            entry = _entries.get(key)
+
+        if entry is None:
+            entry = self._build(user_id, date_from, date_to)
+        else:
+            entry = self._apply_changes(entry, user_id, date_from, date_to)
+
+        with _lock:
+            _entries[key] = entry
+            _entries.move_to_end(key)
+            while len(_entries) > MAX_ENTRIES:
+                _entries.popitem(last=False)
+
+        categories = entry['categories']
+        return {
+            'total_amount': sum(amount for amount, _ in categories.values()),
+            'total_items': sum(items for _, items in categories.values()),
+            'categories': categories,
+        }
+
+    def _build(self, user_id, date_from, date_to):
+        """
+        Полный пересчет итогов по таблице операций
+        :param user_id: id пользователя
+        :param date_from: Начало периода
+        :param date_to: Конец периода
+        :return: Запись кэша
+        """
+        conditions, params = make_date_conditions(date_from, date_to)
+        where_clause = ' AND '.join(['user_id = ?', *conditions])
+        source = PartitionsService(self.connection).get_operations_source(date_from, date_to, user_id)
+        # Номер последней записи журнала читается тем же запросом, что и итоги,
+        # иначе изменение между двумя запросами было бы учтено дважды или потеряно
+        cur = self.connection.execute(
+            'SELECT log.last_id, totals.category_id, totals.amount, totals.items '
+            'FROM (SELECT IFNULL(MAX(id), 0) AS last_id FROM operation_log) AS log '
+            'LEFT JOIN ('
+            ' SELECT category_id, SUM(amount) AS amount, COUNT(*) AS items'
+            f' FROM {source}'
+            f' WHERE {where_clause}'
+            ' GROUP BY category_id'
+            ') AS totals ON 1',
+            (user_id, *params),
+        )
+        rows = cur.fetchall()
+        categories = {
+            row['category_id']: [row['amount'], row['items']]
+            for row in rows
+            if row['items']
+        }
+        return {
+            'last_id': rows[0]['last_id'],
+            'categories': categories,
+        }
+
+    def _apply_changes(self, entry, user_id, date_from, date_to):
+        """
+        Применение к записи кэша изменений из журнала, сделанных после её построения
+        :param entry: Запись кэша
+        :param user_id: id пользователя
+        :param date_from: Начало периода
+        :param date_to: Конец периода
+        :return: Обновленная запись кэша
+        """
+        conditions, params = make_date_conditions(date_from, date_to)
+        where_clause = ' AND '.join(['user_id = ?', 'id > ?', *conditions])
+        cur = self.connection.execute(
+            'SELECT log.last_id, log.compacted_through, changes.category_id, changes.amount, changes.items '
+            'FROM ('
+            ' SELECT IFNULL(MAX(id), 0) AS last_id,'
+            ' (SELECT IFNULL(MAX(operation_id), 0) FROM operation_log'
+            "  WHERE user_id = 0 AND action = 'compact') AS compacted_through"
+            ' FROM operation_log'
+            ') AS log '
+            'LEFT JOIN ('
+            ' SELECT category_id, SUM(sign * amount) AS amount, SUM(sign) AS items'
+            ' FROM operation_log'
+            f' WHERE {where_clause}'
+            ' GROUP BY category_id'
+            ') AS changes ON 1',
+            (user_id, entry['last_id'], *params),
+        )
+        rows = cur.fetchall()
+        if rows[0]['compacted_through'] > entry['last_id'] or rows[0]['last_id'] < entry['last_id']:
+            # Журнал сжат после построения записи или база заменена (восстановлена из копии)
+            return self._build(user_id, date_from, date_to)
+
+        categories = dict(entry['categories'])
+        for row in rows:
+            if not row['items'] and not row['amount']:
+                continue
+            amount, items = categories.get(row['category_id'], (0, 0))
+            amount += row['amount']
+            items += row['items']
+            if items:
+                categories[row['category_id']] = [amount, items]
+            else:
+                categories.pop(row['category_id'], None)
+        return {
+            'last_id': max(entry['last_id'], rows[0]['last_id']),
+            'categories': categories,
+        }
@@ -1,9 +1,21 @@
 from datetime import datetime
-from dateutil.relativedelta import relativedelta, MO
 from math import ceil
 
+from .analytics import AnalyticsService, analytics_cache
+from .balances import get_month_start
 from .base import BaseService
 from .categories import CategoriesService
+from .exceptions import BadRequest
+from .partitions import PartitionsService
+from .report_cache import ReportCache, make_date_conditions
+from .search import make_match_query
+
+# Начало интервала, к которому относится операция
+BALANCE_BUCKETS = {
+    'day': 'date(operation_date)',
+    'week': "date(operation_date, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m-01', operation_date)",
+}
 
 
 class ReportService(BaseService):
@@ -14,7 +26,17 @@ class ReportService(BaseService):
         :param qs: query string
         :return: Отчет
         """
-        raw_operations, total_items, total_pages = self._get_raw_operations(user_id, qs)
+        self._convert_time_period(qs)
+        operations_page = None
+        if not qs.get('q'):
+            operations_page = self._get_columnar_operations(user_id, qs)
+        if operations_page is None:
+            totals = None
+            if not qs.get('category') and not qs.get('type') and not qs.get('q'):
+                totals = ReportCache(self.connection).get_totals(user_id, qs.get('from'), qs.get('to'))
+            operations_page = self._get_raw_operations(user_id, qs, totals)
+
+        raw_operations, total_items, total_pages, total_amount = operations_page
         if not raw_operations:
             operations = {
                 'operations': [],
@@ -24,25 +46,136 @@ class ReportService(BaseService):
             }
             return operations
 
-        total_amount = raw_operations[0]['total_amount'] / 100
         operations = self._get_operation_categories(user_id, raw_operations)
 
         report = {
             'operations': operations,
-            'total_amount': total_amount,
+            'total_amount': total_amount / 100,
             'total_items': total_items,
             'total_pages': total_pages
         }
 
         return report
 
-    def _get_raw_operations(self, user_id, qs):
+    def get_summary(self, user_id, qs):
+        """
+        Получение итогов по операциям за период с разбивкой по категориям
+        :param user_id: id пользователя
+        :param qs: query string
+        :return: Итоги
+        """
+        self._convert_time_period(qs)
+        totals = ReportCache(self.connection).get_totals(user_id, qs.get('from'), qs.get('to'))
+
+        categories_service = CategoriesService(self.connection)
+        titles = {
+            category['id']: category['title']
+            for category in categories_service.get_categories(user_id)
+        }
+        # Операции удаленных категорий остаются без категории (ON DELETE SET NULL)
+        by_category = {}
+        for category_id, (amount, items) in totals['categories'].items():
+            if category_id not in titles:
+                category_id = None
+            category_amount, category_items = by_category.get(category_id, (0, 0))
+            by_category[category_id] = (category_amount + amount, category_items + items)
+
+        categories = [
+            {
+                'id': category_id,
+                'title': titles.get(category_id),
+                'amount': amount / 100,
+                'items': items,
+            }
+            for category_id, (amount, items) in by_category.items()
+        ]
+        summary = {
+            'categories': categories,
+            'total_amount': totals['total_amount'] / 100,
+            'total_items': totals['total_items'],
+        }
+        return summary
+
+    def get_balance(self, user_id, qs):
+        """
+        Получение баланса на конец каждого интервала (день, неделя, месяц) за период.
+        Баланс на начало периода берется из контрольных точек по месяцам и операций от начала
+        месяца до начала периода, поэтому читаются только операции за период
+        :param user_id: id пользователя
+        :param qs: query string
+        :return: Баланс на начало периода и изменения с балансом по интервалам
+        """
+        bucket = qs.get('bucket', 'day')
+        if bucket not in BALANCE_BUCKETS:
+            raise BadRequest(f'Bucket must be one of: {", ".join(BALANCE_BUCKETS)}.')
+        self._convert_time_period(qs)
+        date_from, date_to = qs.get('from'), qs.get('to')
+
+        opening_params = []
+        opening = '0'
+        if date_from:
+            month_start = get_month_start(date_from)
+            month_conditions, month_params = make_date_conditions(month_start, date_from)
+            month_source = PartitionsService(self.connection).get_operations_source(month_start, date_from)
+            opening = (
+                '(SELECT IFNULL(SUM(change), 0) FROM balance_checkpoint'
+                ' WHERE user_id = ? AND month_start < ?)'
+                ' + (SELECT IFNULL(SUM(amount), 0)'
+                f' FROM {month_source}'
+                ' WHERE {})'.format(' AND '.join(['user_id = ?', *month_conditions]))
+            )
+            opening_params = [user_id, month_start, user_id, *month_params]
+
+        conditions, params = make_date_conditions(date_from, date_to)
+        where_clause = ' AND '.join(['user_id = ?', *conditions])
+        source = PartitionsService(self.connection).get_operations_source(date_from, date_to, user_id)
+        # Начальный баланс и интервалы считаются одним запросом, чтобы видеть одно состояние базы
+        cur = self.connection.execute(
+            'SELECT'
+            ' opening.amount AS opening,'
+            ' buckets.bucket,'
+            ' buckets.change,'
+            ' opening.amount + SUM(buckets.change) OVER (ORDER BY buckets.bucket) AS balance '
+            f'FROM (SELECT {opening} AS amount) AS opening '
+            'LEFT JOIN ('
+            f' SELECT {BALANCE_BUCKETS[bucket]} AS bucket, SUM(amount) AS change'
+            f' FROM {source}'
+            f' WHERE {where_clause}'
+            ' GROUP BY 1'
+            ') AS buckets ON 1 '
+            'ORDER BY buckets.bucket',
+            (*opening_params, user_id, *params),
+        )
+        rows = cur.fetchall()
+        balance = {
+            'bucket': bucket,
+            'opening_balance': rows[0]['opening'] / 100,
+            'balances': [
+                {
+                    'date': row['bucket'],
+                    'change': row['change'] / 100,
+                    'balance': row['balance'] / 100,
+                }
+                for row in rows
+                if row['bucket'] is not None
+            ],
+        }
+        return balance
+
+    def _get_raw_operations(self, user_id, qs, totals=None):
         """
         Получение операций (без категорий)
         :param user_id: id пользователя
         :param qs: query string
-        :return: Операции, их количество и количество страниц, которое они занимают
+        :param totals: Итоги из кэша отчетов; если их нет, итоги считаются тем же запросом
+        :return: Операции, их количество, количество страниц, которое они занимают, и их сумма
         """
+        totals_fields = ''
+        if totals is None:
+            totals_fields = (
+                ', SUM(amount) OVER () AS total_amount'
+                ', COUNT(*) OVER () AS total_items'
+            )
         query = (
             'SELECT'
             ' operation.id,'
@@ -50,12 +183,13 @@ class ReportService(BaseService):
             ' operation.type,'
             ' operation.amount,'
             ' operation.description,'
-            ' category.tree_path,'
-            'SUM(amount) OVER () AS total_amount, '
-            'COUNT(*) OVER () AS total_items '
-            'FROM operation '
+            ' category.tree_path'
+            f'{totals_fields} '
+            'FROM {source} AS operation '
             'LEFT JOIN category ON operation.category_id = category.id '
+            '{search_join}'
             '{where_clause} '
+            '{order_clause}'
             '{limit_clause} '
             '{offset_clause} '
         )
@@ -71,8 +205,6 @@ class ReportService(BaseService):
             where_conditions.append('category.tree_path LIKE ? ')
             params.append(node)
 
-        self._convert_time_period(qs)
-
         date_from = qs.get('from')
         if date_from:
             where_conditions.append("strftime('%s',operation.operation_date) >= strftime('%s', ?) ")
@@ -83,6 +215,20 @@ class ReportService(BaseService):
             where_conditions.append("strftime('%s', operation.operation_date) < strftime('%s', ?) ")
             params.append(date_to)
 
+        operation_type = qs.get('type')
+        if operation_type:
+            where_conditions.append('operation.type = ? ')
+            params.append(operation_type)
+
+        search_join = ''
+        order_clause = ''
+        q = qs.get('q')
+        if q:
+            search_join = 'INNER JOIN operation_search ON operation_search.rowid = operation.id '
+            where_conditions.append('operation_search MATCH ? ')
+            params.append(make_match_query(q))
+            order_clause = 'ORDER BY operation_search.rank '
+
         page = int(qs.get('page', 1))
         page_size = int(qs.get('page_size', 15))
 
@@ -95,7 +241,15 @@ class ReportService(BaseService):
         where_clause = ''
         if where_conditions:
             where_clause = 'WHERE {}'.format(' AND '.join(where_conditions))
-        query = query.format(where_clause=where_clause, limit_clause=limit_clause, offset_clause=offset_clause)
+        source = PartitionsService(self.connection).get_operations_source(date_from, date_to, user_id)
+        query = query.format(
+            source=source,
+            search_join=search_join,
+            where_clause=where_clause,
+            order_clause=order_clause,
+            limit_clause=limit_clause,
+            offset_clause=offset_clause,
+        )
 
         cur = self.connection.execute(query, params)
         rows = cur.fetchall()
@@ -103,11 +257,80 @@ class ReportService(BaseService):
 
         total_items = 0
         total_pages = 0
-        if raw_operations:
+        total_amount = 0
+        if totals is not None:
+            total_items = totals['total_items']
+            total_pages = ceil(total_items / page_size)
+            total_amount = totals['total_amount']
+        elif raw_operations:
             total_items = raw_operations[0]['total_items']
             total_pages = ceil(total_items / page_size)
+            total_amount = raw_operations[0]['total_amount']
+
+        return raw_operations, total_items, total_pages, total_amount
 
-        return raw_operations, total_items, total_pages
+    def _get_columnar_operations(self, user_id, qs):
+        """
+        Получение операций через кэш столбцов (для пользователей с большим количеством операций)
+        :param user_id: id пользователя
+        :param qs: query string
+        :return: То же, что и _get_raw_operations, или None, если пользователь не кэшируется
+        """
+        if qs.get('type') and qs['type'] not in ('income', 'expenses'):
+            # Как и в SQL-запросе: операций другого типа нет
+            return [], 0, 0, 0
+        columns = analytics_cache.get(self.connection, user_id)
+        if columns is None:
+            return None
+
+        service = AnalyticsService(self.connection)
+        date_from, date_to = service.get_timestamps(qs.get('from'), qs.get('to'))
+        category_ids = None
+        if qs.get('category'):
+            category_ids = service.get_subtree_ids(user_id, qs['category'])
+        is_income = None
+        if qs.get('type'):
+            is_income = qs['type'] == 'income'
+        ids, total_amount = columns.find(date_from, date_to, category_ids, is_income)
+
+        page = int(qs.get('page', 1))
+        page_size = int(qs.get('page_size', 15))
+        offset = (page - 1) * page_size
+        page_ids = [int(operation_id) for operation_id in ids[offset:offset + page_size]]
+        raw_operations = self._get_operations_by_ids(user_id, page_ids, qs.get('from'), qs.get('to'))
+
+        total_items = len(ids)
+        total_pages = ceil(total_items / page_size)
+        return raw_operations, total_items, total_pages, total_amount
+
+    def _get_operations_by_ids(self, user_id, operation_ids, date_from, date_to):
+        """
+        Получение операций (без категорий) по их id в том же порядке
+        :param user_id: id пользователя
+        :param operation_ids: id операций
+        :param date_from: Начало периода (нужно, чтобы подключить только нужные архивы)
+        :param date_to: Конец периода
+        :return: Операции
+        """
+        if not operation_ids:
+            return []
+        source = PartitionsService(self.connection).get_operations_source(date_from, date_to, user_id)
+        placeholders = self.make_placeholders(len(operation_ids))
+        cur = self.connection.execute(
+            'SELECT'
+            ' operation.id,'
+            ' operation.operation_date,'
+            ' operation.type,'
+            ' operation.amount,'
+            ' operation.description,'
+            ' category.tree_path '
+            f'FROM {source} AS operation '
+            'LEFT JOIN category ON operation.category_id = category.id '
+            f'WHERE operation.id IN ({placeholders})',
+            operation_ids,
+        )
+        operations = {row['id']: dict(row) for row in cur.fetchall()}
+        return [operations[operation_id] for operation_id in operation_ids if operation_id in operations]
 
     def _get_operation_categories(self, user_id, raw_operations):
         """
@@ -147,6 +370,8 @@ class ReportService(BaseService):
         if not period:
             return
 
+        from dateutil.relativedelta import relativedelta, MO
+
         current_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
         if period == 'week':
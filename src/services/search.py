@@ -0,0 +1,68 @@
+import re
+from itertools import chain
+
+from .base import BaseService
+from .exceptions import BadRequest
+from .partitions import PartitionsService
+
+
+def make_match_query(q):
+    """
+    Преобразование поисковой строки в запрос FTS5.
+    Слова ищутся все сразу, слово со звездочкой в конце ищется как префикс (кофе* -> кофейня)
+    :param q: Поисковая строка
+    :return: Запрос для MATCH
+    """
+    terms = re.findall(r'\w+\*?', q)
+    if not terms:
+        raise BadRequest('Search query must contain at least one word.')
+    match_terms = []
+    for term in terms:
+        if term.endswith('*'):
+            match_terms.append(f'"{term[:-1]}"*')
+        else:
+            match_terms.append(f'"{term}"')
+    return ' '.join(match_terms)
+
+
+class SearchService(BaseService):
+    """
+    Полнотекстовый индекс описаний операций (FTS5). rowid записи индекса совпадает с id операции
+    """
+    def index_operation(self, old_operation, new_operation):
+        """
+        Обновление индекса после изменения операции
+        :param old_operation: Операция до изменения (None при создании)
+        :param new_operation: Операция после изменения (None при удалении)
+        """
+        old_description = old_operation['description'] if old_operation else None
+        new_description = new_operation['description'] if new_operation else None
+        if old_operation and new_operation and old_description == new_description:
+            return
+        if old_description:
+            self.connection.execute(
+                'DELETE FROM operation_search '
+                'WHERE rowid = ?',
+                (old_operation['id'],),
+            )
+        if new_description:
+            self.connection.execute(
+                'INSERT INTO operation_search(rowid, description, user_id) '
+                'VALUES (?, ?, ?)',
+                (new_operation['id'], new_description, new_operation['user_id']),
+            )
+
+    def rebuild_index(self):
+        """
+        Заполнение индекса заново по всем операциям, включая архивные.
+        Архивы читаются пачками, после каждой пачки изменения коммитятся
+        """
+        self.connection.execute('DELETE FROM operation_search')
+        for source in chain(['operation'], PartitionsService(self.connection).iter_archive_sources()):
+            self.connection.execute(
+                'INSERT INTO operation_search(rowid, description, user_id) '
+                'SELECT id, description, user_id '
+                f'FROM {source} AS source '
+                "WHERE description != ''"
+            )
+            self.connection.commit()
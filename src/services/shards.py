@@ -0,0 +1,208 @@
+from itertools import chain
+
+from .base import BaseService
+from .partitions import OPERATION_FIELDS, PartitionsService
+
+# Таблицы, которые не переносятся в другой шард: журнал изменений нужен только кэшам процессов,
+# а id его записей служат курсорами кэшей и должны расти в пределах одной базы
+LOCAL_TABLES = ('operation_log',)
+
+
+def get_user_tables(connection):
+    """
+    Таблицы с данными пользователей - все таблицы с колонкой user_id, кроме справочника шардов,
+    в порядке создания (родительские таблицы создаются раньше дочерних)
+    :param connection: Соединение с базой шарда
+    :return: Список (имя таблицы, колонки, виртуальная ли таблица)
+    """
+    cur = connection.execute(
+        'SELECT name, sql '
+        'FROM sqlite_master '
+        "WHERE type = 'table' AND name NOT IN ('user', 'shard_directory', 'sqlite_sequence') "
+        'ORDER BY rowid'
+    )
+    tables = []
+    for row in cur.fetchall():
+        columns = [column['name'] for column in connection.execute(f'PRAGMA table_info({row["name"]})')]
+        if 'user_id' in columns:
+            tables.append((row['name'], columns, row['sql'].startswith('CREATE VIRTUAL TABLE')))
+    return tables
+
+
+def copy_user_data(source, target, user):
+    """
+    Копирование данных пользователя в другой шард одной транзакцией.
+    id сохраняются (у каждого шарда свой диапазон id), архивные операции попадают
+    в горячую таблицу целевого шарда. Записи с id из чужого диапазона сдвигают sqlite_sequence,
+    поэтому после копирования счетчики целевого шарда возвращаются в его диапазон.
+    Остатки прерванного переноса в целевом шарде удаляются
+    :param source: Соединение с исходным шардом
+    :param target: Соединение с целевым шардом
+    :param user: Пользователь (id, email, имя)
+    :return: Количество скопированных строк по таблицам
+    """
+    delete_user_data(target, user['id'], keep_user=True)
+    sequences = target.execute('SELECT name, seq FROM sqlite_sequence').fetchall()
+    target.execute('PRAGMA defer_foreign_keys = ON')
+    target.execute(
+        'INSERT OR IGNORE INTO user(id, first_name, last_name, email, password) '
+        "VALUES (?, ?, ?, ?, '')",
+        (user['id'], user.get('first_name'), user.get('last_name'), user['email']),
+    )
+    copied = {}
+    for table, columns, is_virtual in get_user_tables(target):
+        if table in LOCAL_TABLES:
+            continue
+        if table == 'operation':
+            columns = OPERATION_FIELDS
+            # Архивы читаются пачками: все сразу к соединению не подключить
+            table_sources = chain(['operation'], PartitionsService(source).iter_archive_sources())
+        else:
+            table_sources = [table]
+        if is_virtual:
+            # У FTS-индекса rowid совпадает с id операции, его нужно перенести явно
+            columns = ['rowid', *columns]
+        fields = ', '.join(columns)
+        copied[table] = 0
+        for table_source in table_sources:
+            cur = source.execute(
+                f'SELECT {fields} FROM {table_source} AS source '
+                'WHERE user_id = ?',
+                (user['id'],),
+            )
+            rows = cur.fetchall()
+            target.executemany(
+                f'INSERT INTO {table}({fields}) '
+                f'VALUES ({BaseService.make_placeholders(len(columns))})',
+                [tuple(row) for row in rows],
+            )
+            copied[table] += len(rows)
+    target.executemany(
+        'UPDATE sqlite_sequence '
+        'SET seq = ? '
+        'WHERE name = ?',
+        [(row['seq'], row['name']) for row in sequences],
+    )
+    target.commit()
+    return copied
+
+
+def delete_user_data(connection, user_id, keep_user):
+    """
+    Удаление данных пользователя из шарда одной транзакцией (таблицы - в обратном порядке создания)
+    :param connection: Соединение с шардом
+    :param user_id: id пользователя
+    :param keep_user: Оставить запись пользователя (в основной базе она нужна для авторизации)
+    """
+    connection.execute('PRAGMA defer_foreign_keys = ON')
+    for table, _, _ in reversed(get_user_tables(connection)):
+        connection.execute(
+            f'DELETE FROM {table} '
+            'WHERE user_id = ?',
+            (user_id,),
+        )
+    if not keep_user:
+        connection.execute(
+            'DELETE FROM user '
+            'WHERE id = ?',
+            (user_id,),
+        )
+    connection.commit()
+
+
+class ShardsService(BaseService):
+    """
+    Справочник шардов в основной базе: номер шарда (индекс в SHARD_CONNECTIONS) для каждого пользователя.
+    Пользователь без записи в справочнике живет в основной базе
+    """
+    def get_shard(self, user_id):
+        """
+        Получение шарда пользователя
+        :param user_id: id пользователя
+        :return: Номер шарда или None, если пользователь в основной базе
+        """
+        row = self.select_row(['shard'], table_name='shard_directory', where='user_id', equals_to=user_id)
+        return row['shard'] if row is not None else None
+
+    def set_shard(self, user_id, shard):
+        """
+        Приписывание пользователя к шарду
+        :param user_id: id пользователя
+        :param shard: Номер шарда
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO shard_directory(user_id, shard) '
+            'VALUES (?, ?)',
+            (user_id, shard),
+        )
+
+    def get_sizes(self, shard_count):
+        """
+        Количество пользователей в каждом шарде
+        :param shard_count: Количество шардов
+        :return: Список количеств по номерам шардов
+        """
+        sizes = [0] * shard_count
+        cur = self.connection.execute(
+            'SELECT shard, COUNT(*) AS users '
+            'FROM shard_directory '
+            'GROUP BY shard'
+        )
+        for row in cur.fetchall():
+            if row['shard'] < shard_count:
+                sizes[row['shard']] = row['users']
+        return sizes
+
+    def assign_shard(self, user_id, shard_count):
+        """
+        Приписывание нового пользователя к наименее заполненному шарду
+        :param user_id: id пользователя
+        :param shard_count: Количество шардов
+        :return: Номер шарда
+        """
+        sizes = self.get_sizes(shard_count)
+        shard = sizes.index(min(sizes))
+        self.set_shard(user_id, shard)
+        return shard
+
+    def plan_rebalance(self, shard_count, main_shard):
+        """
+        План выравнивания шардов по количеству пользователей.
+        Пользователи основной базы, которая не является шардом, переносятся в шарды всегда
+        :param shard_count: Количество шардов
+        :param main_shard: Номер шарда основной базы или None, если она не шард
+        :return: Список (id пользователя, исходный шард (None - основная база), целевой шард)
+        """
+        cur = self.connection.execute(
+            'SELECT user.id AS user_id, shard_directory.shard '
+            'FROM user '
+            'LEFT JOIN shard_directory ON shard_directory.user_id = user.id '
+            'ORDER BY user.id'
+        )
+        rows = cur.fetchall()
+        users = [[] for _ in range(shard_count)]
+        moves = []
+        pending = []
+        for row in rows:
+            if row['shard'] is not None and row['shard'] >= shard_count:
+                # Шард убран из SHARD_CONNECTIONS, читать данные пользователя неоткуда
+                continue
+            shard = row['shard'] if row['shard'] is not None else main_shard
+            if shard is None:
+                pending.append((row['user_id'], row['shard']))
+            else:
+                users[shard].append(row['user_id'])
+                if row['shard'] is None:
+                    # Пользователь уже лежит в шарде основной базы, его нужно только записать в справочник
+                    moves.append((row['user_id'], None, shard))
+
+        limit = -(-len(rows) // shard_count) if rows else 0
+        for shard, user_ids in enumerate(users):
+            while len(user_ids) > limit:
+                pending.append((user_ids.pop(), shard))
+
+        for user_id, source in pending:
+            target = min(range(shard_count), key=lambda shard: len(users[shard]))
+            users[target].append(user_id)
+            moves.append((user_id, source, target))
+        return moves
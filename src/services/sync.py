@@ -0,0 +1,134 @@
+import json
+from itertools import chain
+
+from .base import BaseService
+from .partitions import OPERATION_FIELDS, PartitionsService
+
+CATEGORY_FIELDS = ['id', 'title', 'parent_id', 'user_id']
+
+
+class SyncService(BaseService):
+    """
+    Журнал изменений для синхронизации клиентов.
+    Для каждой операции и категории хранится одна строка с номером последнего изменения (seq):
+    INSERT OR REPLACE удаляет старую строку и добавляет новую со следующим seq, поэтому журнал
+    не растет от повторных изменений. Удаление оставляет строку с deleted = 1.
+    Номера у каждого пользователя свои и переносятся вместе с его данными в другой шард,
+    поэтому после переноса номера продолжают расти и клиент не теряет изменения.
+    SQLite выполняет записи по одной, поэтому номер изменения становится виден только после
+    коммита всех меньших номеров и клиент не пропускает изменения, запрашивая seq > since
+    """
+    def stamp(self, entity, user_id, entity_ids, deleted=False):
+        """
+        Запись изменения в той же транзакции, что и само изменение
+        :param entity: Тип записи (operation или category)
+        :param user_id: id пользователя
+        :param entity_ids: id измененных записей
+        :param deleted: Записи удалены
+        """
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO sync_change(user_id, seq, entity, entity_id, deleted) '
+            'VALUES (?, (SELECT IFNULL(MAX(seq), 0) + 1 FROM sync_change WHERE user_id = ?), ?, ?, ?)',
+            [(user_id, user_id, entity, entity_id, int(deleted)) for entity_id in entity_ids],
+        )
+
+    def stamp_existing(self):
+        """
+        Запись в журнал операций (включая архивные) и категорий, которых в нем нет, - созданных
+        до появления журнала, чтобы первая синхронизация получила их все.
+        Архивы читаются пачками, после каждой пачки изменения коммитятся
+        """
+        sources = chain(
+            [('category', 'category'), ('operation', 'operation')],
+            # Генератор архивов отключает пачку, когда переходит к следующей, поэтому читается лениво
+            (('operation', source) for source in PartitionsService(self.connection).iter_archive_sources()),
+        )
+        for entity, source in sources:
+            self.connection.execute(
+                'INSERT INTO sync_change(user_id, seq, entity, entity_id, deleted) '
+                'SELECT user_id, '
+                '(SELECT IFNULL(MAX(seq), 0) FROM sync_change WHERE sync_change.user_id = source.user_id) '
+                '+ ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id), '
+                f"'{entity}', id, 0 "
+                f'FROM {source} AS source '
+                'WHERE NOT EXISTS ('
+                ' SELECT 1 FROM sync_change'
+                ' WHERE sync_change.entity = ? AND sync_change.entity_id = source.id'
+                ')',
+                (entity,),
+            )
+            self.connection.commit()
+
+    def get_changes(self, user_id, since, limit):
+        """
+        Получение операций и категорий, измененных после since.
+        Журнал и записи горячей базы читаются в одной транзакции, чтобы видеть одно состояние базы.
+        Операции, которых нет в горячей таблице, после нее ищутся в архивах
+        :param user_id: id пользователя
+        :param since: Номер последнего полученного клиентом изменения
+        :param limit: Размер страницы
+        :return: Измененные записи, id удаленных, номер для следующего запроса и есть ли еще изменения
+        """
+        if not self.connection.in_transaction:
+            self.connection.execute('BEGIN')
+        cur = self.connection.execute(
+            'SELECT seq, entity, entity_id, deleted '
+            'FROM sync_change '
+            'WHERE user_id = ? AND seq > ? '
+            'ORDER BY seq '
+            'LIMIT ?',
+            (user_id, since, limit + 1),
+        )
+        changes = cur.fetchall()
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        changed_ids = {'operation': [], 'category': []}
+        deleted_ids = {'operation': [], 'category': []}
+        for change in changes:
+            ids = deleted_ids if change['deleted'] else changed_ids
+            ids[change['entity']].append(change['entity_id'])
+
+        operations = self._get_rows(OPERATION_FIELDS, 'operation', changed_ids['operation'])
+        categories = self._get_rows(CATEGORY_FIELDS, 'category', changed_ids['category'])
+        self.connection.commit()
+
+        found_ids = {operation['id'] for operation in operations}
+        archived_ids = [operation_id for operation_id in changed_ids['operation'] if operation_id not in found_ids]
+        if archived_ids:
+            for source in PartitionsService(self.connection).iter_archive_sources():
+                operations.extend(self._get_rows(OPERATION_FIELDS, source, archived_ids))
+            operations.sort(key=lambda operation: operation['id'])
+        for operation in operations:
+            operation['amount'] /= 100
+
+        sync = {
+            'operations': operations,
+            'categories': categories,
+            'deleted': {
+                'operations': deleted_ids['operation'],
+                'categories': deleted_ids['category'],
+            },
+            'next_since': changes[-1]['seq'] if changes else since,
+            'has_more': has_more,
+        }
+        return sync
+
+    def _get_rows(self, fields, source, ids):
+        """
+        Получение записей по списку id
+        :param fields: Поля
+        :param source: Таблица или подзапрос
+        :param ids: id записей
+        :return: Записи
+        """
+        if not ids:
+            return []
+        cur = self.connection.execute(
+            f'SELECT {self.make_select_fields(fields)} '
+            f'FROM {source} AS source '
+            'WHERE id IN (SELECT value FROM json_each(?)) '
+            'ORDER BY id',
+            (json.dumps(ids),),
+        )
+        return [dict(row) for row in cur.fetchall()]
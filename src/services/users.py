@@ -1,8 +1,5 @@
 import sqlite3
 
-from validate_email import validate_email
-from werkzeug.security import generate_password_hash
-
 from .base import BaseService
 from .exceptions import (
     ConflictError,
@@ -10,6 +7,7 @@ from .exceptions import (
     BrokenRulesError,
     BadRequest
 )
+from .passwords import hasher
 
 
 def check_password_length(password):
@@ -61,6 +59,9 @@ class UsersService(BaseService):
         if not user_data.get('email'):
             raise BadRequest('Email is required.')
 
+        # validate_email тянет за собой dnspython и filelock, поэтому импортируется
+        # только при регистрации, а не при старте каждого воркера
+        from validate_email import validate_email
         is_valid = validate_email(email_address=str(user_data.get('email')), check_regex=True, check_mx=False)
         if not is_valid:
             raise BrokenRulesError('Email is not valid.')
@@ -69,7 +70,7 @@ class UsersService(BaseService):
             raise BadRequest('Password is required.')
         check_password_length(user_data.get('password'))
 
-        user_data['password'] = generate_password_hash(user_data['password'])
+        user_data['password'] = hasher.generate(user_data['password'])
         try:
             user_id = self.insert_row(
                 table_name='user',
@@ -79,3 +80,27 @@ class UsersService(BaseService):
             raise ConflictError(f'User with email {user_data["email"]} already exists.') from None
         self.connection.commit()
         return user_id
+
+    def create_user_stub(self, user):
+        """
+        Запись пользователя в шарде: нужна только для внешних ключей, пароль хранится в основной базе
+        :param user: Информация о пользователе (id, email и имя)
+        """
+        self.connection.execute(
+            'INSERT OR IGNORE INTO user(id, first_name, last_name, email, password) '
+            "VALUES (?, ?, ?, ?, '')",
+            (user['id'], user.get('first_name'), user.get('last_name'), user['email']),
+        )
+
+    def update_password_hash(self, user_id, password_hash):
+        """
+        Замена хэша пароля (при смене параметров хэширования)
+        :param user_id: id пользователя
+        :param password_hash: Новый хэш пароля
+        """
+        self.update_row(
+            table_name='user',
+            where='id',
+            equals_to=user_id,
+            password=password_hash,
+        )
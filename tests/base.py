@@ -0,0 +1,71 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from config import Config
+from database import db
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    Приложение на временной базе. Настройки, отличные от Config, задаются в config,
+    имена файлов шардов во временной папке - в shards
+    """
+    config = {}
+    shards = []
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        config = {
+            'DB_CONNECTION': self.path('db.db'),
+            'ADMISSION_ENABLED': False,
+            'SHARD_CONNECTIONS': [self.path(name) for name in self.shards],
+            **self.config,
+        }
+        patcher = mock.patch.multiple(Config, **config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            # Схема основной базы
+            db.connection
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def login(self, email='user@example.com', password='password123', client=None):
+        """
+        Вход пользователя, которого при необходимости добавляет тест (в основную базу)
+        :return: id пользователя
+        """
+        client = client or self.client
+        with sqlite3.connect(self.app.config['DB_CONNECTION']) as connection:
+            if connection.execute('SELECT 1 FROM user WHERE email = ?', (email,)).fetchone() is None:
+                connection.execute(
+                    'INSERT INTO user(first_name, last_name, email, password) '
+                    'VALUES (?, ?, ?, ?)',
+                    ('Test', 'User', email, generate_password_hash(password)),
+                )
+        response = client.post('/auth/login', json={'email': email, 'password': password})
+        self.assertEqual(response.status_code, 200)
+        with client.session_transaction() as session:
+            return session['user_id']
+
+    def create_operation(self, amount=-10, operation_date='2024-01-10T12:00:00', **fields):
+        response = self.client.post('/operations', json={
+            'type': 'income' if amount > 0 else 'expenses',
+            'amount': amount,
+            'operation_date': operation_date,
+            **fields,
+        })
+        self.assertEqual(response.status_code, 201, response.json)
+        return response.json
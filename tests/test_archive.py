@@ -0,0 +1,69 @@
+from services import report_cache
+
+from .base import AppTestCase
+
+
+class ArchivedOperationsTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user_id = self.login()
+        self.operations = {
+            year: self.create_operation(amount=-year, operation_date=f'{year}-05-01T10:00:00')
+            for year in range(2005, 2020)
+        }
+        self.create_operation(amount=5, operation_date='2026-01-02T10:00:00')
+        result = self.app.test_cli_runner().invoke(args=['archive-operations', '--horizon-days', '365'])
+        self.assertIsNone(result.exception, result.output)
+        report_cache._entries.clear()
+
+    def get_report(self, **qs):
+        response = self.client.get('/report', query_string={'page_size': 100, **qs})
+        self.assertEqual(response.status_code, 200, response.json)
+        return response.json
+
+    def test_report_without_period_reads_all_archives(self):
+        report = self.get_report()
+        self.assertEqual(report['total_items'], 16)
+
+    def test_update_archived_operation(self):
+        operation_id = self.operations[2010]['id']
+        response = self.client.patch(f'/operations/{operation_id}', json={'amount': -7, 'type': 'expenses'})
+        self.assertEqual(response.status_code, 200, response.json)
+        report = self.get_report(**{'from': '2010-01-01T00:00:00', 'to': '2011-01-01T00:00:00'})
+        self.assertEqual([operation['amount'] for operation in report['operations']], [-7])
+
+    def test_update_moves_operation_to_its_year(self):
+        operation_id = self.operations[2010]['id']
+        response = self.client.patch(f'/operations/{operation_id}', json={'operation_date': '2012-02-01T10:00:00'})
+        self.assertEqual(response.status_code, 200, response.json)
+        report = self.get_report(**{'from': '2012-01-01T00:00:00', 'to': '2013-01-01T00:00:00'})
+        self.assertEqual(sorted(operation['id'] for operation in report['operations']),
+                         sorted([operation_id, self.operations[2012]['id']]))
+        response = self.client.patch(f'/operations/{operation_id}', json={'operation_date': '2026-02-01T10:00:00'})
+        self.assertEqual(response.status_code, 200, response.json)
+        report = self.get_report(**{'from': '2026-01-01T00:00:00'})
+        self.assertIn(operation_id, [operation['id'] for operation in report['operations']])
+        self.assertEqual(self.get_report()['total_items'], 16)
+
+    def test_delete_archived_operation(self):
+        operation_id = self.operations[2008]['id']
+        response = self.client.delete(f'/operations/{operation_id}')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_report()['total_items'], 15)
+        changes = self.client.get('/sync').json
+        self.assertIn(operation_id, changes['deleted']['operations'])
+
+    def test_other_user_cannot_change_archived_operation(self):
+        other = self.app.test_client()
+        self.login('other@example.com', client=other)
+        operation_id = self.operations[2010]['id']
+        self.assertEqual(other.patch(f'/operations/{operation_id}', json={'amount': -1}).status_code, 403)
+        self.assertEqual(other.delete(f'/operations/{operation_id}').status_code, 403)
+        self.assertEqual(other.delete('/operations/999999').status_code, 403)
+
+    def test_batch_returns_conflict_for_archived_operation(self):
+        operation_id = self.operations[2010]['id']
+        response = self.client.post('/batch', json={'requests': [
+            {'method': 'DELETE', 'path': f'/operations/{operation_id}'},
+        ]})
+        self.assertEqual(response.json[0]['status'], 409, response.json)
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+from maintenance import AUTO_VACUUM_INCREMENTAL, maintenance
+from .base import AppTestCase
+
+
+class MaintenanceTestCase(AppTestCase):
+    config = {
+        'MAINTENANCE_ENABLED': True,
+        'MAINTENANCE_IDLE_SECONDS': 5,
+        'MAINTENANCE_POLL_SECONDS': 3600,
+    }
+
+    def set_activity(self, seconds_ago):
+        activity_at = time.time() - seconds_ago
+        os.utime(self.path('db.db.activity'), (activity_at, activity_at))
+        maintenance._last_request_at = activity_at
+
+    def get_auto_vacuum(self):
+        with closing(sqlite3.connect(self.app.config['DB_CONNECTION'])) as connection:
+            return connection.execute('PRAGMA auto_vacuum').fetchone()[0]
+
+    def test_requests_of_other_processes_postpone_maintenance(self):
+        self.client.get('/categories')
+        self.set_activity(60)
+        self.assertTrue(maintenance.is_idle())
+
+        # Запрос другого процесса виден только по файлу активности
+        now = time.time()
+        os.utime(self.path('db.db.activity'), (now, now))
+        self.assertFalse(maintenance.is_idle())
+
+    def test_maintenance_command_converts_auto_vacuum_once(self):
+        with closing(sqlite3.connect(self.app.config['DB_CONNECTION'])) as connection:
+            connection.execute('PRAGMA auto_vacuum = NONE')
+            connection.execute('VACUUM')
+        self.assertNotEqual(self.get_auto_vacuum(), AUTO_VACUUM_INCREMENTAL)
+
+        result = self.app.test_cli_runner().invoke(args=['maintenance'])
+        self.assertIsNone(result.exception, result.output)
+        self.assertIn('convert_auto_vacuum done', result.output)
+        self.assertNotIn('auto_vacuum is not INCREMENTAL', result.output)
+        self.assertEqual(self.get_auto_vacuum(), AUTO_VACUUM_INCREMENTAL)
+
+        result = self.app.test_cli_runner().invoke(args=['maintenance'])
+        self.assertNotIn('convert_auto_vacuum', result.output)
@@ -0,0 +1,28 @@
+import unittest
+from types import SimpleNamespace
+
+from werkzeug.security import generate_password_hash
+
+from services.passwords import PasswordHasher
+
+
+def make_hasher(method):
+    return PasswordHasher(SimpleNamespace(config={
+        'PASSWORD_HASH_METHOD': method,
+        'PASSWORD_SALT_LENGTH': 8,
+        'PASSWORD_HASH_WORKERS': 1,
+        'PASSWORD_HASH_QUEUE_SIZE': 1,
+    }))
+
+
+class PasswordHasherTestCase(unittest.TestCase):
+    def test_hash_with_current_method_is_not_rehashed(self):
+        for method in ('pbkdf2:sha256', 'pbkdf2:sha256:150000'):
+            with self.subTest(method=method):
+                hasher = make_hasher(method)
+                self.assertFalse(hasher.needs_rehash(hasher.generate('password123')))
+
+    def test_hash_with_other_parameters_is_rehashed(self):
+        hasher = make_hasher('pbkdf2:sha256')
+        self.assertTrue(hasher.needs_rehash(generate_password_hash('password123', method='pbkdf2:sha256:1000')))
+        self.assertTrue(hasher.needs_rehash(generate_password_hash('password123', method='pbkdf2:sha1')))
@@ -0,0 +1,58 @@
+import sqlite3
+import threading
+import time
+
+from replica import replica
+
+from .base import AppTestCase
+
+
+class ReplicaTestCase(AppTestCase):
+    config = {
+        'REPLICA_ENABLED': True,
+        'REPLICA_REFRESH_IN_BACKGROUND': False,
+    }
+
+    def test_refresh_under_concurrent_writes(self):
+        database = self.app.config['DB_CONNECTION']
+        user_id = self.login()
+        with sqlite3.connect(database) as connection:
+            connection.executemany(
+                'INSERT INTO operation(type, amount, description, record_date, operation_date, user_id) '
+                "VALUES ('expenses', -1, ?, '2024-01-10T12:00:00', '2024-01-10T12:00:00', ?)",
+                [('x' * 1000, user_id)] * 20000,
+            )
+
+        stop = threading.Event()
+        writes = []
+
+        def write():
+            connection = sqlite3.connect(database)
+            while not stop.is_set():
+                started_at = time.monotonic()
+                with connection:
+                    connection.execute(
+                        'INSERT INTO operation(type, amount, description, record_date, operation_date, user_id) '
+                        "VALUES ('expenses', -1, '', '2024-01-10T12:00:00', '2024-01-10T12:00:00', ?)",
+                        (user_id,),
+                    )
+                writes.append(time.monotonic() - started_at)
+                time.sleep(0.005)
+            connection.close()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            time.sleep(0.05)
+            started_at = time.monotonic()
+            self.assertIsNotNone(replica._refresh(database))
+            elapsed = time.monotonic() - started_at
+        finally:
+            stop.set()
+            writer.join()
+
+        self.assertLess(elapsed, 5)
+        self.assertLess(max(writes), 1)
+        with sqlite3.connect(replica.get_path(database)) as snapshot:
+            count = snapshot.execute('SELECT COUNT(*) FROM operation').fetchone()[0]
+        self.assertGreaterEqual(count, 20000)
@@ -0,0 +1,81 @@
+import sqlite3
+
+from create_db import create_db
+from services.operation_log import OperationLogService
+from services.operations import OperationsService
+from services.report_cache import ReportCache
+
+from .base import AppTestCase
+
+
+class ReportCacheTestCase(AppTestCase):
+    def connect(self, name):
+        database = self.path(name)
+        create_db(self.app, database)
+        connection = sqlite3.connect(database)
+        connection.row_factory = sqlite3.Row
+        self.addCleanup(connection.close)
+        connection.execute(
+            'INSERT INTO user(id, first_name, last_name, email, password) '
+            "VALUES (1, 'Test', 'User', 'user@example.com', '')"
+        )
+        connection.commit()
+        return connection
+
+    def add_operations(self, connection, count):
+        service = OperationsService(connection)
+        for _ in range(count):
+            service.create_operation({'id': 1}, {
+                'type': 'expenses',
+                'amount': -1,
+                'operation_date': '2024-01-10T12:00:00',
+            })
+        connection.commit()
+
+    def get_items(self, connection):
+        return ReportCache(connection).get_totals(1, None, None)['total_items']
+
+    def test_entries_are_per_database(self):
+        small, large = self.connect('small.db'), self.connect('large.db')
+        self.add_operations(small, 3)
+        self.add_operations(large, 5)
+        self.assertEqual(self.get_items(small), 3)
+        self.assertEqual(self.get_items(large), 5)
+
+    def test_entry_is_rebuilt_after_compaction(self):
+        connection = self.connect('db.db')
+        self.add_operations(connection, 2)
+        self.assertEqual(self.get_items(connection), 2)
+        self.add_operations(connection, 3)
+        # Записи об операциях, добавленных после построения записи кэша, удаляются
+        self.assertGreater(OperationLogService(connection).compact(keep_last=0), 0)
+        connection.commit()
+        self.assertEqual(self.get_items(connection), 5)
+
+    def test_entry_is_rebuilt_after_database_is_replaced(self):
+        connection = self.connect('db.db')
+        self.add_operations(connection, 4)
+        self.assertEqual(self.get_items(connection), 4)
+        connection.close()
+        connection = self.connect('restored.db')
+        self.add_operations(connection, 1)
+        connection.close()
+        source = sqlite3.connect(self.path('restored.db'))
+        target = sqlite3.connect(self.path('db.db'))
+        source.backup(target)
+        source.close()
+        target.close()
+        connection = sqlite3.connect(self.path('db.db'))
+        connection.row_factory = sqlite3.Row
+        self.addCleanup(connection.close)
+        self.assertEqual(self.get_items(connection), 1)
+
+    def test_compact_command(self):
+        self.login()
+        self.create_operation()
+        self.create_operation()
+        result = self.app.test_cli_runner().invoke(args=['compact-operation-log', '--keep-last', '0'])
+        self.assertIsNone(result.exception, result.output)
+        self.assertIn('operation log entries compacted', result.output)
+        response = self.client.get('/report')
+        self.assertEqual(response.json['total_items'], 2)
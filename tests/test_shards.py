@@ -0,0 +1,44 @@
+from database import MAX_CATEGORY_ID
+from .base import AppTestCase
+
+
+class ShardsTestCase(AppTestCase):
+    shards = ['s0.db', 's1.db']
+
+    def setUp(self):
+        super().setUp()
+        self.user_id = self.login()
+
+    def move(self, shard):
+        result = self.app.test_cli_runner().invoke(
+            args=['shards-rebalance', '--user-id', str(self.user_id), '--to', str(shard)],
+        )
+        self.assertIsNone(result.exception, result.output)
+
+    def sync(self, since):
+        response = self.client.get('/sync', query_string={'since': since})
+        self.assertEqual(response.status_code, 200, response.json)
+        return response.json
+
+    def test_sync_continues_after_move_to_lower_shard(self):
+        self.move(1)
+        first = self.create_operation()
+        changes = self.sync(0)
+        self.assertEqual([operation['id'] for operation in changes['operations']], [first['id']])
+
+        self.move(0)
+        second = self.create_operation()
+        changes = self.sync(changes['next_since'])
+        self.assertEqual([operation['id'] for operation in changes['operations']], [second['id']])
+        self.assertEqual(self.sync(changes['next_since'])['operations'], [])
+
+    def test_only_category_ids_are_limited_to_eight_digits(self):
+        self.move(1)
+        operation = self.create_operation()
+        response = self.client.post('/categories', json={'title': 'food', 'parent_id': None})
+        self.assertEqual(response.status_code, 201, response.json)
+
+        self.assertLess(response.json['id'], MAX_CATEGORY_ID)
+        self.assertGreater(operation['id'], MAX_CATEGORY_ID + self.app.config['SHARD_ID_STRIDE'])
+        response = self.client.patch(f'/operations/{operation["id"]}', json={'category_id': response.json['id']})
+        self.assertEqual(response.status_code, 200, response.json)